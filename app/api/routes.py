@@ -2,9 +2,10 @@ import asyncio
 import hmac
 import mimetypes
 import os
-import tempfile
-from typing import Any, List, Optional
-from urllib.parse import quote
+from collections import deque
+from contextlib import AsyncExitStack
+from typing import Any, BinaryIO, List, Optional
+from urllib.parse import quote, unquote
 
 import httpx
 from fastapi import (
@@ -15,10 +16,11 @@ from fastapi import (
     Form,
     Header,
     HTTPException,
+    Query,
     Request,
     UploadFile,
 )
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from sse_starlette.sse import EventSourceResponse
 
@@ -26,15 +28,64 @@ from .. import database
 from ..core.config import Settings, get_active_password, get_settings
 from ..core.http_client import get_http_client
 from ..events import (
+    LAGGED,
+    RESET_MESSAGE,
+    coalesce_events,
     publish_file_update,
+    publish_files_deleted,
+    replay_file_updates,
     subscribe_file_updates,
     unsubscribe_file_updates,
 )
-from ..services.telegram_service import TelegramService, get_telegram_service
-from ..utils.file_paths import build_file_path, extract_file_id_from_value
+from ..services.blob_cache import BlobCache, get_blob_cache
+from ..services.download_fanout import DownloadFanout, get_download_fanout
+from ..services.telegram_service import (
+    CHUNK_SIZE_BYTES,
+    TelegramService,
+    get_telegram_service,
+)
+from ..services.upload_jobs import (
+    UploadJobManager,
+    UploadSessionConflict,
+    get_upload_job_manager,
+    serialize_upload_job,
+)
+from ..utils.cursors import (
+    InvalidCursor,
+    build_page_cursors,
+    decode_cursor,
+    decode_search_cursor,
+    encode_search_cursor,
+)
+from ..utils.file_paths import build_file_path, build_thumbnail_path, extract_file_id_from_value
+from ..utils.http_ranges import (
+    RangeNotSatisfiable,
+    build_validator_headers,
+    if_range_matches,
+    is_not_modified,
+    parse_content_range_total,
+    parse_range_header,
+    split_range_across_chunks,
+)
+from ..utils.media_types import MEDIA_KINDS
+from ..utils.readahead import ByteBoundedBuffer
 
 router = APIRouter()
 
+# 分块下载时在当前分块之外预读的分块数，以及单个请求预读缓冲的总上限。
+DEFAULT_DOWNLOAD_READAHEAD_CHUNKS = 2
+DEFAULT_DOWNLOAD_READAHEAD_MAX_BYTES = 32 * 1024 * 1024
+
+# 从表单文件中读取上传内容时每次读取的字节数。
+UPLOAD_READ_SIZE_BYTES = 1024 * 1024
+
+# 画廊缩略图默认需要的宽度；缩略图的 file_id 对应的内容不会变化，可以长期缓存。
+THUMBNAIL_DEFAULT_WIDTH = 320
+THUMBNAIL_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# 从本地下载缓存输出文件时每次读取的字节数。
+CACHED_FILE_READ_BYTES = 256 * 1024
+
 
 class PasswordRequest(BaseModel):
     password: str
@@ -86,9 +137,354 @@ def _serialize_file(file_info: dict[str, Any], settings: Settings) -> dict[str,
         "upload_date": file_info["upload_date"],
         "path": path,
         "url": url,
+        "thumbnail_path": build_thumbnail_path(file_info["file_id"]),
+    }
+
+
+def _build_single_file_headers(filename: str) -> dict[str, str]:
+    """根据文件名生成单文件下载的响应头，图片内联展示，其余作为附件。"""
+    image_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+    is_image = filename.lower().endswith(image_extensions)
+    content_type, _ = mimetypes.guess_type(filename)
+    if content_type is None:
+        content_type = "application/octet-stream"
+
+    filename_encoded = quote(str(filename), safe="")
+    disposition_type = "inline" if is_image else "attachment"
+    return {
+        "Content-Disposition": f"{disposition_type}; filename*=UTF-8''{filename_encoded}",
+        "Content-Type": content_type,
+    }
+
+
+def _estimate_chunk_sizes(chunk_count: int, total_size: int | None) -> list[int] | None:
+    """按上传时的固定分块大小推算每个分块的长度，数据对不上时返回 None。"""
+    if not chunk_count or not total_size:
+        return None
+
+    last_chunk_size = total_size - CHUNK_SIZE_BYTES * (chunk_count - 1)
+    if not 0 < last_chunk_size <= CHUNK_SIZE_BYTES:
+        return None
+    return [CHUNK_SIZE_BYTES] * (chunk_count - 1) + [last_chunk_size]
+
+
+def _build_chunked_response(
+    original_filename: str,
+    chunk_file_ids: list[str],
+    chunk_sizes: list[int] | None,
+    total_size: int | None,
+    range_header: str | None,
+    validator_headers: dict[str, str],
+    telegram_service: TelegramService,
+    client: httpx.AsyncClient,
+    settings: Settings,
+) -> StreamingResponse:
+    """按分块列表构造大文件响应；分块大小已知时支持 Range。"""
+    filename_encoded = quote(str(original_filename), safe="")
+    response_headers = {
+        "Content-Disposition": f"attachment; filename*=UTF-8''{filename_encoded}",
+        **validator_headers,
+    }
+
+    readahead_options = {
+        "readahead_chunks": settings.DOWNLOAD_READAHEAD_CHUNKS,
+        "readahead_max_bytes": settings.DOWNLOAD_READAHEAD_MAX_BYTES,
+    }
+    if chunk_sizes is None:
+        return StreamingResponse(
+            stream_chunks(chunk_file_ids, telegram_service, client, **readahead_options),
+            headers=response_headers,
+        )
+
+    response_headers["Accept-Ranges"] = "bytes"
+    byte_range = _resolve_byte_range(range_header, total_size)
+    if byte_range is None:
+        return StreamingResponse(
+            stream_chunks(chunk_file_ids, telegram_service, client, **readahead_options),
+            headers=response_headers,
+        )
+
+    start, end = byte_range
+    first_index, first_offset, last_index, last_end = split_range_across_chunks(
+        chunk_sizes,
+        start,
+        end,
+    )
+    return StreamingResponse(
+        stream_chunks(
+            chunk_file_ids[first_index:last_index + 1],
+            telegram_service,
+            client,
+            first_chunk_offset=first_offset,
+            last_chunk_end=last_end,
+            **readahead_options,
+        ),
+        status_code=206,
+        headers={**response_headers, **_build_content_range_headers(start, end, total_size)},
+    )
+
+
+def _build_cached_file_response(
+    cached: tuple[BinaryIO, int],
+    range_header: str | None,
+    headers: dict[str, str],
+) -> Response:
+    """
+    从已打开的缓存文件输出响应，支持 Range。文件描述符在查找缓存时就已打开，
+    即使文件随后被其他 worker 淘汰也能完整输出。
+    """
+    handle, total_size = cached
+    try:
+        byte_range = _resolve_byte_range(range_header, total_size)
+    except HTTPException:
+        handle.close()
+        raise
+    start, end = byte_range or (0, total_size - 1)
+
+    async def body():
+        try:
+            await asyncio.to_thread(handle.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(handle.read, min(CACHED_FILE_READ_BYTES, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            handle.close()
+
+    headers = {**headers, "Accept-Ranges": "bytes"}
+    if byte_range is None:
+        return StreamingResponse(body(), headers={**headers, "Content-Length": str(total_size)})
+    return StreamingResponse(
+        body(),
+        status_code=206,
+        headers={**headers, **_build_content_range_headers(start, end, total_size)},
+    )
+
+
+async def _iter_single_file_body(
+    resp: httpx.Response,
+    byte_range: tuple[int, int] | None,
+    blob_cache: BlobCache | None,
+    file_id: str,
+):
+    """输出单文件响应体；完整读取时顺带写入本地缓存。"""
+    if byte_range is not None:
+        async for chunk in _iter_requested_bytes(resp, byte_range[0], byte_range[1]):
+            yield chunk
+        return
+
+    cache_writer = None
+    if blob_cache is not None and resp.status_code == 200:
+        content_length = resp.headers.get("content-length")
+        cache_writer = await blob_cache.open_writer(
+            file_id,
+            int(content_length) if content_length and content_length.isdigit() else None,
+        )
+
+    completed = False
+    try:
+        async for chunk in resp.aiter_bytes():
+            if cache_writer is not None:
+                await cache_writer.write(chunk)
+            yield chunk
+        completed = True
+    finally:
+        if cache_writer is not None:
+            if completed:
+                await cache_writer.commit()
+            else:
+                await cache_writer.abort()
+
+
+async def _open_single_file_upstream(
+    real_file_id: str,
+    request_headers: dict[str, str],
+    telegram_service: TelegramService,
+    client: httpx.AsyncClient,
+) -> tuple[AsyncExitStack, httpx.Response]:
+    """打开单文件的上游响应，链接失效（4xx）时重新解析一次；调用方负责关闭返回的 AsyncExitStack。"""
+    upstream = AsyncExitStack()
+    try:
+        for attempt in range(2):
+            download_url = await telegram_service.get_download_url(real_file_id)
+            if not download_url:
+                raise HTTPException(status_code=404, detail="文件未找到或下载链接已过期。")
+            resp = await upstream.enter_async_context(
+                client.stream("GET", download_url, headers=request_headers)
+            )
+            if not _is_client_error(resp.status_code):
+                break
+            # 缓存的链接可能已失效，丢弃后重新解析一次。
+            telegram_service.invalidate_download_url(real_file_id)
+            if attempt == 0:
+                await upstream.aclose()
+        resp.raise_for_status()
+    except httpx.HTTPError as exc:
+        await upstream.aclose()
+        raise HTTPException(status_code=503, detail="无法从 Telegram 获取文件。") from exc
+    except BaseException:
+        await upstream.aclose()
+        raise
+    return upstream, resp
+
+
+async def _build_known_single_file_response(
+    file_id: str,
+    real_file_id: str,
+    filename: str,
+    total_size: int,
+    range_header: str | None,
+    validator_headers: dict[str, str],
+    telegram_service: TelegramService,
+    client: httpx.AsyncClient,
+    blob_cache: BlobCache | None,
+    download_fanout: DownloadFanout | None = None,
+) -> StreamingResponse:
+    """
+    数据库已确认是普通文件时，跳过清单探测，只向 CDN 发起一次请求。
+    先拿到上游响应再返回，链接失效（4xx）时还能重新解析一次链接并给出正确的状态码。
+    完整下载时同一文件的并发请求共用一次上游读取。
+    """
+    response_headers = {
+        **_build_single_file_headers(filename),
+        **validator_headers,
+        "Accept-Ranges": "bytes",
+    }
+    byte_range = _resolve_byte_range(range_header, total_size)
+    if byte_range is None and download_fanout is not None:
+        return await _build_fanout_file_response(
+            file_id,
+            real_file_id,
+            response_headers,
+            telegram_service,
+            client,
+            blob_cache,
+            download_fanout,
+        )
+
+    request_headers = {}
+    if byte_range is not None:
+        request_headers["Range"] = f"bytes={byte_range[0]}-{byte_range[1]}"
+    upstream, resp = await _open_single_file_upstream(real_file_id, request_headers, telegram_service, client)
+
+    async def known_file_streamer():
+        try:
+            async for chunk in _iter_single_file_body(resp, byte_range, blob_cache, file_id):
+                yield chunk
+        finally:
+            await upstream.aclose()
+
+    if byte_range is not None:
+        start, end = byte_range
+        return StreamingResponse(
+            known_file_streamer(),
+            status_code=206,
+            headers={**response_headers, **_build_content_range_headers(start, end, total_size)},
+        )
+    return StreamingResponse(known_file_streamer(), headers=response_headers)
+
+
+async def _build_fanout_file_response(
+    file_id: str,
+    real_file_id: str,
+    response_headers: dict[str, str],
+    telegram_service: TelegramService,
+    client: httpx.AsyncClient,
+    blob_cache: BlobCache | None,
+    download_fanout: DownloadFanout,
+) -> StreamingResponse:
+    """
+    第一个请求打开上游并发起分发，并发到达的请求订阅同一份数据。
+    发起方打开上游失败时，等待中的请求各自回源，以便返回正确的状态码。
+    """
+
+    async def resume(offset: int):
+        # 无法加入或因读取过慢被摘除的请求，从已输出的偏移自行回源。
+        request_headers = {"Range": f"bytes={offset}-"} if offset else {}
+        upstream, resp = await _open_single_file_upstream(real_file_id, request_headers, telegram_service, client)
+        async with upstream:
+            async for chunk in _iter_requested_bytes(resp, offset, None):
+                yield chunk
+
+    stream = download_fanout.get(file_id)
+    if stream is not None and await stream.wait_started():
+        return StreamingResponse(stream.subscribe(resume), headers=response_headers)
+
+    stream = download_fanout.create(file_id)
+    try:
+        upstream, resp = await _open_single_file_upstream(real_file_id, {}, telegram_service, client)
+    except BaseException:
+        stream.fail()
+        raise
+
+    async def upstream_body():
+        try:
+            async for chunk in _iter_single_file_body(resp, None, blob_cache, file_id):
+                yield chunk
+        finally:
+            await upstream.aclose()
+
+    # 先登记发起方自己的订阅再开始读取上游，大于补齐窗口的文件也不会让发起方另行回源。
+    body = stream.subscribe(resume)
+    stream.start(upstream_body())
+    return StreamingResponse(body, headers=response_headers)
+
+
+def _resolve_byte_range(range_header: str | None, total_size: int | None) -> tuple[int, int] | None:
+    """解析客户端 Range，超出范围时返回 416。"""
+    if not range_header or not total_size:
+        return None
+
+    try:
+        return parse_range_header(range_header, total_size)
+    except RangeNotSatisfiable as exc:
+        raise HTTPException(
+            status_code=416,
+            detail="请求的范围无效。",
+            headers={"Content-Range": f"bytes */{total_size}"},
+        ) from exc
+
+
+def _build_content_range_headers(start: int, end: int, total_size: int) -> dict[str, str]:
+    return {
+        "Content-Range": f"bytes {start}-{end}/{total_size}",
+        "Content-Length": str(end - start + 1),
     }
 
 
+async def _iter_requested_bytes(response: httpx.Response, start: int, end: int | None):
+    """
+    输出响应中 [start, end] 区间的字节。
+    CDN 已按 Range 返回 206 时直接透传，忽略 Range 返回 200 时在本地裁剪。
+    """
+    if response.status_code == 206 or (start == 0 and end is None):
+        async for chunk in response.aiter_bytes():
+            yield chunk
+        return
+
+    position = 0
+    async for chunk in response.aiter_bytes():
+        chunk_start = position
+        position += len(chunk)
+        if position <= start:
+            continue
+
+        piece = chunk[max(start - chunk_start, 0):]
+        if end is not None and position > end + 1:
+            piece = piece[:len(piece) - (position - end - 1)]
+            if piece:
+                yield piece
+            return
+        yield piece
+
+
+def _is_client_error(status_code: int) -> bool:
+    return 400 <= status_code < 500
+
+
 def _extract_delete_targets(payload: Any, settings: Settings) -> list[str]:
     """尽量从不同格式的 PicList 请求体中提取 file_id。"""
     collected: list[str] = []
@@ -129,56 +525,50 @@ def _extract_delete_targets(payload: Any, settings: Settings) -> list[str]:
     return deduplicated
 
 
-async def _delete_file_and_sync(
-    file_id: str,
-    telegram_service: TelegramService,
-) -> dict[str, Any]:
-    """删除 Telegram 主消息后，同步清理数据库并广播删除事件。"""
-    delete_result = await telegram_service.delete_file_with_chunks(file_id)
-    delete_result["file_id"] = file_id
+def _is_delete_synced(delete_result: dict[str, Any]) -> bool:
+    """主消息已删除或在 Telegram 中已不存在时，数据库与前端都应同步移除该文件。"""
     error_text = " ".join(
         str(value)
         for value in (delete_result.get("reason"), delete_result.get("error"))
         if value
     ).lower()
-    is_not_found_error = "not found" in error_text
-    main_message_deleted = bool(delete_result.get("main_message_deleted"))
-
-    if main_message_deleted or is_not_found_error:
-        was_deleted_from_db = await asyncio.to_thread(database.delete_file_metadata, file_id)
-        if is_not_found_error:
-            delete_result["db_status"] = "deleted_after_not_found"
-            delete_result["status"] = "success"
-        elif was_deleted_from_db:
-            delete_result["db_status"] = "deleted"
-        else:
-            delete_result["db_status"] = "not_found_in_db"
+    return bool(delete_result.get("main_message_deleted")) or "not found" in error_text
 
-        await publish_file_update(
-            {
-                "action": "delete",
-                "file_id": file_id,
-            }
+
+def _build_delete_success(
+    file_id: str,
+    delete_result: dict[str, Any],
+    was_deleted_from_db: bool,
+) -> dict[str, Any]:
+    is_not_found_error = not delete_result.get("main_message_deleted")
+    if is_not_found_error:
+        delete_result["db_status"] = "deleted_after_not_found"
+        delete_result["status"] = "success"
+    elif was_deleted_from_db:
+        delete_result["db_status"] = "deleted"
+    else:
+        delete_result["db_status"] = "not_found_in_db"
+
+    message = f"文件 {file_id} 已删除。"
+    if delete_result.get("status") == "partial_failure":
+        message = (
+            f"文件 {file_id} 已从前端列表移除，"
+            f"但仍有 {len(delete_result.get('failed_chunks', []))} 个分块删除失败。"
         )
+    elif is_not_found_error:
+        message = f"文件 {file_id} 在 Telegram 中未找到，已按删除状态完成同步。"
 
-        message = f"文件 {file_id} 已删除。"
-        if delete_result.get("status") == "partial_failure":
-            message = (
-                f"文件 {file_id} 已从前端列表移除，"
-                f"但仍有 {len(delete_result.get('failed_chunks', []))} 个分块删除失败。"
-            )
-        elif is_not_found_error:
-            message = f"文件 {file_id} 在 Telegram 中未找到，已按删除状态完成同步。"
+    return {
+        "status": "ok",
+        "file_id": file_id,
+        "message": message,
+        "details": delete_result,
+    }
 
-        return {
-            "status": "ok",
-            "file_id": file_id,
-            "message": message,
-            "details": delete_result,
-        }
 
+def _build_delete_failure(file_id: str, delete_result: dict[str, Any]) -> HTTPException:
     if delete_result.get("status") == "partial_failure":
-        raise HTTPException(
+        return HTTPException(
             status_code=500,
             detail={
                 "file_id": file_id,
@@ -187,7 +577,7 @@ async def _delete_file_and_sync(
             },
         )
 
-    raise HTTPException(
+    return HTTPException(
         status_code=400,
         detail={
             "file_id": file_id,
@@ -197,42 +587,73 @@ async def _delete_file_and_sync(
     )
 
 
-@router.post("/api/upload")
-async def upload_file(
-    request: Request,
-    file: UploadFile = File(...),
-    key: Optional[str] = Form(None),
-    settings: Settings = Depends(get_settings),
-    telegram_service: TelegramService = Depends(get_telegram_service),
-    x_api_key: Optional[str] = Header(None),
-):
-    """处理网页与 PicList 的上传请求。"""
-    submitted_key = x_api_key or key
-    _ensure_request_authorized(request, settings, submitted_key)
+async def _delete_files_and_sync(
+    file_ids: list[str],
+    telegram_service: TelegramService,
+) -> tuple[list[dict[str, Any]], list[HTTPException]]:
+    """
+    批量删除 Telegram 消息后，在一个事务中清理数据库，并合并广播一次删除事件。
+    返回 (成功结果列表, 失败异常列表)。
+    """
+    unique_ids = list(dict.fromkeys(file_ids))
+    delete_results = await telegram_service.delete_files_with_chunks(unique_ids)
+
+    synced_file_ids: list[str] = []
+    failed: list[HTTPException] = []
+    for file_id in unique_ids:
+        delete_result = delete_results[file_id]
+        delete_result["file_id"] = file_id
+        if _is_delete_synced(delete_result):
+            synced_file_ids.append(file_id)
+        else:
+            failed.append(_build_delete_failure(file_id, delete_result))
 
-    temp_file_path = None
-    try:
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            temp_file_path = temp_file.name
-            while chunk := await file.read(1024 * 1024):
-                temp_file.write(chunk)
+    deleted_from_db = set(
+        await asyncio.to_thread(database.delete_files_metadata, synced_file_ids)
+    )
+    blob_cache = get_blob_cache()
+    if blob_cache is not None:
+        for file_id in synced_file_ids:
+            await blob_cache.discard(file_id)
+    await publish_files_deleted(synced_file_ids)
 
-        upload_filename = file.filename or "upload"
-        file_id = await telegram_service.upload_file(temp_file_path, upload_filename)
-    finally:
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
+    deleted = [
+        _build_delete_success(file_id, delete_results[file_id], file_id in deleted_from_db)
+        for file_id in synced_file_ids
+    ]
+    return deleted, failed
+
+
+async def _delete_file_and_sync(
+    file_id: str,
+    telegram_service: TelegramService,
+) -> dict[str, Any]:
+    """删除 Telegram 主消息后，同步清理数据库并广播删除事件。"""
+    deleted, failed = await _delete_files_and_sync([file_id], telegram_service)
+    if failed:
+        raise failed[0]
+    return deleted[0]
 
+
+async def _build_upload_response(
+    file_id: str | None,
+    upload_filename: str,
+    settings: Settings,
+    *,
+    publish_event: bool = True,
+) -> dict[str, Any]:
+    """广播新增文件事件，并生成网页与 PicList 共用的上传结果。"""
     if not file_id:
         raise HTTPException(status_code=500, detail="文件上传失败。")
 
     file_info = await asyncio.to_thread(database.get_file_info, file_id)
     if file_info:
         serialized_file = _serialize_file(file_info, settings)
-        await publish_file_update({
-            "action": "add",
-            **serialized_file,
-        })
+        if publish_event:
+            await publish_file_update({
+                "action": "add",
+                **serialized_file,
+            })
     else:
         serialized_file = {
             "path": build_file_path(file_id, upload_filename, settings.FILE_ROUTE),
@@ -257,28 +678,374 @@ async def upload_file(
     }
 
 
+async def _iter_upload_file(file: UploadFile):
+    while chunk := await file.read(UPLOAD_READ_SIZE_BYTES):
+        yield chunk
+
+
+@router.post("/api/upload")
+async def upload_file(
+    request: Request,
+    file: UploadFile = File(...),
+    key: Optional[str] = Form(None),
+    settings: Settings = Depends(get_settings),
+    telegram_service: TelegramService = Depends(get_telegram_service),
+    x_api_key: Optional[str] = Header(None),
+):
+    """处理网页与 PicList 的上传请求。"""
+    submitted_key = x_api_key or key
+    _ensure_request_authorized(request, settings, submitted_key)
+
+    # 直接从表单解析得到的文件对象切分上传，不再额外复制到临时文件。
+    upload_filename = file.filename or "upload"
+    file_id = await telegram_service.upload_stream(
+        _iter_upload_file(file),
+        upload_filename,
+        total_size=file.size,
+    )
+    return await _build_upload_response(file_id, upload_filename, settings)
+
+
+@router.post("/api/upload/stream")
+async def upload_file_stream(
+    request: Request,
+    filename: Optional[str] = None,
+    key: Optional[str] = None,
+    settings: Settings = Depends(get_settings),
+    telegram_service: TelegramService = Depends(get_telegram_service),
+    x_api_key: Optional[str] = Header(None),
+    x_file_name: Optional[str] = Header(None),
+    content_length: Optional[int] = Header(None),
+):
+    """
+    以原始请求体上传单个文件，边接收边按分块发送到 Telegram。
+    文件名通过 `filename` 查询参数或 URL 编码的 `X-File-Name` 请求头传入。
+    """
+    _ensure_request_authorized(request, settings, x_api_key or key)
+
+    upload_filename = filename or (unquote(x_file_name) if x_file_name else "upload")
+    file_id = await telegram_service.upload_stream(
+        request.stream(),
+        upload_filename,
+        total_size=content_length,
+    )
+    return await _build_upload_response(file_id, upload_filename, settings)
+
+
+# SSE 推送时收集同一波事件的等待时间与单次合并的最大事件数。
+SSE_COALESCE_WINDOW_SECONDS = 0.05
+SSE_COALESCE_MAX_EVENTS = 500
+
+# 请求体写入暂存文件时，攒够这么多字节再交给线程写盘。
+SPOOL_WRITE_BUFFER_BYTES = 1024 * 1024
+
+
+async def _spool_request_body(chunks, spool_path: str) -> int:
+    """把请求体写入暂存文件，返回写入的总字节数。"""
+    written = 0
+    buffer = bytearray()
+    with open(spool_path, "wb") as spool_file:
+        async for chunk in chunks:
+            buffer += chunk
+            if len(buffer) >= SPOOL_WRITE_BUFFER_BYTES:
+                await asyncio.to_thread(spool_file.write, bytes(buffer))
+                written += len(buffer)
+                buffer.clear()
+        if buffer:
+            await asyncio.to_thread(spool_file.write, bytes(buffer))
+            written += len(buffer)
+    return written
+
+
+def _remove_spool_file(spool_path: str) -> None:
+    try:
+        os.remove(spool_path)
+    except FileNotFoundError:
+        pass
+
+
+async def _get_upload_job_or_404(job_id: str) -> dict[str, Any]:
+    job = await asyncio.to_thread(database.get_upload_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="上传任务不存在。")
+    return job
+
+
+@router.post("/api/upload/jobs", status_code=202)
+async def create_upload_job(
+    request: Request,
+    filename: Optional[str] = None,
+    key: Optional[str] = None,
+    settings: Settings = Depends(get_settings),
+    upload_job_manager: UploadJobManager = Depends(get_upload_job_manager),
+    x_api_key: Optional[str] = Header(None),
+    x_file_name: Optional[str] = Header(None),
+    content_length: Optional[int] = Header(None),
+):
+    """
+    以原始请求体创建后台上传任务。请求体完整落地后立即返回任务 ID，
+    发送到 Telegram 的过程在后台进行，可通过 /api/jobs/{job_id} 或 SSE 查看进度。
+    """
+    _ensure_request_authorized(request, settings, x_api_key or key)
+
+    upload_filename = filename or (unquote(x_file_name) if x_file_name else "upload")
+    job_id, spool_path = upload_job_manager.new_spool_path()
+    try:
+        total_size = await _spool_request_body(request.stream(), spool_path)
+    except BaseException:
+        _remove_spool_file(spool_path)
+        raise
+
+    if total_size == 0 or (content_length is not None and total_size != content_length):
+        _remove_spool_file(spool_path)
+        raise HTTPException(status_code=400, detail="上传数据为空或不完整。")
+
+    job = await upload_job_manager.submit(job_id, upload_filename, spool_path, total_size)
+    return JSONResponse(
+        status_code=202,
+        content={
+            **serialize_upload_job(job),
+            "status_url": f"{settings.BASE_URL.strip('/')}/api/jobs/{job_id}",
+        },
+    )
+
+
+@router.get("/api/jobs/{job_id}")
+async def get_upload_job(
+    job_id: str,
+    request: Request,
+    key: Optional[str] = None,
+    settings: Settings = Depends(get_settings),
+    x_api_key: Optional[str] = Header(None),
+):
+    """查询后台上传任务的状态与进度。"""
+    _ensure_request_authorized(request, settings, x_api_key or key)
+
+    job = await _get_upload_job_or_404(job_id)
+    result = serialize_upload_job(job)
+    if job["file_id"]:
+        path = build_file_path(job["file_id"], job["filename"], settings.FILE_ROUTE)
+        result["path"] = path
+        result["url"] = f"{settings.BASE_URL.strip('/')}{path}"
+    return result
+
+
+def _serialize_upload_session(job: dict[str, Any], offset: int, settings: Settings) -> dict[str, Any]:
+    return {
+        **serialize_upload_job(job),
+        "session_id": job["id"],
+        "offset": offset,
+        "part_size": CHUNK_SIZE_BYTES,
+        "session_url": f"{settings.BASE_URL.strip('/')}/api/upload/sessions/{job['id']}",
+    }
+
+
+def _upload_session_conflict_response(exc: UploadSessionConflict) -> JSONResponse:
+    return JSONResponse(
+        status_code=409,
+        content={"detail": str(exc), "offset": exc.offset},
+        headers={"Upload-Offset": str(exc.offset)},
+    )
+
+
+@router.post("/api/upload/sessions", status_code=201)
+async def create_upload_session(
+    request: Request,
+    filename: Optional[str] = None,
+    size: Optional[int] = None,
+    key: Optional[str] = None,
+    settings: Settings = Depends(get_settings),
+    upload_job_manager: UploadJobManager = Depends(get_upload_job_manager),
+    x_api_key: Optional[str] = Header(None),
+    x_file_name: Optional[str] = Header(None),
+    upload_length: Optional[int] = Header(None),
+):
+    """
+    创建可续传上传会话。文件总大小通过 `size` 查询参数或 `Upload-Length` 请求头传入，
+    之后用 PATCH 按偏移追加数据，收齐后调用 finalize。
+    """
+    _ensure_request_authorized(request, settings, x_api_key or key)
+
+    total_size = size if size is not None else upload_length
+    if not total_size or total_size <= 0:
+        raise HTTPException(status_code=400, detail="需要提供文件总大小。")
+
+    upload_filename = filename or (unquote(x_file_name) if x_file_name else "upload")
+    job = await upload_job_manager.create_session(upload_filename, total_size)
+    return JSONResponse(status_code=201, content=_serialize_upload_session(job, 0, settings))
+
+
+@router.get("/api/upload/sessions/{session_id}")
+async def get_upload_session(
+    session_id: str,
+    request: Request,
+    key: Optional[str] = None,
+    settings: Settings = Depends(get_settings),
+    upload_job_manager: UploadJobManager = Depends(get_upload_job_manager),
+    x_api_key: Optional[str] = Header(None),
+):
+    """查询上传会话已接收的偏移，客户端断线重连后据此继续发送。"""
+    _ensure_request_authorized(request, settings, x_api_key or key)
+
+    job = await _get_upload_job_or_404(session_id)
+    offset = upload_job_manager.get_session_offset(job) if job["status"] == "receiving" else job["total_size"]
+    return JSONResponse(
+        content=_serialize_upload_session(job, offset, settings),
+        headers={"Upload-Offset": str(offset), "Cache-Control": "no-store"},
+    )
+
+
+@router.patch("/api/upload/sessions/{session_id}")
+async def append_upload_session(
+    session_id: str,
+    request: Request,
+    key: Optional[str] = None,
+    settings: Settings = Depends(get_settings),
+    upload_job_manager: UploadJobManager = Depends(get_upload_job_manager),
+    x_api_key: Optional[str] = Header(None),
+    upload_offset: int = Header(...),
+):
+    """
+    从 `Upload-Offset` 处追加一段数据。偏移与服务端不一致时返回 409 与当前偏移，
+    每收齐一个完整分块就在后台转发到 Telegram。
+    """
+    _ensure_request_authorized(request, settings, x_api_key or key)
+
+    job = await _get_upload_job_or_404(session_id)
+    try:
+        offset = await upload_job_manager.append_session_data(job, upload_offset, request.stream())
+    except UploadSessionConflict as exc:
+        return _upload_session_conflict_response(exc)
+
+    return JSONResponse(content={"offset": offset}, headers={"Upload-Offset": str(offset)})
+
+
+@router.post("/api/upload/sessions/{session_id}/finalize")
+async def finalize_upload_session(
+    session_id: str,
+    request: Request,
+    key: Optional[str] = None,
+    settings: Settings = Depends(get_settings),
+    upload_job_manager: UploadJobManager = Depends(get_upload_job_manager),
+    x_api_key: Optional[str] = Header(None),
+):
+    """
+    结束上传会话，发送剩余分块与清单，完成后返回与 `/api/upload` 相同的结果。
+    重复调用是安全的；任务仍在进行时返回 202 与当前状态。
+    """
+    _ensure_request_authorized(request, settings, x_api_key or key)
+
+    job = await _get_upload_job_or_404(session_id)
+    try:
+        job = await upload_job_manager.finalize_session(job)
+    except UploadSessionConflict as exc:
+        return _upload_session_conflict_response(exc)
+
+    if job["status"] == "done":
+        # 新增文件事件已由后台任务广播。
+        return await _build_upload_response(job["file_id"], job["filename"], settings, publish_event=False)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job["error"] or "文件上传失败。")
+    return JSONResponse(status_code=202, content=serialize_upload_job(job))
+
+
 @router.get("/d/{file_id}/{filename}")
 async def download_file(
     file_id: str,
     filename: str,
+    request: Request,
     telegram_service: TelegramService = Depends(get_telegram_service),
     client: httpx.AsyncClient = Depends(get_http_client),
+    blob_cache: BlobCache | None = Depends(get_blob_cache),
+    settings: Settings = Depends(get_settings),
+    download_fanout: DownloadFanout | None = Depends(get_download_fanout),
 ):
-    """处理单文件与清单文件的下载。"""
+    """处理单文件与清单文件的下载，支持 Range 与条件请求。"""
     try:
         _, real_file_id = file_id.split(':', 1)
     except ValueError:
         real_file_id = file_id
 
+    file_info = await asyncio.to_thread(database.get_file_info, file_id)
+    if file_info:
+        database.record_file_access(file_id)
+    elif not await telegram_service.get_download_url(real_file_id):
+        # 数据库中没有记录时先确认文件仍然存在，不存在的文件返回 404 而不是 304。
+        raise HTTPException(status_code=404, detail="文件未找到或下载链接已过期。")
+
+    validator_headers = build_validator_headers(
+        file_id,
+        file_info["upload_date"] if file_info else None,
+    )
+    if is_not_modified(request.headers, validator_headers):
+        return Response(status_code=304, headers=validator_headers)
+
+    range_header = request.headers.get("range")
+    if not if_range_matches(request.headers.get("if-range"), validator_headers):
+        range_header = None
+
+    if blob_cache is not None:
+        cached = await blob_cache.open_blob(file_id)
+        if cached:
+            return _build_cached_file_response(
+                cached,
+                range_header,
+                {**_build_single_file_headers(filename), **validator_headers},
+            )
+
+    if file_info:
+        # 已建立分块索引的大文件直接按索引下载分块，省去探测与读取清单的请求。
+        chunks = await asyncio.to_thread(database.get_file_chunks, file_id)
+        if chunks:
+            chunk_sizes = [chunk["chunk_size"] for chunk in chunks]
+            if None in chunk_sizes or sum(chunk_sizes) != file_info["filesize"]:
+                chunk_sizes = _estimate_chunk_sizes(len(chunks), file_info["filesize"])
+            return _build_chunked_response(
+                file_info["filename"],
+                [chunk["chunk_file_id"] for chunk in chunks],
+                chunk_sizes,
+                file_info["filesize"],
+                range_header,
+                validator_headers,
+                telegram_service,
+                client,
+                settings,
+            )
+
+    if file_info and file_info["is_manifest"] == 0:
+        return await _build_known_single_file_response(
+            file_id,
+            real_file_id,
+            filename,
+            file_info["filesize"],
+            range_header,
+            validator_headers,
+            telegram_service,
+            client,
+            blob_cache,
+            download_fanout,
+        )
+
+    # 旧记录不知道是否为清单，先探测文件开头，结果写回数据库供下次直接判断。
     download_url = await telegram_service.get_download_url(real_file_id)
     if not download_url:
         raise HTTPException(status_code=404, detail="文件未找到或下载链接已过期。")
 
     try:
         head_resp = await client.get(download_url, headers={"Range": "bytes=0-127"})
+        if _is_client_error(head_resp.status_code):
+            # 缓存的链接可能已失效，丢弃后重新解析一次。
+            telegram_service.invalidate_download_url(real_file_id)
+            download_url = await telegram_service.get_download_url(real_file_id)
+            if not download_url:
+                raise HTTPException(status_code=404, detail="文件未找到或下载链接已过期。")
+            head_resp = await client.get(download_url, headers={"Range": "bytes=0-127"})
         head_resp.raise_for_status()
         first_bytes = head_resp.content
-        if first_bytes.startswith(b'tgstate-blob\n'):
+        is_manifest = first_bytes.startswith(b'tgstate-blob\n')
+        if file_info and file_info["is_manifest"] is None:
+            await asyncio.to_thread(database.set_file_is_manifest, file_id, is_manifest)
+        if is_manifest:
             if head_resp.status_code == 206:
                 manifest_resp = await client.get(download_url)
                 manifest_resp.raise_for_status()
@@ -299,51 +1066,207 @@ async def download_file(
         if len(lines) < 2:
             raise HTTPException(status_code=502, detail="文件清单格式无效。")
 
-        original_filename = lines[1]
         chunk_file_ids = lines[2:]
-        filename_encoded = quote(str(original_filename), safe="")
-        response_headers = {
-            "Content-Disposition": f"attachment; filename*=UTF-8''{filename_encoded}"
-        }
-        return StreamingResponse(
-            stream_chunks(chunk_file_ids, telegram_service, client),
-            headers=response_headers,
+        total_size = file_info["filesize"] if file_info else None
+        chunk_sizes = _estimate_chunk_sizes(len(chunk_file_ids), total_size)
+        if file_info:
+            # 旧记录读取过一次清单后补写分块索引，之后的下载与删除不再访问清单。
+            await asyncio.to_thread(
+                database.save_file_chunks,
+                file_id,
+                list(zip(chunk_file_ids, chunk_sizes or [None] * len(chunk_file_ids))),
+            )
+        return _build_chunked_response(
+            lines[1],
+            chunk_file_ids,
+            chunk_sizes,
+            total_size,
+            range_header,
+            validator_headers,
+            telegram_service,
+            client,
+            settings,
         )
 
-    image_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
-    is_image = filename.lower().endswith(image_extensions)
-    content_type, _ = mimetypes.guess_type(filename)
-    if content_type is None:
-        content_type = "application/octet-stream"
-
-    filename_encoded = quote(str(filename), safe="")
-    disposition_type = "inline" if is_image else "attachment"
     response_headers = {
-        "Content-Disposition": f"{disposition_type}; filename*=UTF-8''{filename_encoded}",
-        "Content-Type": content_type,
+        **_build_single_file_headers(filename),
+        **validator_headers,
+        "Accept-Ranges": "bytes",
     }
+    total_size = parse_content_range_total(head_resp.headers.get("content-range"))
+    if head_resp.status_code == 200:
+        total_size = len(first_bytes)
+    elif total_size is None and file_info:
+        total_size = file_info["filesize"]
+    byte_range = _resolve_byte_range(range_header, total_size)
+
+    if total_size == len(first_bytes):
+        # 探测请求已经拿到了完整内容，无需再次请求 CDN。
+        if blob_cache is not None:
+            await blob_cache.store(file_id, first_bytes)
+
+        if byte_range is not None:
+            start, end = byte_range
+            return Response(
+                content=first_bytes[start:end + 1],
+                status_code=206,
+                headers={**response_headers, **_build_content_range_headers(start, end, total_size)},
+            )
 
-    if manifest_content is None and len(first_bytes) > 128:
         async def buffered_streamer():
             yield first_bytes
 
         return StreamingResponse(buffered_streamer(), headers=response_headers)
 
     async def single_file_streamer():
-        async with client.stream("GET", download_url) as resp:
+        request_headers = {}
+        if byte_range is not None:
+            request_headers["Range"] = f"bytes={byte_range[0]}-{byte_range[1]}"
+
+        async with client.stream("GET", download_url, headers=request_headers) as resp:
+            if _is_client_error(resp.status_code):
+                telegram_service.invalidate_download_url(real_file_id)
             resp.raise_for_status()
-            async for chunk in resp.aiter_bytes():
+            async for chunk in _iter_single_file_body(resp, byte_range, blob_cache, file_id):
                 yield chunk
 
+    if byte_range is not None:
+        start, end = byte_range
+        return StreamingResponse(
+            single_file_streamer(),
+            status_code=206,
+            headers={**response_headers, **_build_content_range_headers(start, end, total_size)},
+        )
     return StreamingResponse(single_file_streamer(), headers=response_headers)
 
 
+@router.get("/t/{file_id}")
+async def get_thumbnail(
+    file_id: str,
+    request: Request,
+    w: int = Query(THUMBNAIL_DEFAULT_WIDTH, ge=1, le=4096),
+    telegram_service: TelegramService = Depends(get_telegram_service),
+    client: httpx.AsyncClient = Depends(get_http_client),
+    blob_cache: BlobCache | None = Depends(get_blob_cache),
+    settings: Settings = Depends(get_settings),
+):
+    """
+    返回图片的缩略图，优先选择宽度不小于 w 的最小尺寸。
+    没有保存缩略图的文件（旧记录、同步导入的文件）重定向到原文件。
+    """
+    thumbnail = await asyncio.to_thread(database.get_file_thumbnail, file_id, w)
+    if not thumbnail:
+        file_info = await asyncio.to_thread(database.get_file_info, file_id)
+        if not file_info:
+            raise HTTPException(status_code=404, detail="文件未找到。")
+        return RedirectResponse(
+            url=build_file_path(file_id, file_info["filename"], settings.FILE_ROUTE),
+            status_code=307,
+        )
+
+    thumb_file_id = thumbnail["thumb_file_id"]
+    headers = {
+        "Cache-Control": THUMBNAIL_CACHE_CONTROL,
+        "ETag": f'"{quote(thumb_file_id, safe="")}"',
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    cache_key = f"thumb:{thumb_file_id}"
+    if blob_cache is not None:
+        cached = await blob_cache.open_blob(cache_key)
+        if cached:
+            return _build_cached_file_response(cached, None, {**headers, "Content-Type": "image/jpeg"})
+
+    download_url = await telegram_service.get_download_url(thumb_file_id)
+    if not download_url:
+        raise HTTPException(status_code=404, detail="缩略图未找到或下载链接已过期。")
+    try:
+        resp = await client.get(download_url)
+        if _is_client_error(resp.status_code):
+            # 缓存的链接可能已失效，丢弃后重新解析一次。
+            telegram_service.invalidate_download_url(thumb_file_id)
+            download_url = await telegram_service.get_download_url(thumb_file_id)
+            if not download_url:
+                raise HTTPException(status_code=404, detail="缩略图未找到或下载链接已过期。")
+            resp = await client.get(download_url)
+        resp.raise_for_status()
+    except httpx.HTTPError as exc:
+        raise HTTPException(status_code=503, detail="无法从 Telegram 获取缩略图。") from exc
+
+    if blob_cache is not None:
+        await blob_cache.store(cache_key, resp.content)
+    return Response(content=resp.content, media_type="image/jpeg", headers=headers)
+
+
+def _parse_last_event_id(value: str | None) -> int | None:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+async def _collect_file_updates(
+    subscriber_queue: asyncio.Queue,
+    first_event: tuple[int, str],
+    last_event_id: int,
+) -> list[tuple[int, str]]:
+    """
+    收到第一条事件后再稍等片刻，收集同一波的后续事件。
+    遇到队列溢出标记时从 last_event_id 重放，已推送过的事件按 ID 过滤掉。
+    """
+    events = [first_event]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SSE_COALESCE_WINDOW_SECONDS
+    while len(events) < SSE_COALESCE_MAX_EVENTS:
+        try:
+            events.append(subscriber_queue.get_nowait())
+            continue
+        except asyncio.QueueEmpty:
+            pass
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            events.append(await asyncio.wait_for(subscriber_queue.get(), timeout=remaining))
+        except asyncio.TimeoutError:
+            break
+
+    pending: list[tuple[int, str]] = []
+    for event in events:
+        if event is LAGGED:
+            replayed = await replay_file_updates(last_event_id)
+            if replayed is None:
+                return [(last_event_id, RESET_MESSAGE)]
+            pending.extend(replayed)
+        else:
+            pending.append(event)
+
+    unique_events: dict[int, str] = {}
+    for event_id, message in pending:
+        if event_id > last_event_id or message == RESET_MESSAGE:
+            unique_events.setdefault(event_id, message)
+    return sorted(unique_events.items())
+
+
 @router.get("/api/file-updates")
-async def file_updates(request: Request):
-    """向所有前端页面广播文件新增和删除事件。"""
-    subscriber_queue = await subscribe_file_updates()
+async def file_updates(
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    last_event_id_param: Optional[str] = Query(None, alias="last_event_id"),
+):
+    """
+    向所有前端页面广播文件新增和删除事件。
+
+    每条事件带有单调递增的 ID。重连时通过 `Last-Event-ID` 请求头（或 `last_event_id`
+    查询参数）补发错过的事件，无法补齐时推送 reset；同一波的多条事件合并为一条 batch 事件。
+    """
+    subscriber_queue, start_event_id = await subscribe_file_updates(
+        _parse_last_event_id(last_event_id or last_event_id_param)
+    )
 
     async def event_generator():
+        sent_event_id = start_event_id
         try:
             while True:
                 if await request.is_disconnected():
@@ -351,12 +1274,17 @@ async def file_updates(request: Request):
                     break
 
                 try:
-                    update_json = await asyncio.wait_for(subscriber_queue.get(), timeout=30)
-                    yield {"data": update_json}
+                    first_event = await asyncio.wait_for(subscriber_queue.get(), timeout=30)
+                    events = await _collect_file_updates(subscriber_queue, first_event, sent_event_id)
                 except asyncio.TimeoutError:
                     continue
                 except Exception as exc:
                     print(f"推送事件时出错: {exc}")
+                    continue
+
+                for event_id, update_json in coalesce_events(events):
+                    sent_event_id = max(sent_event_id, event_id)
+                    yield {"id": str(event_id), "data": update_json}
         finally:
             await unsubscribe_file_updates(subscriber_queue)
 
@@ -367,20 +1295,123 @@ async def file_updates(request: Request):
 async def get_files_list(
     page: int = 1,
     page_size: int = 50,
+    cursor: Optional[str] = None,
+    before: Optional[str] = None,
+    kind: Optional[str] = None,
+    images_only: bool = False,
     settings: Settings = Depends(get_settings),
 ):
-    """分页读取数据库文件列表。"""
+    """
+    分页读取数据库文件列表，`kind` 可按类别（image、video、archive 等）过滤。
+    默认使用 (upload_date, id) 键集分页：`cursor` 取下一页，`before` 取上一页；
+    不带游标且 page 大于 1 时仍按页码分页，兼容旧的调用方式。
+    """
     page = max(page, 1)
     page_size = min(max(page_size, 1), 100)
-    files, total = await asyncio.gather(
-        asyncio.to_thread(database.get_files_page, page_size, (page - 1) * page_size),
-        asyncio.to_thread(database.count_files),
-    )
+    media_kind = "image" if images_only else kind
+    if media_kind is not None and media_kind not in MEDIA_KINDS:
+        raise HTTPException(status_code=400, detail="未知的文件类别。")
+    try:
+        after_key = decode_cursor(cursor) if cursor else None
+        before_key = decode_cursor(before) if before else None
+    except InvalidCursor as exc:
+        raise HTTPException(status_code=400, detail="无效的分页游标。") from exc
+
+    total_task = asyncio.to_thread(database.count_files, media_kind=media_kind)
+    if after_key is None and before_key is None and page > 1:
+        offset = (page - 1) * page_size
+        files, total = await asyncio.gather(
+            asyncio.to_thread(database.get_files_page, page_size, offset, media_kind=media_kind),
+            total_task,
+        )
+        next_cursor, prev_cursor = build_page_cursors(
+            files,
+            has_older=offset + len(files) < total,
+            has_newer=True,
+        )
+    else:
+        (files, has_older, has_newer), total = await asyncio.gather(
+            asyncio.to_thread(
+                database.get_files_page_by_cursor,
+                page_size,
+                after=after_key,
+                before=before_key,
+                media_kind=media_kind,
+            ),
+            total_task,
+        )
+        next_cursor, prev_cursor = build_page_cursors(
+            files,
+            has_older=has_older,
+            has_newer=has_newer,
+        )
+        if after_key is not None or before_key is not None:
+            page = None
+
     return {
         "items": [_serialize_file(file_info, settings) for file_info in files],
         "page": page,
         "page_size": page_size,
         "total": total,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+    }
+
+
+@router.get("/api/files/search")
+async def search_files(
+    q: str,
+    page_size: int = 50,
+    cursor: Optional[str] = None,
+    kind: Optional[str] = None,
+    settings: Settings = Depends(get_settings),
+):
+    """按文件名全文搜索，支持中日韩文件名与子串匹配，使用 `next_cursor` 翻页。"""
+    page_size = min(max(page_size, 1), 100)
+    if kind is not None and kind not in MEDIA_KINDS:
+        raise HTTPException(status_code=400, detail="未知的文件类别。")
+
+    try:
+        after_key = decode_search_cursor(cursor) if cursor else None
+        files, has_more = await asyncio.to_thread(
+            database.search_files,
+            q,
+            page_size,
+            after=after_key,
+            media_kind=kind,
+        )
+    except InvalidCursor as exc:
+        raise HTTPException(status_code=400, detail="无效的分页游标。") from exc
+
+    next_cursor = None
+    if has_more and files:
+        next_cursor = encode_search_cursor(files[-1]["sort_key"], files[-1]["id"])
+    return {
+        "items": [_serialize_file(file_info, settings) for file_info in files],
+        "query": q,
+        "page_size": page_size,
+        "next_cursor": next_cursor,
+    }
+
+
+@router.get("/api/stats")
+async def get_stats(
+    request: Request,
+    key: Optional[str] = None,
+    settings: Settings = Depends(get_settings),
+    telegram_service: TelegramService = Depends(get_telegram_service),
+    download_fanout: DownloadFanout | None = Depends(get_download_fanout),
+    x_api_key: Optional[str] = Header(None),
+):
+    """返回文件库统计与运行期统计信息，例如下载链接缓存的命中情况。"""
+    _ensure_request_authorized(request, settings, x_api_key or key)
+    blob_cache = get_blob_cache()
+    return {
+        "files": await asyncio.to_thread(database.get_file_stats),
+        "download_url_cache": telegram_service.download_url_cache.stats(),
+        "http_transport": telegram_service.http_transport.stats(),
+        "blob_cache": blob_cache.stats() if blob_cache is not None else None,
+        "download_fanout": download_fanout.stats() if download_fanout is not None else None,
     }
 
 
@@ -417,18 +1448,11 @@ async def delete_files_for_piclist(
     if not file_ids:
         raise HTTPException(status_code=400, detail="请求体中未解析到可删除的 file_id。")
 
-    deleted = []
-    failed = []
-    for file_id in file_ids:
-        try:
-            deleted.append(await _delete_file_and_sync(file_id, telegram_service))
-        except HTTPException as exc:
-            failed.append(exc.detail)
-
+    deleted, failed = await _delete_files_and_sync(file_ids, telegram_service)
     return {
         "status": "completed",
         "deleted": deleted,
-        "failed": failed,
+        "failed": [exc.detail for exc in failed],
     }
 
 
@@ -474,27 +1498,87 @@ async def batch_delete_files(
     """批量删除文件。"""
     _ensure_request_authorized(request, settings, x_api_key or key)
 
-    successful_deletions = []
-    failed_deletions = []
-    for file_id in request_data.file_ids:
-        try:
-            successful_deletions.append(await _delete_file_and_sync(file_id, telegram_service))
-        except HTTPException as exc:
-            failed_deletions.append(exc.detail)
-
+    successful_deletions, failed_deletions = await _delete_files_and_sync(
+        request_data.file_ids,
+        telegram_service,
+    )
     return {
         "status": "completed",
         "deleted": successful_deletions,
-        "failed": failed_deletions,
+        "failed": [exc.detail for exc in failed_deletions],
     }
 
 
+class _ChunkStreamAborted(Exception):
+    """分块无法继续下载，整个响应需要提前结束。"""
+
+
+async def _fetch_chunk_into_buffer(
+    chunk_id: str,
+    actual_chunk_id: str,
+    range_start: int,
+    range_end: int | None,
+    telegram_service: TelegramService,
+    client: httpx.AsyncClient,
+    buffer: ByteBoundedBuffer,
+) -> None:
+    """下载单个分块写入缓冲区；无法获取链接的分块被跳过，其余失败会中止整个响应。"""
+    error: BaseException | None = None
+    try:
+        chunk_url = await telegram_service.get_download_url(actual_chunk_id)
+        if not chunk_url:
+            print(f"警告: 无法为分块 {actual_chunk_id} 获取下载链接，已跳过。")
+            return
+
+        request_headers = {}
+        if range_start or range_end is not None:
+            request_headers["Range"] = f"bytes={range_start}-{'' if range_end is None else range_end}"
+
+        async with client.stream('GET', chunk_url, headers=request_headers) as chunk_resp:
+            if chunk_resp.status_code not in (200, 206):
+                print(f"错误: 获取分块 {chunk_id} 失败，状态码: {chunk_resp.status_code}")
+                if _is_client_error(chunk_resp.status_code):
+                    telegram_service.invalidate_download_url(actual_chunk_id)
+                await asyncio.sleep(1)
+                chunk_url = await telegram_service.get_download_url(actual_chunk_id)
+                if not chunk_url:
+                    print(f"重试失败: 无法为分块 {chunk_id} 获取新的下载链接。")
+                    raise _ChunkStreamAborted(chunk_id)
+
+                async with client.stream('GET', chunk_url, headers=request_headers) as retry_resp:
+                    retry_resp.raise_for_status()
+                    async for chunk_data in _iter_requested_bytes(retry_resp, range_start, range_end):
+                        await buffer.put(chunk_data)
+            else:
+                async for chunk_data in _iter_requested_bytes(chunk_resp, range_start, range_end):
+                    await buffer.put(chunk_data)
+    except httpx.RequestError as exc:
+        print(f"流式传输分块 {chunk_id} 时出现网络错误: {exc}")
+        error = _ChunkStreamAborted(chunk_id)
+    except Exception as exc:
+        error = exc
+    finally:
+        await buffer.close(error)
+
+
 async def stream_chunks(
     chunk_composite_ids: list[str],
     telegram_service: TelegramService,
     client: httpx.AsyncClient,
+    first_chunk_offset: int = 0,
+    last_chunk_end: int | None = None,
+    readahead_chunks: int = DEFAULT_DOWNLOAD_READAHEAD_CHUNKS,
+    readahead_max_bytes: int = DEFAULT_DOWNLOAD_READAHEAD_MAX_BYTES,
 ):
-    """流式输出分块文件，并预取下一个分块的临时 URL。"""
+    """
+    流式输出分块文件，并在输出当前分块的同时预读后续 `readahead_chunks` 个分块。
+
+    每个在途分块有独立的有界缓冲区，合计不超过 `readahead_max_bytes`；
+    客户端读取变慢时缓冲区写满，预读随之暂停。
+
+    Range 请求时，`first_chunk_offset` 为第一个分块内的起始偏移，
+    `last_chunk_end` 为最后一个分块内的结束偏移（闭区间）。
+    """
     actual_chunk_ids: list[tuple[str, str]] = []
     for chunk_id in chunk_composite_ids:
         try:
@@ -506,37 +1590,43 @@ async def stream_chunks(
     if not actual_chunk_ids:
         return
 
-    url_task = asyncio.create_task(
-        telegram_service.get_download_url(actual_chunk_ids[0][1])
-    )
-    for index, (chunk_id, actual_chunk_id) in enumerate(actual_chunk_ids):
-        chunk_url = await url_task
-        if index + 1 < len(actual_chunk_ids):
-            url_task = asyncio.create_task(
-                telegram_service.get_download_url(actual_chunk_ids[index + 1][1])
+    window_size = max(readahead_chunks, 0) + 1
+    per_chunk_max_bytes = max(readahead_max_bytes // window_size, 1)
+    last_index = len(actual_chunk_ids) - 1
+    in_flight: deque[tuple[asyncio.Task, ByteBoundedBuffer]] = deque()
+    next_index = 0
+
+    def start_next_chunk() -> None:
+        nonlocal next_index
+        chunk_id, actual_chunk_id = actual_chunk_ids[next_index]
+        buffer = ByteBoundedBuffer(per_chunk_max_bytes)
+        task = asyncio.create_task(
+            _fetch_chunk_into_buffer(
+                chunk_id,
+                actual_chunk_id,
+                first_chunk_offset if next_index == 0 else 0,
+                last_chunk_end if next_index == last_index else None,
+                telegram_service,
+                client,
+                buffer,
             )
+        )
+        in_flight.append((task, buffer))
+        next_index += 1
 
-        if not chunk_url:
-            print(f"警告: 无法为分块 {actual_chunk_id} 获取下载链接，已跳过。")
-            continue
-
-        try:
-            async with client.stream('GET', chunk_url) as chunk_resp:
-                if chunk_resp.status_code != 200:
-                    print(f"错误: 获取分块 {chunk_id} 失败，状态码: {chunk_resp.status_code}")
-                    await asyncio.sleep(1)
-                    chunk_url = await telegram_service.get_download_url(actual_chunk_id)
-                    if not chunk_url:
-                        print(f"重试失败: 无法为分块 {chunk_id} 获取新的下载链接。")
-                        break
-
-                    async with client.stream('GET', chunk_url) as retry_resp:
-                        retry_resp.raise_for_status()
-                        async for chunk_data in retry_resp.aiter_bytes():
-                            yield chunk_data
-                else:
-                    async for chunk_data in chunk_resp.aiter_bytes():
-                        yield chunk_data
-        except httpx.RequestError as exc:
-            print(f"流式传输分块 {chunk_id} 时出现网络错误: {exc}")
-            break
+    try:
+        while in_flight or next_index <= last_index:
+            while len(in_flight) < window_size and next_index <= last_index:
+                start_next_chunk()
+
+            _, buffer = in_flight[0]
+            try:
+                while (chunk_data := await buffer.get()) is not None:
+                    yield chunk_data
+            except _ChunkStreamAborted:
+                break
+            in_flight.popleft()
+    finally:
+        for task, _ in in_flight:
+            task.cancel()
+        await asyncio.gather(*(task for task, _ in in_flight), return_exceptions=True)
@@ -6,8 +6,9 @@ from telegram.ext import Application, ContextTypes, MessageHandler, filters
 
 from . import database
 from .core.config import get_settings
+from .core.http_transport import get_shared_transport
 from .events import publish_file_update
-from .services.telegram_service import get_telegram_service
+from .services.telegram_service import extract_thumbnails, get_telegram_service
 from .utils.file_paths import build_file_path
 
 
@@ -58,6 +59,8 @@ async def handle_new_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         filename=file_name,
         file_id=composite_id,
         filesize=file_obj.file_size,
+        mime_type=getattr(file_obj, "mime_type", None),
+        thumbnails=extract_thumbnails(message),
     )
     if not inserted:
         return
@@ -98,7 +101,17 @@ async def handle_get_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     final_file_id = file_id
     final_file_name = file_name
 
+    manifest_info = None
     if file_name.endswith('.manifest'):
+        # 已入库的清单直接使用数据库中的原始文件名，无需下载清单。
+        manifest_info = await asyncio.to_thread(
+            database.get_file_info,
+            f"{update.message.reply_to_message.message_id}:{file_id}",
+        )
+        if manifest_info:
+            final_file_name = manifest_info["filename"]
+
+    if file_name.endswith('.manifest') and not manifest_info:
         telegram_service = get_telegram_service()
         download_url = await telegram_service.get_download_url(file_id)
         if download_url:
@@ -134,7 +147,15 @@ def create_bot_app() -> Application:
         print("错误: .env 文件中未设置 BOT_TOKEN。机器人无法创建。")
         raise ValueError("BOT_TOKEN not configured.")
 
-    application = Application.builder().token(settings.BOT_TOKEN).build()
+    # 轮询与处理消息时的 Bot API 调用同样走共享连接池。
+    http_transport = get_shared_transport()
+    application = (
+        Application.builder()
+        .token(settings.BOT_TOKEN)
+        .request(http_transport.create_bot_request())
+        .get_updates_request(http_transport.create_bot_request())
+        .build()
+    )
 
     get_handler = MessageHandler(
         filters.TEXT & (~filters.COMMAND) & filters.REPLY,
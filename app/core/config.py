@@ -22,6 +22,41 @@ class Settings(BaseSettings):
     TELEGRAM_SYNC_SESSION: str = "tgstate-sync"
     TELEGRAM_SYNC_SESSION_STRING: Optional[str] = None
     TELEGRAM_RECONCILE_INTERVAL: int = 60
+    # 增量对账完整轮转一遍所有文件的目标时长（秒）。
+    TELEGRAM_RECONCILE_SWEEP_WINDOW: int = 24 * 60 * 60
+    # 历史回填时同时解析的清单消息数量。
+    MANIFEST_RESOLVE_CONCURRENCY: int = 4
+
+    # 大文件分块上传时同时在途的分块数量。
+    UPLOAD_CONCURRENCY: int = 4
+    # 后台上传任务：请求体落地目录，以及同时执行的任务数量。
+    UPLOAD_SPOOL_DIR: str = "upload_spool"
+    UPLOAD_JOB_CONCURRENCY: int = 2
+
+    # 分块文件下载时预读的后续分块数量，以及单个请求预读缓冲的总字节上限。
+    DOWNLOAD_READAHEAD_CHUNKS: int = 2
+    DOWNLOAD_READAHEAD_MAX_BYTES: int = 32 * 1024 * 1024
+    # 合并同一文件的并发完整下载，只回源一次；每个订阅者的缓冲上限，慢连接超出后改为自己回源。
+    DOWNLOAD_FANOUT_ENABLED: bool = True
+    DOWNLOAD_FANOUT_BUFFER_BYTES: int = 8 * 1024 * 1024
+
+    # 所有 Telegram 请求共用的连接池：总连接数、保持空闲的连接数、空闲连接保留秒数、
+    # 单个主机文件下载与 Bot API 调用各自的并发上限，以及是否启用 HTTP/2（依赖 httpx[http2]，已列入 requirements.txt）。
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_MAX_CONNECTIONS_PER_HOST: int = 64
+    HTTP_MAX_API_CONNECTIONS_PER_HOST: int = 16
+    HTTP2_ENABLED: bool = True
+
+    # 文件更新事件总线：memory 仅在单进程内广播；sqlite 通过数据库中的事件日志在多个 worker 进程间广播。
+    EVENT_BUS_BACKEND: str = "memory"
+
+    # 可选的本地下载缓存，热点小文件直接从磁盘返回，减少回源 Telegram。
+    BLOB_CACHE_ENABLED: bool = False
+    BLOB_CACHE_DIR: str = "blob_cache"
+    BLOB_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
+    BLOB_CACHE_MAX_FILE_BYTES: int = 20 * 1024 * 1024
 
 
 @lru_cache()
@@ -5,7 +5,11 @@ from fastapi import FastAPI
 
 from .. import database
 from ..bot_handler import create_bot_app
+from ..events import start_event_bus, stop_event_bus
 from ..services.telegram_sync_service import get_telegram_sync_service
+from ..services.upload_jobs import get_upload_job_manager
+from .config import get_settings
+from .http_transport import close_shared_transport, get_shared_transport
 
 # 这个变量将持有全局共享的客户端实例。
 http_client: httpx.AsyncClient | None = None
@@ -15,7 +19,7 @@ http_client: httpx.AsyncClient | None = None
 async def lifespan(app: FastAPI):
     """
     应用生命周期管理器。
-    启动时初始化数据库、HTTP 客户端、Bot 与删除同步服务；
+    启动时初始化数据库、HTTP 客户端、Bot、删除同步服务与后台上传任务；
     关闭时按相反顺序释放资源。
     """
     print("🚀 应用启动...")
@@ -23,10 +27,16 @@ async def lifespan(app: FastAPI):
     database.init_db()
     print("✔️ 数据库已初始化。")
 
+    try:
+        event_bus_backend = get_settings().EVENT_BUS_BACKEND
+        await start_event_bus(event_bus_backend)
+        print(f"✔️ 文件更新事件总线已启动 ({event_bus_backend})。")
+    except Exception as exc:
+        print(f"❌ 启动文件更新事件总线失败，将仅在本进程内广播: {exc}")
+
     global http_client
-    limits = httpx.Limits(max_connections=50, max_keepalive_connections=20)
-    http_client = httpx.AsyncClient(timeout=300.0, limits=limits)
-    print("✔️ 共享的 HTTP 客户端已创建。")
+    http_client = get_shared_transport().client
+    print("✔️ 共享的 HTTP 连接池已创建。")
 
     bot_app = None
     bot_initialized = False
@@ -54,18 +64,27 @@ async def lifespan(app: FastAPI):
     except Exception as exc:
         print(f"❌ 启动 Telegram 删除同步服务失败: {exc}")
 
+    try:
+        upload_job_manager = get_upload_job_manager()
+        await upload_job_manager.start()
+        app.state.upload_job_manager = upload_job_manager
+        print("✔️ 后台上传任务已启动。")
+    except Exception as exc:
+        app.state.upload_job_manager = None
+        print(f"❌ 启动后台上传任务失败: {exc}")
+
     yield
 
     print("🔌 应用关闭...")
 
+    if getattr(app.state, "upload_job_manager", None):
+        await app.state.upload_job_manager.stop()
+        print("✔️ 后台上传任务已停止。")
+
     if getattr(app.state, "telegram_sync_service", None):
         await app.state.telegram_sync_service.stop()
         print("✔️ Telegram 删除同步服务已停止。")
 
-    if http_client:
-        await http_client.aclose()
-        print("✔️ 共享的 HTTP 客户端已关闭。")
-
     if hasattr(app.state, "bot_app") and app.state.bot_app:
         print("正在停止机器人...")
         await app.state.bot_app.updater.stop()
@@ -73,6 +92,15 @@ async def lifespan(app: FastAPI):
         await app.state.bot_app.shutdown()
         print("✔️ 机器人已停止。")
 
+    # 机器人与下载都借用这个连接池，最后关闭。
+    await close_shared_transport()
+    http_client = None
+    print("✔️ 共享的 HTTP 连接池已关闭。")
+
+    await stop_event_bus()
+    database.close_db()
+    print("✔️ 数据库连接池已关闭。")
+
 
 def get_http_client() -> httpx.AsyncClient:
     """提供共享的 `httpx.AsyncClient` 实例。"""
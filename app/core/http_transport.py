@@ -0,0 +1,219 @@
+import asyncio
+import importlib.util
+from typing import Any, AsyncIterator
+
+import httpx
+from telegram.request import HTTPXRequest
+
+from .config import get_settings
+
+# 共享连接池的默认参数：总连接数、保持空闲的连接数、空闲连接的保留时长与单个主机的并发上限。
+DEFAULT_HTTP_MAX_CONNECTIONS = 100
+DEFAULT_HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_HTTP_KEEPALIVE_EXPIRY_SECONDS = 30.0
+DEFAULT_HTTP_MAX_CONNECTIONS_PER_HOST = 64
+# 每个主机为 Bot API 调用保留的并发名额；文件下载（/file/ 路径）单独计数，长时间的流式下载不会占满它。
+DEFAULT_HTTP_MAX_API_CONNECTIONS_PER_HOST = 16
+# Bot API 请求等待连接名额的超时；python-telegram-bot 的默认值只有 1 秒。
+BOT_API_POOL_TIMEOUT_SECONDS = 30.0
+# 共享客户端的默认超时，与之前下载用的客户端一致，照顾大文件传输。
+DEFAULT_HTTP_TIMEOUT_SECONDS = 300.0
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """包装响应体，响应关闭时归还主机并发名额。"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class _BorrowedTransport(httpx.AsyncBaseTransport):
+    """
+    交给 python-telegram-bot 等自行管理客户端的组件使用。
+    它们关闭自己的客户端时不会关闭共享的连接池。
+    """
+
+    def __init__(self, owner: "SharedHttpTransport"):
+        self._owner = owner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._owner.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        pass
+
+
+class SharedHttpTransport(httpx.AsyncBaseTransport):
+    """
+    所有发往 Telegram 的请求共用的传输层：Bot API 调用、文件下载、删除时读取清单等。
+
+    只有一个连接池，keep-alive 连接与 TLS 会话在各处之间复用。
+    每个主机的并发请求数单独限制，并把 Bot API 调用与文件下载分开计数：
+    两者都发往 api.telegram.org，流式下载在关闭前一直占用名额，
+    分开后慢速下载再多也不会挤占 getFile、sendDocument 与轮询所需的名额。
+    两类名额之和不超过连接池总数，连接池本身也不会被下载占满。
+    等待名额的时间计入请求的 pool 超时，与 httpx 自身的连接池行为一致。
+    """
+
+    def __init__(
+        self,
+        *,
+        max_connections: int = DEFAULT_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = DEFAULT_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = DEFAULT_HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        max_connections_per_host: int = DEFAULT_HTTP_MAX_CONNECTIONS_PER_HOST,
+        max_api_connections_per_host: int = DEFAULT_HTTP_MAX_API_CONNECTIONS_PER_HOST,
+        http2: bool = True,
+        timeout: float = DEFAULT_HTTP_TIMEOUT_SECONDS,
+    ):
+        if http2 and importlib.util.find_spec("h2") is None:
+            print("未安装 h2，HTTP/2 已禁用；需要时请执行 pip install 'httpx[http2]'。")
+            http2 = False
+        self.http2 = http2
+        self.max_api_connections_per_host = max(max_api_connections_per_host, 1)
+        self.max_connections = max(max_connections, self.max_api_connections_per_host + 1)
+        self.max_connections_per_host = max(
+            min(max_connections_per_host, self.max_connections - self.max_api_connections_per_host),
+            1,
+        )
+        self._pool = httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
+        self._host_slots: dict[str, asyncio.Semaphore] = {}
+        self._host_active: dict[str, int] = {}
+        self.requests = 0
+        self.errors = 0
+        self.pool_timeouts = 0
+        self.waiting = 0
+        self.is_closed = False
+        # 应用内直接发起请求使用的客户端，同样走这个连接池。
+        self.client = httpx.AsyncClient(timeout=timeout, transport=self.borrow())
+
+    def create_bot_request(self, **kwargs: Any) -> HTTPXRequest:
+        """创建走共享连接池的 python-telegram-bot 请求对象，并显式设置等待名额的超时。"""
+        kwargs.setdefault("pool_timeout", BOT_API_POOL_TIMEOUT_SECONDS)
+        return HTTPXRequest(httpx_kwargs={"transport": self.borrow()}, **kwargs)
+
+    def borrow(self) -> httpx.AsyncBaseTransport:
+        """返回一个不会关闭共享连接池的传输层视图。"""
+        return _BorrowedTransport(self)
+
+    @staticmethod
+    def _limiter_key(request: httpx.Request) -> tuple[str, bool]:
+        """返回 (名额分组, 是否为文件下载)，文件下载按 `主机/file` 单独分组。"""
+        is_file = request.url.path.startswith("/file/")
+        host = request.url.host
+        return (f"{host}/file" if is_file else host), is_file
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key, is_file = self._limiter_key(request)
+        slots = self._host_slots.get(key)
+        if slots is None:
+            limit = self.max_connections_per_host if is_file else self.max_api_connections_per_host
+            slots = self._host_slots[key] = asyncio.Semaphore(limit)
+
+        pool_timeout = (request.extensions.get("timeout") or {}).get("pool")
+        self.waiting += 1
+        try:
+            async with asyncio.timeout(pool_timeout):
+                await slots.acquire()
+        except TimeoutError as exc:
+            self.pool_timeouts += 1
+            raise httpx.PoolTimeout(f"等待 {key} 的连接名额超时。", request=request) from exc
+        finally:
+            self.waiting -= 1
+
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self._host_active[key] -= 1
+                slots.release()
+
+        self.requests += 1
+        self._host_active[key] = self._host_active.get(key, 0) + 1
+        try:
+            response = await self._pool.handle_async_request(request)
+        except BaseException:
+            self.errors += 1
+            release()
+            raise
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, release),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        self.is_closed = True
+        await self.client.aclose()
+        await self._pool.aclose()
+
+    def stats(self) -> dict[str, Any]:
+        # httpcore 的连接池对象没有公开的访问方式，取不到时只返回请求计数。
+        connections = getattr(getattr(self._pool, "_pool", None), "connections", None) or []
+        return {
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "max_connections_per_host": self.max_connections_per_host,
+            "max_api_connections_per_host": self.max_api_connections_per_host,
+            "requests": self.requests,
+            "errors": self.errors,
+            "pool_timeouts": self.pool_timeouts,
+            "waiting_requests": self.waiting,
+            "active_requests": sum(self._host_active.values()),
+            "active_requests_by_host": {host: count for host, count in self._host_active.items() if count},
+            "open_connections": len(connections),
+            "idle_connections": sum(1 for connection in connections if connection.is_idle()),
+        }
+
+
+_shared_transport: SharedHttpTransport | None = None
+
+
+def create_shared_transport() -> SharedHttpTransport:
+    settings = get_settings()
+    return SharedHttpTransport(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        max_connections_per_host=settings.HTTP_MAX_CONNECTIONS_PER_HOST,
+        max_api_connections_per_host=settings.HTTP_MAX_API_CONNECTIONS_PER_HOST,
+        http2=settings.HTTP2_ENABLED,
+    )
+
+
+def get_shared_transport() -> SharedHttpTransport:
+    """返回全局共享的传输层，首次使用或关闭后重新创建。"""
+    global _shared_transport
+    if _shared_transport is None or _shared_transport.is_closed:
+        _shared_transport = create_shared_transport()
+    return _shared_transport
+
+
+async def close_shared_transport() -> None:
+    """关闭共享的连接池，由应用生命周期在所有使用方停止后调用。"""
+    global _shared_transport
+    if _shared_transport is not None:
+        await _shared_transport.aclose()
+        _shared_transport = None
@@ -1,46 +1,646 @@
+import queue
 import sqlite3
 import threading
-from typing import Any
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from .utils.cursors import InvalidCursor
+from .utils.media_types import classify_media_kind, file_extension
 
 DATABASE_URL = "file_metadata.db"
 
-# 使用线程锁来确保多线程环境下的数据库访问安全
-_db_lock = threading.Lock()
+# 读连接池大小。WAL 模式下读操作互不阻塞，也不会排在写操作后面。
+READER_POOL_SIZE = 4
+# 每个连接缓存的预编译语句数量，固定的 SQL 文本会直接复用已编译的语句。
+STATEMENT_CACHE_SIZE = 128
+# trigram 分词至少需要三个字符才能命中索引，更短的关键词退回 LIKE 匹配。
+SEARCH_MIN_TRIGRAM_LENGTH = 3
+SEARCH_MAX_TERMS = 8
+# 按消息 ID 批量删除或更新时每条 SQL 绑定的参数数量上限。
+DELETE_BATCH_SIZE = 500
+# 尚未写回数据库的访问记录上限，未启用对账时不会被消费，超出后不再记录新文件。
+PENDING_ACCESS_MAX = 10_000
+# event_log 最多保留的事件数，写入新事件时删除更早的行。
+EVENT_LOG_MAX_ROWS = 10_000
+# 等待其他连接释放写锁的时长（毫秒）；执行结构迁移时等待其他进程完成迁移，时间更长。
+BUSY_TIMEOUT_MS = 5000
+MIGRATION_BUSY_TIMEOUT_MS = 120_000
+CONNECTION_PRAGMAS = (
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+)
 
 
-def get_db_connection():
-    """获取数据库连接。"""
-    conn = sqlite3.connect(DATABASE_URL, check_same_thread=False)
+def _open_connection(database_path: str, *, read_only: bool = False) -> sqlite3.Connection:
+    """打开一个已应用调优参数的 SQLite 连接。"""
+    conn = sqlite3.connect(
+        database_path,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
     return conn
 
 
-def init_db():
-    """初始化数据库，创建表。"""
-    with _db_lock:
-        conn = get_db_connection()
+class ConnectionPool:
+    """
+    SQLite 连接池：一个专用写连接加若干只读连接。
+    写操作通过写锁串行化，读操作从空闲队列借用连接并发执行。
+    每个只读连接带有借出时的池代数；close 之后归还的旧连接直接关闭，不再回到空闲队列。
+    """
+
+    def __init__(self, database_path: str, reader_count: int = READER_POOL_SIZE):
+        self.database_path = database_path
+        self._reader_count = max(reader_count, 1)
+        # 元素为 (池代数, 连接)；连接为 None 表示唤醒等待者重新尝试打开连接。
+        self._idle_readers: queue.LifoQueue[tuple[int, sqlite3.Connection | None]] = queue.LifoQueue()
+        self._opened_readers = 0
+        self._generation = 0
+        self._readers_lock = threading.Lock()
+        self._writer: sqlite3.Connection | None = None
+        self._writer_lock = threading.Lock()
+
+    def _get_writer(self) -> sqlite3.Connection:
+        if self._writer is None:
+            conn = _open_connection(self.database_path)
+            conn.execute("PRAGMA journal_mode = WAL")
+            self._writer = conn
+        return self._writer
+
+    def _acquire_reader(self) -> tuple[int, sqlite3.Connection]:
+        while True:
+            try:
+                generation, conn = self._idle_readers.get_nowait()
+            except queue.Empty:
+                with self._readers_lock:
+                    generation = self._generation
+                    can_open = self._opened_readers < self._reader_count
+                    if can_open:
+                        self._opened_readers += 1
+
+                if can_open:
+                    try:
+                        return generation, _open_connection(self.database_path, read_only=True)
+                    except Exception:
+                        with self._readers_lock:
+                            if generation == self._generation:
+                                self._opened_readers -= 1
+                        raise
+
+                generation, conn = self._idle_readers.get()
+
+            if conn is None:
+                continue
+            if generation == self._generation:
+                return generation, conn
+            conn.close()
+
+    def _release_reader(self, generation: int, conn: sqlite3.Connection) -> None:
+        with self._readers_lock:
+            current = generation == self._generation
+        if current:
+            self._idle_readers.put((generation, conn))
+            return
+
+        # 借出期间连接池已关闭：关闭旧连接，并唤醒可能在等待空闲连接的线程。
+        conn.close()
+        self._idle_readers.put((generation, None))
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """借用一个只读连接。"""
+        generation, conn = self._acquire_reader()
         try:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS files (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    filename TEXT NOT NULL,
-                    file_id TEXT NOT NULL UNIQUE,
-                    filesize INTEGER NOT NULL,
-                    upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-                """
-            )
-            cursor.execute(
-                """
-                CREATE INDEX IF NOT EXISTS idx_files_upload_date_id
-                ON files(upload_date DESC, id DESC);
-                """
-            )
-            conn.commit()
+            yield conn
         finally:
-            conn.close()
+            if conn.in_transaction:
+                conn.rollback()
+            self._release_reader(generation, conn)
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """独占写连接，正常退出时提交事务，出错时回滚。"""
+        with self._writer_lock:
+            conn = self._get_writer()
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def close(self) -> None:
+        """关闭写连接与空闲的只读连接；仍被借用的只读连接在归还时关闭。"""
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+        with self._readers_lock:
+            self._generation += 1
+            self._opened_readers = 0
+        while True:
+            try:
+                _, conn = self._idle_readers.get_nowait()
+            except queue.Empty:
+                break
+            if conn is not None:
+                conn.close()
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_connection_pool() -> ConnectionPool:
+    """返回当前数据库文件对应的连接池，数据库路径变化时自动重建。"""
+    global _pool
+    pool = _pool
+    if pool is not None and pool.database_path == DATABASE_URL:
+        return pool
+
+    with _pool_lock:
+        if _pool is None or _pool.database_path != DATABASE_URL:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DATABASE_URL)
+        return _pool
+
+
+def close_db() -> None:
+    """关闭连接池，供应用退出时调用。"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def get_db_connection():
+    """获取一个独立的数据库连接，调用方负责关闭。"""
+    return _open_connection(DATABASE_URL)
+
+
+def init_db():
+    """初始化数据库，创建表并执行尚未应用的结构迁移。"""
+    with get_connection_pool().writer() as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT NOT NULL,
+                file_id TEXT NOT NULL UNIQUE,
+                filesize INTEGER NOT NULL,
+                upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_files_upload_date_id
+            ON files(upload_date DESC, id DESC);
+            """
+        )
+        _apply_migrations(conn)
+
+
+def _apply_migrations(conn: sqlite3.Connection) -> None:
+    """
+    按 PRAGMA user_version 依次执行迁移，每个迁移与版本号在同一事务中提交。
+
+    多个 worker 进程会同时执行这里：每一步先用 BEGIN IMMEDIATE 取得写锁，
+    再在事务内重新读取版本号，其他进程已经应用的迁移直接跳过，不会重复执行 ALTER TABLE。
+    """
+    conn.commit()
+    # 等待其他进程完成迁移的时间可能超过平时的 busy_timeout。
+    conn.execute(f"PRAGMA busy_timeout = {MIGRATION_BUSY_TIMEOUT_MS}")
+    try:
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version >= len(SCHEMA_MIGRATIONS):
+                    conn.commit()
+                    return
+                SCHEMA_MIGRATIONS[version](conn)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            print(f"数据库结构已迁移到版本 {version + 1}。")
+    finally:
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+
+
+def _migrate_add_file_stats(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS file_stats (
+            extension TEXT PRIMARY KEY,
+            file_count INTEGER NOT NULL DEFAULT 0,
+            total_bytes INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    totals: dict[str, list[int]] = {}
+    for row in conn.execute("SELECT filename, filesize FROM files"):
+        bucket = totals.setdefault(file_extension(row["filename"]), [0, 0])
+        bucket[0] += 1
+        bucket[1] += row["filesize"] or 0
+
+    conn.execute("DELETE FROM file_stats")
+    conn.executemany(
+        "INSERT INTO file_stats (extension, file_count, total_bytes) VALUES (?, ?, ?)",
+        [(extension, count, size) for extension, (count, size) in totals.items()],
+    )
+
+
+def _migrate_add_media_kind(conn: sqlite3.Connection) -> None:
+    """为 files 增加扩展名与类别列并回填，统计表改为按 (扩展名, 类别) 聚合。"""
+    conn.execute("ALTER TABLE files ADD COLUMN extension TEXT NOT NULL DEFAULT ''")
+    conn.execute("ALTER TABLE files ADD COLUMN media_kind TEXT NOT NULL DEFAULT 'other'")
+    rows = conn.execute("SELECT id, filename FROM files").fetchall()
+    conn.executemany(
+        "UPDATE files SET extension = ?, media_kind = ? WHERE id = ?",
+        [
+            (file_extension(row["filename"]), classify_media_kind(row["filename"]), row["id"])
+            for row in rows
+        ],
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_files_media_kind_upload_date_id
+        ON files(media_kind, upload_date DESC, id DESC)
+        """
+    )
+
+    conn.execute("DROP TABLE IF EXISTS file_stats")
+    conn.execute(
+        """
+        CREATE TABLE file_stats (
+            extension TEXT NOT NULL,
+            media_kind TEXT NOT NULL,
+            file_count INTEGER NOT NULL DEFAULT 0,
+            total_bytes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (extension, media_kind)
+        )
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO file_stats (extension, media_kind, file_count, total_bytes)
+        SELECT extension, media_kind, COUNT(*), COALESCE(SUM(filesize), 0)
+        FROM files
+        GROUP BY extension, media_kind
+        """
+    )
+
+
+def _migrate_add_message_id(conn: sqlite3.Connection) -> None:
+    """从复合 file_id 中拆出频道消息 ID，按消息 ID 删除时不再需要 LIKE 扫描。"""
+    conn.execute("ALTER TABLE files ADD COLUMN message_id INTEGER")
+    rows = conn.execute("SELECT id, file_id FROM files").fetchall()
+    conn.executemany(
+        "UPDATE files SET message_id = ? WHERE id = ?",
+        [(parse_message_id(row["file_id"]), row["id"]) for row in rows],
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_files_message_id ON files(message_id)")
+
+
+def _migrate_add_filename_search(conn: sqlite3.Connection) -> None:
+    """
+    建立文件名全文索引。trigram 分词按三个字符切分，
+    中日韩文件名与扩展名都能做子串匹配；索引内容通过触发器与 files 保持同步。
+    """
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+            filename,
+            content='files',
+            content_rowid='id',
+            tokenize='trigram'
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS files_fts_after_insert AFTER INSERT ON files BEGIN
+            INSERT INTO files_fts(rowid, filename) VALUES (new.id, new.filename);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS files_fts_after_delete AFTER DELETE ON files BEGIN
+            INSERT INTO files_fts(files_fts, rowid, filename) VALUES ('delete', old.id, old.filename);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS files_fts_after_update AFTER UPDATE OF filename ON files BEGIN
+            INSERT INTO files_fts(files_fts, rowid, filename) VALUES ('delete', old.id, old.filename);
+            INSERT INTO files_fts(rowid, filename) VALUES (new.id, new.filename);
+        END
+        """
+    )
+    conn.execute("INSERT INTO files_fts(files_fts) VALUES ('rebuild')")
+
+
+def _migrate_add_reconcile_tracking(conn: sqlite3.Connection) -> None:
+    """
+    记录每行最近一次对账确认与被访问的时间（Unix 秒），
+    增量对账按 last_verified_at 轮转，未确认过的行（NULL）排在最前。
+    """
+    conn.execute("ALTER TABLE files ADD COLUMN last_verified_at INTEGER")
+    conn.execute("ALTER TABLE files ADD COLUMN last_accessed_at INTEGER")
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_files_last_verified_at_id
+        ON files(last_verified_at, id DESC)
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_files_last_accessed_at ON files(last_accessed_at)"
+    )
+
+
+def _migrate_add_sync_state(conn: sqlite3.Connection) -> None:
+    """保存同步任务的检查点，例如历史回填扫描到的位置。"""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        )
+        """
+    )
+
+
+def _migrate_add_file_chunks(conn: sqlite3.Connection) -> None:
+    """
+    在本地保存大文件清单：每个分块的序号、复合 ID、大小与在原文件中的偏移。
+    下载和删除大文件时直接查表，不再从 Telegram 下载清单；主记录删除时分块记录随之删除。
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS file_chunks (
+            file_id TEXT NOT NULL,
+            ordinal INTEGER NOT NULL,
+            chunk_file_id TEXT NOT NULL,
+            chunk_size INTEGER,
+            byte_offset INTEGER,
+            PRIMARY KEY (file_id, ordinal)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS file_chunks_after_file_delete AFTER DELETE ON files BEGIN
+            DELETE FROM file_chunks WHERE file_id = old.file_id;
+        END
+        """
+    )
+
+
+def _migrate_add_is_manifest(conn: sqlite3.Connection) -> None:
+    """
+    记录文件是否为分块清单，下载时据此直接选择下载方式。
+    已有分块索引的行回填为 1，其余旧记录保持 NULL，首次下载探测后再写回。
+    """
+    conn.execute("ALTER TABLE files ADD COLUMN is_manifest INTEGER")
+    conn.execute(
+        """
+        UPDATE files SET is_manifest = 1
+        WHERE file_id IN (SELECT DISTINCT file_id FROM file_chunks)
+        """
+    )
+
+
+def _migrate_add_upload_jobs(conn: sqlite3.Connection) -> None:
+    """
+    后台上传任务及其已完成的分块。请求体先落地到 spool_path，再由后台任务发送到 Telegram；
+    每个分块发送成功后立即记录，应用重启后从最后一个已完成的分块继续。
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS upload_jobs (
+            id TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            spool_path TEXT NOT NULL,
+            total_size INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            uploaded_bytes INTEGER NOT NULL DEFAULT 0,
+            file_id TEXT,
+            error TEXT,
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_upload_jobs_status ON upload_jobs(status)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS upload_job_parts (
+            job_id TEXT NOT NULL,
+            part_index INTEGER NOT NULL,
+            chunk_file_id TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            PRIMARY KEY (job_id, part_index)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS upload_job_parts_after_job_delete AFTER DELETE ON upload_jobs BEGIN
+            DELETE FROM upload_job_parts WHERE job_id = old.id;
+        END
+        """
+    )
+
+
+def _migrate_add_event_log(conn: sqlite3.Connection) -> None:
+    """
+    跨进程的文件更新事件日志。多个 worker 进程共用同一个数据库时，
+    发布事件写入此表，各进程轮询新行后推送给本进程的 SSE 客户端。
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS event_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+        """
+    )
+
+
+def _migrate_add_file_thumbnails(conn: sqlite3.Connection) -> None:
+    """
+    保存图片的缩略图尺寸：照片消息中较小的 PhotoSize 与图片文档的缩略图，
+    画廊按需要的宽度选择其中一个；主记录删除时缩略图记录随之删除。
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS file_thumbnails (
+            file_id TEXT NOT NULL,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            thumb_file_id TEXT NOT NULL,
+            PRIMARY KEY (file_id, width)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS file_thumbnails_after_file_delete AFTER DELETE ON files BEGIN
+            DELETE FROM file_thumbnails WHERE file_id = old.file_id;
+        END
+        """
+    )
+
+
+def _migrate_add_upload_job_lease(conn: sqlite3.Connection) -> None:
+    """
+    上传任务记录执行它的 worker 与租约到期时间。多个 worker 进程共用同一个数据库时，
+    任务先原子地认领再执行，租约过期的 running 任务才由其他进程接管。
+    """
+    conn.execute("ALTER TABLE upload_jobs ADD COLUMN owner TEXT")
+    conn.execute("ALTER TABLE upload_jobs ADD COLUMN lease_expires_at INTEGER")
+
+
+SCHEMA_MIGRATIONS = (
+    _migrate_add_file_stats,
+    _migrate_add_media_kind,
+    _migrate_add_message_id,
+    _migrate_add_filename_search,
+    _migrate_add_reconcile_tracking,
+    _migrate_add_sync_state,
+    _migrate_add_file_chunks,
+    _migrate_add_is_manifest,
+    _migrate_add_upload_jobs,
+    _migrate_add_event_log,
+    _migrate_add_file_thumbnails,
+    _migrate_add_upload_job_lease,
+)
+
+
+def parse_message_id(file_id: str) -> int | None:
+    """从 "message_id:file_id" 形式的复合 ID 中取出消息 ID。"""
+    message_id, separator, _ = str(file_id).partition(":")
+    if not separator or not message_id.isdigit():
+        return None
+    return int(message_id)
+
+
+def _adjust_file_stats(
+    conn: sqlite3.Connection,
+    extension: str,
+    media_kind: str,
+    filesize: int,
+    delta: int,
+) -> None:
+    """在调用方的写事务中增减按 (扩展名, 类别) 聚合的计数。"""
+    conn.execute(
+        """
+        INSERT INTO file_stats (extension, media_kind, file_count, total_bytes)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(extension, media_kind) DO UPDATE SET
+            file_count = file_count + excluded.file_count,
+            total_bytes = total_bytes + excluded.total_bytes
+        """,
+        (extension, media_kind, delta, delta * (filesize or 0)),
+    )
+
+
+def _insert_file_metadata(
+    conn: sqlite3.Connection,
+    filename: str,
+    file_id: str,
+    filesize: int,
+    upload_date: str | None,
+    mime_type: str | None,
+    chunks: list[tuple[str, int | None]] | None = None,
+    thumbnails: list[tuple[str, int, int]] | None = None,
+) -> bool:
+    """
+    在调用方的写事务中插入一条记录并更新统计，已存在时忽略。
+    传入 chunks 时记为清单并一并写入分块索引，否则记为普通文件；
+    传入 thumbnails 时一并写入缩略图。
+    """
+    extension = file_extension(filename)
+    media_kind = classify_media_kind(filename, mime_type)
+    cursor = conn.execute(
+        """
+        INSERT OR IGNORE INTO files
+            (filename, file_id, filesize, upload_date, extension, media_kind, message_id, is_manifest)
+        VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?, ?, ?)
+        """,
+        (
+            filename,
+            file_id,
+            filesize,
+            upload_date,
+            extension,
+            media_kind,
+            parse_message_id(file_id),
+            1 if chunks else 0,
+        )
+    )
+    inserted = cursor.rowcount > 0
+    if inserted:
+        _adjust_file_stats(conn, extension, media_kind, filesize, 1)
+        if chunks:
+            _replace_file_chunks(conn, file_id, chunks)
+        if thumbnails:
+            _replace_file_thumbnails(conn, file_id, thumbnails)
+    return inserted
+
+
+def _replace_file_chunks(
+    conn: sqlite3.Connection,
+    file_id: str,
+    chunks: list[tuple[str, int | None]],
+) -> None:
+    """按顺序写入分块 (复合 ID, 大小)，偏移由前面分块的大小累加；大小未知之后的偏移记为 NULL。"""
+    conn.execute("DELETE FROM file_chunks WHERE file_id = ?", (file_id,))
+    rows = []
+    byte_offset: int | None = 0
+    for ordinal, (chunk_file_id, chunk_size) in enumerate(chunks):
+        rows.append((file_id, ordinal, chunk_file_id, chunk_size, byte_offset))
+        byte_offset = byte_offset + chunk_size if byte_offset is not None and chunk_size is not None else None
+    conn.executemany(
+        """
+        INSERT INTO file_chunks (file_id, ordinal, chunk_file_id, chunk_size, byte_offset)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+
+
+def _replace_file_thumbnails(
+    conn: sqlite3.Connection,
+    file_id: str,
+    thumbnails: list[tuple[str, int, int]],
+) -> None:
+    """写入缩略图 (缩略图 file_id, 宽, 高)，同一宽度只保留最后一个。"""
+    conn.execute("DELETE FROM file_thumbnails WHERE file_id = ?", (file_id,))
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO file_thumbnails (file_id, width, height, thumb_file_id)
+        VALUES (?, ?, ?, ?)
+        """,
+        [(file_id, width, height, thumb_file_id) for thumb_file_id, width, height in thumbnails],
+    )
 
 
 def add_file_metadata(
@@ -48,123 +648,517 @@ def add_file_metadata(
     file_id: str,
     filesize: int,
     upload_date: str | None = None,
+    mime_type: str | None = None,
+    chunks: list[tuple[str, int | None]] | None = None,
+    thumbnails: list[tuple[str, int, int]] | None = None,
 ) -> bool:
     """
     向数据库中添加一个新的文件元数据记录。
+    扩展名与类别在写入时根据文件名（以及可选的 MIME 类型）确定。
+    大文件传入 chunks（按顺序的分块复合 ID 与大小），图片传入 thumbnails（缩略图 file_id、宽、高），
+    与主记录在同一事务中写入。
     返回值表示本次调用是否真正插入了新记录。
     """
-    with _db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            if upload_date is None:
-                cursor.execute(
-                    "INSERT OR IGNORE INTO files (filename, file_id, filesize) VALUES (?, ?, ?)",
-                    (filename, file_id, filesize)
-                )
-            else:
-                cursor.execute(
-                    """
-                    INSERT OR IGNORE INTO files (filename, file_id, filesize, upload_date)
-                    VALUES (?, ?, ?, ?)
-                    """,
-                    (filename, file_id, filesize, upload_date)
-                )
-            conn.commit()
-            inserted = cursor.rowcount > 0
-            print(f"已添加或忽略文件元数据: {filename}")
-            return inserted
-        finally:
-            conn.close()
+    with get_connection_pool().writer() as conn:
+        inserted = _insert_file_metadata(
+            conn,
+            filename,
+            file_id,
+            filesize,
+            upload_date,
+            mime_type,
+            chunks,
+            thumbnails,
+        )
+    print(f"已添加或忽略文件元数据: {filename}")
+    return inserted
+
+
+def add_files_metadata(
+    records: list[dict[str, Any]],
+    *,
+    sync_state: dict[str, int | None] | None = None,
+) -> list[str]:
+    """
+    在一个事务中批量写入文件元数据，返回真正新插入的 file_id。
+    已存在的记录由 file_id 唯一索引判定后忽略；传入 sync_state 时检查点与数据一起提交。
+    """
+    inserted_file_ids: list[str] = []
+    with get_connection_pool().writer() as conn:
+        for record in records:
+            if _insert_file_metadata(
+                conn,
+                record["filename"],
+                record["file_id"],
+                record["filesize"],
+                record.get("upload_date"),
+                record.get("mime_type"),
+                record.get("chunks"),
+                record.get("thumbnails"),
+            ):
+                inserted_file_ids.append(record["file_id"])
+        if sync_state:
+            _write_sync_state(conn, sync_state)
+    return inserted_file_ids
+
+
+def save_file_chunks(file_id: str, chunks: list[tuple[str, int | None]]) -> bool:
+    """
+    为已有的文件记录补写分块索引，通常在从 Telegram 读取过一次清单后调用。
+    文件记录不存在时不写入，返回值表示是否写入。
+    """
+    with get_connection_pool().writer() as conn:
+        if conn.execute("SELECT 1 FROM files WHERE file_id = ?", (file_id,)).fetchone() is None:
+            return False
+        _replace_file_chunks(conn, file_id, chunks)
+        conn.execute("UPDATE files SET is_manifest = 1 WHERE file_id = ?", (file_id,))
+        return True
+
+
+def get_file_thumbnail(file_id: str, min_width: int) -> dict[str, Any] | None:
+    """
+    返回宽度不小于 min_width 的最小缩略图，都不够宽时返回最大的一个；
+    没有缩略图时返回 None。
+    """
+    with get_connection_pool().reader() as conn:
+        row = conn.execute(
+            """
+            SELECT thumb_file_id, width, height FROM file_thumbnails
+            WHERE file_id = ?
+            ORDER BY width < ?, CASE WHEN width >= ? THEN width ELSE -width END
+            LIMIT 1
+            """,
+            (file_id, min_width, min_width),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def set_file_is_manifest(file_id: str, is_manifest: bool) -> None:
+    """写回探测得到的文件类型，供 is_manifest 仍为 NULL 的旧记录使用。"""
+    with get_connection_pool().writer() as conn:
+        conn.execute(
+            "UPDATE files SET is_manifest = ? WHERE file_id = ?",
+            (1 if is_manifest else 0, file_id),
+        )
+
+
+def get_file_chunks(file_id: str) -> list[dict[str, Any]]:
+    """按序号返回大文件的分块索引；普通文件或尚未建立索引的旧记录返回空列表。"""
+    with get_connection_pool().reader() as conn:
+        cursor = conn.execute(
+            """
+            SELECT ordinal, chunk_file_id, chunk_size, byte_offset
+            FROM file_chunks
+            WHERE file_id = ?
+            ORDER BY ordinal
+            """,
+            (file_id,),
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def find_file_by_first_chunk(chunk_file_id: str) -> str | None:
+    """
+    按第一个分块的复合 ID 查找已登记的大文件，用于判断上传任务的清单是否已经发送过。
+    只在恢复任务时调用，不为此单独建索引。
+    """
+    with get_connection_pool().reader() as conn:
+        row = conn.execute(
+            "SELECT file_id FROM file_chunks WHERE ordinal = 0 AND chunk_file_id = ? LIMIT 1",
+            (chunk_file_id,),
+        ).fetchone()
+    return row["file_id"] if row else None
+
+
+def get_chunk_lists(file_ids: list[str]) -> dict[str, list[str] | None]:
+    """
+    批量查询文件的分块复合 ID 列表：清单返回按序号排列的分块，已知的普通文件返回空列表，
+    数据库中没有记录或尚不确定类型的文件返回 None，由调用方回退到读取清单。
+    """
+    unique_ids = list(dict.fromkeys(file_ids))
+    chunk_lists: dict[str, list[str] | None] = {file_id: None for file_id in unique_ids}
+    with get_connection_pool().reader() as conn:
+        for index in range(0, len(unique_ids), DELETE_BATCH_SIZE):
+            batch_ids = unique_ids[index:index + DELETE_BATCH_SIZE]
+            placeholders = ', '.join('?' * len(batch_ids))
+            for row in conn.execute(
+                f"SELECT file_id FROM files WHERE file_id IN ({placeholders}) AND is_manifest = 0",
+                batch_ids,
+            ):
+                chunk_lists[row["file_id"]] = []
+            for row in conn.execute(
+                f"""
+                SELECT file_id, chunk_file_id FROM file_chunks
+                WHERE file_id IN ({placeholders})
+                ORDER BY file_id, ordinal
+                """,
+                batch_ids,
+            ):
+                chunk_list = chunk_lists[row["file_id"]]
+                if chunk_list is None:
+                    chunk_list = chunk_lists[row["file_id"]] = []
+                chunk_list.append(row["chunk_file_id"])
+    return chunk_lists
+
+
+def _write_sync_state(conn: sqlite3.Connection, values: dict[str, int | None]) -> None:
+    for key, value in values.items():
+        if value is None:
+            conn.execute("DELETE FROM sync_state WHERE key = ?", (key,))
+        else:
+            conn.execute(
+                """
+                INSERT INTO sync_state (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+                """,
+                (key, value),
+            )
+
+
+def get_sync_state() -> dict[str, int]:
+    """读取全部同步检查点。"""
+    with get_connection_pool().reader() as conn:
+        return {row["key"]: row["value"] for row in conn.execute("SELECT key, value FROM sync_state")}
+
+
+def set_sync_state(values: dict[str, int | None]) -> None:
+    """写入同步检查点，值为 None 时删除对应的键。"""
+    with get_connection_pool().writer() as conn:
+        _write_sync_state(conn, values)
+
+
+def _resolve_media_kind(media_kind: str | None, images_only: bool) -> str | None:
+    """images_only 是 media_kind="image" 的旧写法。"""
+    return "image" if images_only else media_kind
 
 
 def get_files_page(
     limit: int,
     offset: int = 0,
     *,
+    media_kind: str | None = None,
     images_only: bool = False,
 ) -> list[dict[str, Any]]:
-    """按上传时间倒序读取一页文件。"""
+    """按上传时间倒序读取一页文件，可按类别过滤。"""
     where_clause = ""
     parameters: list[Any] = []
-    if images_only:
-        where_clause = (
-            "WHERE lower(filename) LIKE ? OR lower(filename) LIKE ? "
-            "OR lower(filename) LIKE ? OR lower(filename) LIKE ? "
-            "OR lower(filename) LIKE ? OR lower(filename) LIKE ?"
-        )
-        parameters.extend(("%.jpg", "%.jpeg", "%.png", "%.gif", "%.bmp", "%.webp"))
+    media_kind = _resolve_media_kind(media_kind, images_only)
+    if media_kind is not None:
+        where_clause = "WHERE media_kind = ?"
+        parameters.append(media_kind)
 
     parameters.extend((limit, offset))
-    with _db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                f"""
-                SELECT filename, file_id, filesize, upload_date
-                FROM files
-                {where_clause}
-                ORDER BY upload_date DESC, id DESC
-                LIMIT ? OFFSET ?
-                """,
-                parameters,
+    with get_connection_pool().reader() as conn:
+        cursor = conn.execute(
+            f"""
+            SELECT id, filename, file_id, filesize, upload_date
+            FROM files
+            {where_clause}
+            ORDER BY upload_date DESC, id DESC
+            LIMIT ? OFFSET ?
+            """,
+            parameters,
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def get_files_page_by_cursor(
+    limit: int,
+    *,
+    after: tuple[str, int] | None = None,
+    before: tuple[str, int] | None = None,
+    media_kind: str | None = None,
+    images_only: bool = False,
+) -> tuple[list[dict[str, Any]], bool, bool]:
+    """
+    按 (upload_date, id) 键集分页读取文件，顺序与 get_files_page 一致。
+
+    `after` 读取排在该位置之后（更旧）的一页，`before` 读取排在该位置之前（更新）的一页，
+    两者都直接在 idx_files_upload_date_id（按类别过滤时为 idx_files_media_kind_upload_date_id）
+    上定位，不随页数增加而变慢。
+    返回 (当前页, 是否还有更旧的记录, 是否还有更新的记录)。
+    """
+    conditions: list[str] = []
+    parameters: list[Any] = []
+    media_kind = _resolve_media_kind(media_kind, images_only)
+    if media_kind is not None:
+        conditions.append("media_kind = ?")
+        parameters.append(media_kind)
+
+    order = "DESC"
+    if before is not None:
+        conditions.append("(upload_date, id) > (?, ?)")
+        parameters.extend(before)
+        order = "ASC"
+    elif after is not None:
+        conditions.append("(upload_date, id) < (?, ?)")
+        parameters.extend(after)
+
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # 多取一行用来判断是否还有下一页。
+    parameters.append(limit + 1)
+    with get_connection_pool().reader() as conn:
+        cursor = conn.execute(
+            f"""
+            SELECT id, filename, file_id, filesize, upload_date
+            FROM files
+            {where_clause}
+            ORDER BY upload_date {order}, id {order}
+            LIMIT ?
+            """,
+            parameters,
+        )
+        rows = [dict(row) for row in cursor.fetchall()]
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        rows.reverse()
+        return rows, True, has_more
+    # 沿某个方向翻页时，来时的方向一定还有记录。
+    return rows, has_more, after is not None
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_files(
+    query: str,
+    limit: int,
+    *,
+    after: tuple[float | str, int] | None = None,
+    media_kind: str | None = None,
+) -> tuple[list[dict[str, Any]], bool]:
+    """
+    按文件名搜索，多个关键词之间为“与”关系，均按子串匹配。
+
+    至少有一个关键词不短于 SEARCH_MIN_TRIGRAM_LENGTH 时走 FTS5 索引并按 bm25 相关度排序，
+    更短的关键词作为附加的 LIKE 条件；全部是短关键词时只能按 LIKE 过滤，结果按上传时间倒序。
+    每行的 `sort_key` 与 `id` 即下一页游标的内容，返回 (当前页, 是否还有更多结果)。
+    """
+    terms = query.split()[:SEARCH_MAX_TERMS]
+    if not terms:
+        return [], False
+
+    indexed_terms = [term for term in terms if len(term) >= SEARCH_MIN_TRIGRAM_LENGTH]
+    short_terms = [term for term in terms if len(term) < SEARCH_MIN_TRIGRAM_LENGTH]
+    conditions = ["files.filename LIKE ? ESCAPE '\\'" for _ in short_terms]
+    parameters: list[Any] = [f"%{_escape_like(term)}%" for term in short_terms]
+    if media_kind is not None:
+        conditions.append("files.media_kind = ?")
+        parameters.append(media_kind)
+
+    if indexed_terms:
+        if after is not None and isinstance(after[0], str):
+            raise InvalidCursor(str(after))
+        match_expression = " ".join(
+            '"' + term.replace('"', '""') + '"' for term in indexed_terms
+        )
+        where_clause = "".join(f" AND {condition}" for condition in conditions)
+        cursor_clause = "WHERE (sort_key, id) > (?, ?)" if after is not None else ""
+        sql = f"""
+            SELECT * FROM (
+                SELECT files.id, files.filename, files.file_id, files.filesize,
+                       files.upload_date, files_fts.rank AS sort_key
+                FROM files_fts
+                JOIN files ON files.id = files_fts.rowid
+                WHERE files_fts MATCH ?{where_clause}
             )
-            return [dict(row) for row in cursor.fetchall()]
-        finally:
-            conn.close()
+            {cursor_clause}
+            ORDER BY sort_key, id
+            LIMIT ?
+        """
+        parameters.insert(0, match_expression)
+    else:
+        if after is not None and not isinstance(after[0], str):
+            raise InvalidCursor(str(after))
+        if after is not None:
+            conditions.append("(files.upload_date, files.id) < (?, ?)")
+        sql = f"""
+            SELECT files.id, files.filename, files.file_id, files.filesize,
+                   files.upload_date, files.upload_date AS sort_key
+            FROM files
+            WHERE {' AND '.join(conditions)}
+            ORDER BY files.upload_date DESC, files.id DESC
+            LIMIT ?
+        """
 
+    if after is not None:
+        parameters.extend(after)
+    parameters.append(limit + 1)
+    with get_connection_pool().reader() as conn:
+        rows = [dict(row) for row in conn.execute(sql, parameters).fetchall()]
+    return rows[:limit], len(rows) > limit
 
-def count_files(*, images_only: bool = False) -> int:
-    """返回文件总数，图床页面可只统计图片。"""
+
+def count_files(*, media_kind: str | None = None, images_only: bool = False) -> int:
+    """从聚合计数表读取文件总数，可只统计某一类别，不扫描 files 表。"""
     where_clause = ""
     parameters: tuple[str, ...] = ()
-    if images_only:
-        where_clause = (
-            "WHERE lower(filename) LIKE ? OR lower(filename) LIKE ? "
-            "OR lower(filename) LIKE ? OR lower(filename) LIKE ? "
-            "OR lower(filename) LIKE ? OR lower(filename) LIKE ?"
+    media_kind = _resolve_media_kind(media_kind, images_only)
+    if media_kind is not None:
+        where_clause = "WHERE media_kind = ?"
+        parameters = (media_kind,)
+
+    with get_connection_pool().reader() as conn:
+        cursor = conn.execute(
+            f"SELECT COALESCE(SUM(file_count), 0) FROM file_stats {where_clause}",
+            parameters,
         )
-        parameters = ("%.jpg", "%.jpeg", "%.png", "%.gif", "%.bmp", "%.webp")
+        return int(cursor.fetchone()[0])
 
-    with _db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(f"SELECT COUNT(*) FROM files {where_clause}", parameters)
-            return int(cursor.fetchone()[0])
-        finally:
-            conn.close()
+
+def get_file_stats() -> dict[str, Any]:
+    """返回文件总数、总字节数、图片数量以及按类别、扩展名的分布。"""
+    with get_connection_pool().reader() as conn:
+        rows = conn.execute(
+            """
+            SELECT extension, media_kind, file_count, total_bytes
+            FROM file_stats
+            WHERE file_count > 0
+            ORDER BY file_count DESC, extension
+            """
+        ).fetchall()
+
+    media_kinds: dict[str, dict[str, int]] = {}
+    extensions: dict[str, dict[str, int]] = {}
+    for row in rows:
+        for bucket in (
+            media_kinds.setdefault(row["media_kind"], {"files": 0, "bytes": 0}),
+            extensions.setdefault(row["extension"], {"files": 0, "bytes": 0}),
+        ):
+            bucket["files"] += row["file_count"]
+            bucket["bytes"] += row["total_bytes"]
+
+    return {
+        "total_files": sum(row["file_count"] for row in rows),
+        "total_bytes": sum(row["total_bytes"] for row in rows),
+        "image_files": media_kinds.get("image", {}).get("files", 0),
+        "media_kinds": media_kinds,
+        "extensions": extensions,
+    }
 
 
 def get_all_files() -> list[dict[str, Any]]:
     """从数据库中获取所有文件的元数据。"""
-    with _db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT filename, file_id, filesize, upload_date FROM files ORDER BY upload_date DESC"
-            )
-            return [dict(row) for row in cursor.fetchall()]
-        finally:
-            conn.close()
+    with get_connection_pool().reader() as conn:
+        cursor = conn.execute(
+            "SELECT filename, file_id, filesize, upload_date FROM files ORDER BY upload_date DESC"
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+
+_pending_access: dict[str, int] = {}
+_pending_access_lock = threading.Lock()
+
+
+def record_file_access(file_id: str) -> None:
+    """
+    在内存中记下文件被访问的时间，不写数据库。
+    下载请求路径上只做一次字典赋值，由对账任务通过 flush_file_access 批量写回。
+    """
+    with _pending_access_lock:
+        if file_id in _pending_access or len(_pending_access) < PENDING_ACCESS_MAX:
+            _pending_access[file_id] = int(time.time())
+
+
+def flush_file_access() -> int:
+    """把内存中的访问记录在一个事务内写回 last_accessed_at，返回写回的记录数。"""
+    global _pending_access
+    with _pending_access_lock:
+        pending, _pending_access = _pending_access, {}
+    if not pending:
+        return 0
+
+    with get_connection_pool().writer() as conn:
+        conn.executemany(
+            "UPDATE files SET last_accessed_at = ? WHERE file_id = ?",
+            [(accessed_at, file_id) for file_id, accessed_at in pending.items()],
+        )
+    return len(pending)
+
+
+def get_reconcile_slice(
+    limit: int,
+    *,
+    priority_limit: int = 0,
+    accessed_since: int | None = None,
+) -> list[dict[str, Any]]:
+    """
+    返回本轮需要对账的一批文件 (message_id, file_id)。
+
+    先取 accessed_since 之后被访问、且访问晚于上次确认的行（最多 priority_limit 条），
+    其余名额按 last_verified_at 从旧到新轮转；从未确认过的行排在最前，其中新上传的优先。
+    """
+    if limit <= 0:
+        return []
+
+    rows: dict[int, dict[str, Any]] = {}
+    with get_connection_pool().reader() as conn:
+        if priority_limit > 0 and accessed_since is not None:
+            for row in conn.execute(
+                """
+                SELECT message_id, file_id FROM files
+                WHERE last_accessed_at >= ?
+                  AND last_accessed_at > COALESCE(last_verified_at, 0)
+                  AND message_id IS NOT NULL
+                ORDER BY last_accessed_at DESC
+                LIMIT ?
+                """,
+                (accessed_since, min(priority_limit, limit)),
+            ):
+                rows[row["message_id"]] = dict(row)
+
+        for row in conn.execute(
+            """
+            SELECT message_id, file_id FROM files
+            WHERE message_id IS NOT NULL
+            ORDER BY last_verified_at, id DESC
+            LIMIT ?
+            """,
+            (limit,),
+        ):
+            if len(rows) >= limit:
+                break
+            rows.setdefault(row["message_id"], dict(row))
+
+    return list(rows.values())
+
+
+def mark_files_verified(message_ids: list[int], verified_at: int | None = None) -> int:
+    """在同一个事务中批量写回对账确认时间，返回更新的行数。"""
+    unique_ids = list(dict.fromkeys(int(message_id) for message_id in message_ids))
+    if not unique_ids:
+        return 0
+
+    verified_at = int(time.time()) if verified_at is None else verified_at
+    updated_rows = 0
+    with get_connection_pool().writer() as conn:
+        for index in range(0, len(unique_ids), DELETE_BATCH_SIZE):
+            batch_ids = unique_ids[index:index + DELETE_BATCH_SIZE]
+            updated_rows += conn.execute(
+                f"""
+                UPDATE files SET last_verified_at = ?
+                WHERE message_id IN ({', '.join('?' * len(batch_ids))})
+                """,
+                [verified_at, *batch_ids],
+            ).rowcount
+    return updated_rows
 
 
 def get_file_info(file_id: str) -> dict[str, Any] | None:
     """通过 file_id 获取单个文件的完整元数据。"""
-    with _db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT filename, file_id, filesize, upload_date FROM files WHERE file_id = ?",
-                (file_id,)
-            )
-            result = cursor.fetchone()
-            return dict(result) if result else None
-        finally:
-            conn.close()
+    with get_connection_pool().reader() as conn:
+        cursor = conn.execute(
+            """
+            SELECT filename, file_id, filesize, upload_date, is_manifest
+            FROM files WHERE file_id = ?
+            """,
+            (file_id,)
+        )
+        result = cursor.fetchone()
+        return dict(result) if result else None
 
 
 def get_file_by_id(file_id: str) -> dict[str, Any] | None:
@@ -183,15 +1177,31 @@ def delete_file_metadata(file_id: str) -> bool:
     根据 file_id 从数据库中删除文件元数据。
     返回: 如果成功删除了一行，则为 True，否则为 False。
     """
-    with _db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
-            conn.commit()
-            return cursor.rowcount > 0
-        finally:
-            conn.close()
+    return bool(delete_files_metadata([file_id]))
+
+
+def delete_files_metadata(file_ids: list[str]) -> list[str]:
+    """在同一个事务中删除一批 file_id 对应的元数据，返回真正删除的 file_id。"""
+    unique_ids = list(dict.fromkeys(file_ids))
+    deleted_file_ids: list[str] = []
+    if not unique_ids:
+        return deleted_file_ids
+
+    with get_connection_pool().writer() as conn:
+        for index in range(0, len(unique_ids), DELETE_BATCH_SIZE):
+            batch_ids = unique_ids[index:index + DELETE_BATCH_SIZE]
+            deleted_rows = conn.execute(
+                f"""
+                DELETE FROM files
+                WHERE file_id IN ({', '.join('?' * len(batch_ids))})
+                RETURNING file_id, extension, media_kind, filesize
+                """,
+                batch_ids,
+            ).fetchall()
+            for row in deleted_rows:
+                _adjust_file_stats(conn, row["extension"], row["media_kind"], row["filesize"], -1)
+                deleted_file_ids.append(row["file_id"])
+    return deleted_file_ids
 
 
 def delete_file_by_message_id(message_id: int) -> str | None:
@@ -199,23 +1209,297 @@ def delete_file_by_message_id(message_id: int) -> str | None:
     根据 message_id 从数据库中删除文件元数据，并返回其 file_id。
     因为一个主消息 ID 只对应一个文件，所以可以直接删除。
     """
-    file_id_to_delete = None
-    with _db_lock:
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT file_id FROM files WHERE file_id LIKE ?",
-                (f"{message_id}:%",)
+    deleted_file_ids = delete_files_by_message_ids([message_id])
+    return deleted_file_ids[0] if deleted_file_ids else None
+
+
+def delete_files_by_message_ids(message_ids: list[int]) -> list[str]:
+    """
+    在同一个事务中删除一批消息 ID 对应的文件元数据，返回被删除的 file_id。
+    通过 idx_files_message_id 定位，适合一次处理整条删除事件。
+    """
+    unique_ids = list(dict.fromkeys(int(message_id) for message_id in message_ids))
+    deleted_file_ids: list[str] = []
+    if not unique_ids:
+        return deleted_file_ids
+
+    with get_connection_pool().writer() as conn:
+        for index in range(0, len(unique_ids), DELETE_BATCH_SIZE):
+            batch_ids = unique_ids[index:index + DELETE_BATCH_SIZE]
+            deleted_rows = conn.execute(
+                f"""
+                DELETE FROM files
+                WHERE message_id IN ({', '.join('?' * len(batch_ids))})
+                RETURNING file_id, extension, media_kind, filesize
+                """,
+                batch_ids,
+            ).fetchall()
+            for row in deleted_rows:
+                _adjust_file_stats(conn, row["extension"], row["media_kind"], row["filesize"], -1)
+                deleted_file_ids.append(row["file_id"])
+
+    for file_id in deleted_file_ids:
+        print(f"已从数据库中删除与消息 ID {parse_message_id(file_id)} 关联的文件: {file_id}")
+    return deleted_file_ids
+
+
+UPLOAD_JOB_COLUMNS = (
+    "id, filename, spool_path, total_size, status, uploaded_bytes, file_id, error, created_at, updated_at, "
+    "owner, lease_expires_at"
+)
+
+
+def create_upload_job(
+    job_id: str,
+    filename: str,
+    spool_path: str,
+    total_size: int,
+    *,
+    status: str = "queued",
+) -> dict[str, Any]:
+    """登记一个上传任务并返回其记录；可续传上传会话以 receiving 状态创建。"""
+    now = int(time.time())
+    with get_connection_pool().writer() as conn:
+        row = conn.execute(
+            f"""
+            INSERT INTO upload_jobs (id, filename, spool_path, total_size, status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            RETURNING {UPLOAD_JOB_COLUMNS}
+            """,
+            (job_id, filename, spool_path, total_size, status, now, now),
+        ).fetchone()
+    return dict(row)
+
+
+def get_upload_job(job_id: str) -> dict[str, Any] | None:
+    """读取单个上传任务，附带已完成的分块数。"""
+    with get_connection_pool().reader() as conn:
+        row = conn.execute(
+            f"""
+            SELECT {UPLOAD_JOB_COLUMNS},
+                   (SELECT COUNT(*) FROM upload_job_parts WHERE job_id = upload_jobs.id) AS completed_parts
+            FROM upload_jobs WHERE id = ?
+            """,
+            (job_id,),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def claim_upload_job(job_id: str, owner: str, lease_seconds: int) -> dict[str, Any] | None:
+    """
+    原子地认领一个上传任务并置为 running，返回认领后的记录；任务已被其他 worker 认领时返回 None。
+    只能认领 queued 任务，或租约已过期（包括没有租约的旧记录）的 running 任务。
+    """
+    now = int(time.time())
+    with get_connection_pool().writer() as conn:
+        row = conn.execute(
+            f"""
+            UPDATE upload_jobs
+            SET status = 'running', owner = ?, lease_expires_at = ?, updated_at = ?
+            WHERE id = ? AND (
+                status = 'queued'
+                OR (status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?))
             )
-            result = cursor.fetchone()
-            if result:
-                file_id_to_delete = result[0]
-                cursor.execute("DELETE FROM files WHERE file_id = ?", (file_id_to_delete,))
-                conn.commit()
-                print(
-                    f"已从数据库中删除与消息 ID {message_id} 关联的文件: {file_id_to_delete}"
-                )
-            return file_id_to_delete
-        finally:
-            conn.close()
+            RETURNING {UPLOAD_JOB_COLUMNS}
+            """,
+            (owner, now + lease_seconds, now, job_id, now),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def claim_upload_session(job_id: str, owner: str, lease_seconds: int) -> dict[str, Any] | None:
+    """
+    为转发上传会话中的完整分块认领租约，状态保持 receiving。
+    会话已结束或正由其他 worker 转发时返回 None，同一个分块不会被两个 worker 同时发送。
+    """
+    now = int(time.time())
+    with get_connection_pool().writer() as conn:
+        row = conn.execute(
+            f"""
+            UPDATE upload_jobs SET owner = ?, lease_expires_at = ?
+            WHERE id = ? AND status = 'receiving'
+              AND (owner IS NULL OR lease_expires_at IS NULL OR lease_expires_at < ?)
+            RETURNING {UPLOAD_JOB_COLUMNS}
+            """,
+            (owner, now + lease_seconds, job_id, now),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def queue_upload_session(job_id: str) -> bool:
+    """把数据已收齐的会话交给后台任务；会话已结束或其他 worker 仍在转发分块时返回 False。"""
+    now = int(time.time())
+    with get_connection_pool().writer() as conn:
+        cursor = conn.execute(
+            """
+            UPDATE upload_jobs SET status = 'queued', owner = NULL, lease_expires_at = NULL, updated_at = ?
+            WHERE id = ? AND status = 'receiving'
+              AND (owner IS NULL OR lease_expires_at IS NULL OR lease_expires_at < ?)
+            """,
+            (now, job_id, now),
+        )
+    return cursor.rowcount > 0
+
+
+def touch_upload_session(job_id: str) -> None:
+    """记录会话最近一次收到数据的时间；会话已被结束或认领时不做改动。"""
+    with get_connection_pool().writer() as conn:
+        conn.execute(
+            "UPDATE upload_jobs SET updated_at = ? WHERE id = ? AND status = 'receiving'",
+            (int(time.time()), job_id),
+        )
+
+
+def renew_upload_job_lease(job_id: str, owner: str, lease_seconds: int) -> bool:
+    """延长仍由 owner 执行或转发的任务的租约，任务已被接管或已结束时返回 False。"""
+    with get_connection_pool().writer() as conn:
+        cursor = conn.execute(
+            """
+            UPDATE upload_jobs SET lease_expires_at = ?
+            WHERE id = ? AND owner = ? AND status IN ('receiving', 'running')
+            """,
+            (int(time.time()) + lease_seconds, job_id, owner),
+        )
+    return cursor.rowcount > 0
+
+
+def release_upload_job_leases(owner: str, job_id: str | None = None) -> None:
+    """
+    释放 owner 持有的租约，任务状态不变，其他 worker 可立即接管；
+    worker 停止时释放全部租约，会话转发结束时只释放 job_id 的租约。
+    """
+    with get_connection_pool().writer() as conn:
+        conn.execute(
+            """
+            UPDATE upload_jobs SET owner = NULL, lease_expires_at = NULL
+            WHERE owner = ? AND status IN ('receiving', 'running') AND (? IS NULL OR id = ?)
+            """,
+            (owner, job_id, job_id),
+        )
+
+
+def get_expired_upload_jobs() -> list[str]:
+    """返回租约已过期、执行它的 worker 可能已退出的 running 任务 ID。"""
+    with get_connection_pool().reader() as conn:
+        return [
+            row["id"]
+            for row in conn.execute(
+                """
+                SELECT id FROM upload_jobs
+                WHERE status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                ORDER BY created_at, id
+                """,
+                (int(time.time()),),
+            )
+        ]
+
+
+def get_unfinished_upload_jobs() -> list[dict[str, Any]]:
+    """按创建顺序返回尚未完成的上传任务与仍在接收数据的上传会话，用于应用启动时恢复。"""
+    with get_connection_pool().reader() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT {UPLOAD_JOB_COLUMNS} FROM upload_jobs
+            WHERE status IN ('receiving', 'queued', 'running')
+            ORDER BY created_at, id
+            """
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def set_upload_job_status(
+    job_id: str,
+    status: str,
+    *,
+    file_id: str | None = None,
+    error: str | None = None,
+    owner: str | None = None,
+) -> bool:
+    """
+    更新上传任务状态，file_id 与 error 为 None 时保持原值；离开 running 状态时释放租约。
+    指定 owner 时只更新仍由该 worker 持有的任务，返回是否更新成功。
+    """
+    with get_connection_pool().writer() as conn:
+        cursor = conn.execute(
+            """
+            UPDATE upload_jobs
+            SET status = ?, file_id = COALESCE(?, file_id), error = COALESCE(?, error), updated_at = ?,
+                owner = CASE WHEN ? = 'running' THEN owner END,
+                lease_expires_at = CASE WHEN ? = 'running' THEN lease_expires_at END
+            WHERE id = ? AND (? IS NULL OR owner = ?)
+            """,
+            (status, file_id, error, int(time.time()), status, status, job_id, owner, owner),
+        )
+    return cursor.rowcount > 0
+
+
+def record_upload_job_part(job_id: str, part_index: int, chunk_file_id: str, size: int) -> int:
+    """记录一个已发送成功的分块，返回任务累计已上传的字节数。"""
+    with get_connection_pool().writer() as conn:
+        conn.execute(
+            """
+            INSERT INTO upload_job_parts (job_id, part_index, chunk_file_id, size) VALUES (?, ?, ?, ?)
+            ON CONFLICT(job_id, part_index) DO UPDATE SET
+                chunk_file_id = excluded.chunk_file_id,
+                size = excluded.size
+            """,
+            (job_id, part_index, chunk_file_id, size),
+        )
+        row = conn.execute(
+            """
+            UPDATE upload_jobs
+            SET uploaded_bytes = (SELECT COALESCE(SUM(size), 0) FROM upload_job_parts WHERE job_id = ?),
+                updated_at = ?
+            WHERE id = ?
+            RETURNING uploaded_bytes
+            """,
+            (job_id, int(time.time()), job_id),
+        ).fetchone()
+    return row["uploaded_bytes"] if row else 0
+
+
+def get_upload_job_parts(job_id: str) -> dict[int, str]:
+    """返回任务已完成分块的 {序号: 复合 ID}。"""
+    with get_connection_pool().reader() as conn:
+        return {
+            row["part_index"]: row["chunk_file_id"]
+            for row in conn.execute(
+                "SELECT part_index, chunk_file_id FROM upload_job_parts WHERE job_id = ? ORDER BY part_index",
+                (job_id,),
+            )
+        }
+
+
+def append_event(payload: str) -> int:
+    """写入一条文件更新事件并返回其 ID，同时删除超出保留数量的旧事件。"""
+    with get_connection_pool().writer() as conn:
+        event_id = conn.execute(
+            "INSERT INTO event_log (payload, created_at) VALUES (?, ?)",
+            (payload, int(time.time())),
+        ).lastrowid
+        conn.execute("DELETE FROM event_log WHERE id <= ?", (event_id - EVENT_LOG_MAX_ROWS,))
+    return event_id
+
+
+def get_events_after(last_event_id: int, limit: int) -> list[tuple[int, str]]:
+    """按 ID 顺序返回 last_event_id 之后的事件。"""
+    with get_connection_pool().reader() as conn:
+        return [
+            (row["id"], row["payload"])
+            for row in conn.execute(
+                "SELECT id, payload FROM event_log WHERE id > ? ORDER BY id LIMIT ?",
+                (last_event_id, limit),
+            )
+        ]
+
+
+def get_last_event_id() -> int:
+    """返回事件日志中最新一条事件的 ID，没有事件时返回 0。"""
+    with get_connection_pool().reader() as conn:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM event_log").fetchone()[0]
+
+
+def get_first_event_id() -> int | None:
+    """返回事件日志中仍保留的最早一条事件的 ID，没有事件时返回 None。"""
+    with get_connection_pool().reader() as conn:
+        return conn.execute("SELECT MIN(id) FROM event_log").fetchone()[0]
@@ -1,42 +1,291 @@
 import asyncio
 import json
+import time
+from collections import deque
 from typing import Any
 
-# 为每个 SSE 客户端维护独立队列，避免单消费者队列导致事件丢失。
-_subscribers: set[asyncio.Queue[str]] = set()
-_subscribers_lock = asyncio.Lock()
+from . import database
 
+# SQLite 事件总线轮询 event_log 的间隔，以及单次读取的最大行数。
+SQLITE_EVENT_POLL_INTERVAL_SECONDS = 0.2
+SQLITE_EVENT_FETCH_LIMIT = 500
+# 每个订阅者队列的容量、进程内保留用于重放的最近事件数，以及单次重放的最大事件数。
+SUBSCRIBER_QUEUE_SIZE = 100
+EVENT_REPLAY_BUFFER_SIZE = 1000
+EVENT_REPLAY_MAX_EVENTS = 1000
 
-async def subscribe_file_updates() -> asyncio.Queue[str]:
-    """注册一个文件更新订阅者，并返回其专属事件队列。"""
-    queue: asyncio.Queue[str] = asyncio.Queue(maxsize=100)
-    async with _subscribers_lock:
-        _subscribers.add(queue)
-    return queue
+# 订阅者队列中的事件为 (事件 ID, JSON 字符串)。
+# 队列溢出时清空并放入 LAGGED 标记，读取方据此从最后收到的事件 ID 重放。
+FileUpdate = tuple[int, str]
+LAGGED: FileUpdate = (0, "")
+RESET_MESSAGE = json.dumps({"action": "reset"})
 
 
-async def unsubscribe_file_updates(queue: asyncio.Queue[str]) -> None:
+class MemoryEventBus:
+    """
+    进程内事件总线。为每个 SSE 客户端维护独立队列，避免单消费者队列导致事件丢失；
+    只有同一进程内的客户端能收到事件。
+
+    事件 ID 单调递增，起点取启动时的微秒时间戳，重启前的 ID 不会与之后的混淆；
+    最近的事件保存在环形缓冲中，断线重连的客户端据此补发错过的事件。
+    """
+
+    def __init__(self):
+        self._subscribers: set[asyncio.Queue[FileUpdate]] = set()
+        self._subscribers_lock = asyncio.Lock()
+        self._last_event_id = time.time_ns() // 1000
+        self._recent_events: deque[FileUpdate] = deque(maxlen=EVENT_REPLAY_BUFFER_SIZE)
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def subscribe(self, last_event_id: int | None = None) -> tuple[asyncio.Queue[FileUpdate], int]:
+        """
+        注册订阅者，返回 (事件队列, 队列中事件的起始 ID)，队列只会收到大于起始 ID 的事件。
+        传入 last_event_id 时先把之后的事件放入队列；无法完整补发时放入一条 reset 事件。
+        """
+        queue: asyncio.Queue[FileUpdate] = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        async with self._subscribers_lock:
+            current_event_id = self._last_event_id
+            start_event_id = current_event_id
+            if last_event_id is not None and last_event_id != current_event_id:
+                start_event_id = min(last_event_id, current_event_id)
+                replayed = await self._replay(last_event_id)
+                if replayed is None:
+                    queue.put_nowait((current_event_id, RESET_MESSAGE))
+                else:
+                    # 补发事件超过队列容量时合并为一条批量事件。
+                    for event in coalesce_events(replayed) if len(replayed) >= SUBSCRIBER_QUEUE_SIZE else replayed:
+                        queue.put_nowait(event)
+            self._subscribers.add(queue)
+        return queue, start_event_id
+
+    async def unsubscribe(self, queue: asyncio.Queue[FileUpdate]) -> None:
+        async with self._subscribers_lock:
+            self._subscribers.discard(queue)
+
+    async def replay(self, last_event_id: int) -> list[FileUpdate] | None:
+        """返回 last_event_id 之后已广播的事件；缺口无法补齐时返回 None。"""
+        async with self._subscribers_lock:
+            return await self._replay(last_event_id)
+
+    async def _replay(self, last_event_id: int) -> list[FileUpdate] | None:
+        if last_event_id > self._last_event_id:
+            return None
+        if last_event_id == self._last_event_id:
+            return []
+        if not self._recent_events or last_event_id < self._recent_events[0][0] - 1:
+            return None
+        return [event for event in self._recent_events if event[0] > last_event_id]
+
+    async def publish(self, message: str) -> None:
+        self._last_event_id += 1
+        await self._deliver(self._last_event_id, message)
+
+    async def _deliver(self, event_id: int, message: str) -> None:
+        """记录事件并放入本进程所有订阅者的队列。"""
+        async with self._subscribers_lock:
+            self._recent_events.append((event_id, message))
+            self._last_event_id = max(self._last_event_id, event_id)
+            subscribers = tuple(self._subscribers)
+
+        for queue in subscribers:
+            try:
+                queue.put_nowait((event_id, message))
+            except asyncio.QueueFull:
+                # 慢连接的队列已满：清空并标记，由读取方从最后收到的事件 ID 重放，
+                # 避免广播被单个慢连接阻塞，也不会悄悄丢失事件。
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(LAGGED)
+
+
+class SqliteEventBus(MemoryEventBus):
+    """
+    基于 SQLite event_log 的跨进程事件总线，适合 `uvicorn --workers N` 多进程部署。
+
+    发布事件只写入 event_log；每个进程各自运行一个轮询任务读取新行，
+    再推送给本进程的订阅者，所以任一进程发布的事件都能到达所有进程的 SSE 客户端。
+    本进程发布后会立即唤醒轮询任务，不必等到下一个轮询周期。
+    """
+
+    def __init__(self, poll_interval: float = SQLITE_EVENT_POLL_INTERVAL_SECONDS):
+        super().__init__()
+        self.poll_interval = poll_interval
+        self._last_event_id = 0
+        self._wakeup = asyncio.Event()
+        self._tail_task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._tail_task:
+            return
+        # 只推送启动之后发布的事件；事件 ID 沿用 event_log 的行 ID，各进程一致。
+        self._last_event_id = await asyncio.to_thread(database.get_last_event_id)
+        self._tail_task = asyncio.create_task(self._tail_loop())
+
+    async def stop(self) -> None:
+        if not self._tail_task:
+            return
+        self._tail_task.cancel()
+        try:
+            await self._tail_task
+        except asyncio.CancelledError:
+            pass
+        self._tail_task = None
+
+    async def publish(self, message: str) -> None:
+        await asyncio.to_thread(database.append_event, message)
+        self._wakeup.set()
+
+    async def _replay(self, last_event_id: int) -> list[FileUpdate] | None:
+        """
+        从 event_log 重放，客户端可以重连到任意一个 worker 进程。
+        只补发本进程已推送过的事件，之后的事件由轮询任务送达。
+        """
+        if last_event_id > self._last_event_id:
+            return None
+        if last_event_id == self._last_event_id:
+            return []
+        first_event_id = await asyncio.to_thread(database.get_first_event_id)
+        if first_event_id is None or last_event_id < first_event_id - 1:
+            return None
+        events = await asyncio.to_thread(database.get_events_after, last_event_id, EVENT_REPLAY_MAX_EVENTS + 1)
+        events = [event for event in events if event[0] <= self._last_event_id]
+        if len(events) > EVENT_REPLAY_MAX_EVENTS:
+            return None
+        return events
+
+    async def _tail_loop(self) -> None:
+        while True:
+            try:
+                await self._deliver_new_events()
+            except Exception as exc:
+                print(f"读取事件日志时出错: {exc}")
+
+            # 不用 wait_for：唤醒与取消同时发生时它可能吞掉取消，导致 stop 无法结束。
+            try:
+                async with asyncio.timeout(self.poll_interval):
+                    await self._wakeup.wait()
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _deliver_new_events(self) -> None:
+        while True:
+            events = await asyncio.to_thread(
+                database.get_events_after,
+                self._last_event_id,
+                SQLITE_EVENT_FETCH_LIMIT,
+            )
+            for event_id, message in events:
+                await self._deliver(event_id, message)
+            if len(events) < SQLITE_EVENT_FETCH_LIMIT:
+                return
+
+
+_event_bus: MemoryEventBus = MemoryEventBus()
+
+
+def create_event_bus(backend: str) -> MemoryEventBus:
+    """根据配置创建事件总线，未知的后端名称回退到进程内总线。"""
+    if backend == "sqlite":
+        return SqliteEventBus()
+    if backend != "memory":
+        print(f"未知的事件总线后端 {backend!r}，已回退到 memory。")
+    return MemoryEventBus()
+
+
+async def start_event_bus(backend: str) -> None:
+    """切换到指定后端并启动，由应用生命周期调用。"""
+    global _event_bus
+    await _event_bus.stop()
+    _event_bus = create_event_bus(backend)
+    await _event_bus.start()
+
+
+async def stop_event_bus() -> None:
+    await _event_bus.stop()
+
+
+async def subscribe_file_updates(
+    last_event_id: int | None = None,
+) -> tuple[asyncio.Queue[FileUpdate], int]:
+    """注册一个文件更新订阅者，返回其专属事件队列与队列中事件的起始 ID。"""
+    return await _event_bus.subscribe(last_event_id)
+
+
+async def unsubscribe_file_updates(queue: asyncio.Queue[FileUpdate]) -> None:
     """取消文件更新订阅。"""
-    async with _subscribers_lock:
-        _subscribers.discard(queue)
+    await _event_bus.unsubscribe(queue)
+
+
+async def replay_file_updates(last_event_id: int) -> list[FileUpdate] | None:
+    """返回 last_event_id 之后的事件，无法完整补发时返回 None。"""
+    return await _event_bus.replay(last_event_id)
+
+
+def coalesce_events(events: list[FileUpdate]) -> list[FileUpdate]:
+    """
+    把一批事件合并为一条 batch 事件，ID 取其中最大的事件 ID。
+
+    新增与删除按顺序折算为最终结果：同一文件先新增后删除只保留删除，
+    多次新增只保留最后一次；上传任务进度只保留每个任务的最新状态，其余事件原样放入 events。
+    """
+    if len(events) <= 1:
+        return events
+
+    added: dict[str, dict[str, Any]] = {}
+    deleted: dict[str, None] = {}
+    jobs: dict[str, dict[str, Any]] = {}
+    others: list[dict[str, Any]] = []
+    for _, message in events:
+        payload = json.loads(message)
+        action = payload.get("action")
+        if action == "add":
+            deleted.pop(payload["file_id"], None)
+            added.pop(payload["file_id"], None)
+            added[payload["file_id"]] = {key: value for key, value in payload.items() if key != "action"}
+        elif action in ("delete", "delete_many"):
+            file_ids = payload["file_ids"] if action == "delete_many" else [payload["file_id"]]
+            for file_id in file_ids:
+                added.pop(file_id, None)
+                deleted[file_id] = None
+        elif action == "job":
+            jobs.pop(payload["job_id"], None)
+            jobs[payload["job_id"]] = payload
+        elif action == "reset":
+            # reset 之后客户端会重新加载列表，之前的事件都可以丢弃。
+            added.clear()
+            deleted.clear()
+            jobs.clear()
+            others = [payload]
+        else:
+            others.append(payload)
+
+    batch = {
+        "action": "batch",
+        "deleted": list(deleted),
+        "added": list(added.values()),
+        "events": [*others, *jobs.values()],
+    }
+    return [(max(event_id for event_id, _ in events), json.dumps(batch, ensure_ascii=False))]
 
 
 async def publish_file_update(payload: dict[str, Any] | str) -> None:
     """向所有已连接客户端广播文件更新事件。"""
     message = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+    await _event_bus.publish(message)
 
-    async with _subscribers_lock:
-        subscribers = tuple(_subscribers)
-
-    for queue in subscribers:
-        if queue.full():
-            try:
-                queue.get_nowait()
-            except asyncio.QueueEmpty:
-                pass
 
-        try:
-            queue.put_nowait(message)
-        except asyncio.QueueFull:
-            # 队列仍然满时直接丢弃最新事件，避免广播被单个慢连接阻塞。
-            print("警告: 文件更新事件队列已满，已跳过一个客户端事件。")
+async def publish_files_deleted(file_ids: list[str]) -> None:
+    """
+    广播文件删除事件。多个文件合并为一条 delete_many 事件，
+    避免批量删除时逐条推送占满客户端队列。
+    """
+    if len(file_ids) == 1:
+        await publish_file_update({"action": "delete", "file_id": file_ids[0]})
+    elif file_ids:
+        await publish_file_update({"action": "delete_many", "file_ids": list(file_ids)})
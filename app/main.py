@@ -34,7 +34,7 @@ async def auth_middleware(request: Request, call_next):
     protected_paths = ["/", "/settings", "/image_hosting"]
     
     # 定义公共路径，这些路径不应被拦截
-    public_paths = ["/pwd", "/static", "/api", "/d"]
+    public_paths = ["/pwd", "/static", "/api", "/d", "/t"]
 
     request_path = request.url.path
     
@@ -9,7 +9,8 @@ from starlette.templating import Jinja2Templates
 
 from . import database
 from .core.config import Settings, get_active_password, get_settings
-from .utils.file_paths import build_file_path
+from .utils.cursors import InvalidCursor, build_page_cursors, decode_cursor
+from .utils.file_paths import build_file_path, build_thumbnail_path
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
@@ -20,19 +21,59 @@ PAGE_SIZE = 50
 _login_attempts: dict[str, list[float]] = {}
 
 
-async def _get_page(page: int, *, images_only: bool = False) -> tuple[list[dict], int]:
+async def _get_page(
+    page: int,
+    *,
+    cursor: str | None = None,
+    before: str | None = None,
+    images_only: bool = False,
+) -> dict:
+    """
+    读取列表页数据。带游标时走键集分页，只有旧链接 `?page=N` 才按偏移量分页；
+    无法解析的游标按第一页处理。
+    """
     page = max(page, 1)
-    offset = (page - 1) * PAGE_SIZE
-    files, total = await asyncio.gather(
-        asyncio.to_thread(
-            database.get_files_page,
-            PAGE_SIZE,
-            offset,
-            images_only=images_only,
-        ),
-        asyncio.to_thread(database.count_files, images_only=images_only),
-    )
-    return files, max(1, math.ceil(total / PAGE_SIZE))
+    try:
+        after_key = decode_cursor(cursor) if cursor else None
+        before_key = decode_cursor(before) if before else None
+    except InvalidCursor:
+        after_key = before_key = None
+
+    total_task = asyncio.to_thread(database.count_files, images_only=images_only)
+    if after_key is None and before_key is None and page > 1:
+        offset = (page - 1) * PAGE_SIZE
+        files, total = await asyncio.gather(
+            asyncio.to_thread(
+                database.get_files_page,
+                PAGE_SIZE,
+                offset,
+                images_only=images_only,
+            ),
+            total_task,
+        )
+        has_older, has_newer = offset + len(files) < total, True
+    else:
+        (files, has_older, has_newer), total = await asyncio.gather(
+            asyncio.to_thread(
+                database.get_files_page_by_cursor,
+                PAGE_SIZE,
+                after=after_key,
+                before=before_key,
+                images_only=images_only,
+            ),
+            total_task,
+        )
+        if after_key is not None or before_key is not None:
+            page = None
+
+    next_cursor, prev_cursor = build_page_cursors(files, has_older=has_older, has_newer=has_newer)
+    return {
+        "files": files,
+        "page": page,
+        "total_pages": max(1, math.ceil(total / PAGE_SIZE)),
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+    }
 
 
 def _check_login_rate_limit(client_host: str) -> None:
@@ -58,6 +99,7 @@ def _serialize_file_for_page(file_info: dict, settings: Settings) -> dict:
         **file_info,
         "path": path,
         "url": f"{settings.BASE_URL.strip('/')}{path}",
+        "thumbnail_path": build_thumbnail_path(file_info["file_id"]),
     }
 
 
@@ -65,19 +107,22 @@ def _serialize_file_for_page(file_info: dict, settings: Settings) -> dict:
 async def main_page(
     request: Request,
     page: int = 1,
+    cursor: str | None = None,
+    before: str | None = None,
     settings: Settings = Depends(get_settings),
 ):
     """提供主页，展示文件上传区域和分页文件列表。"""
-    files, total_pages = await _get_page(page)
-    serialized_files = [_serialize_file_for_page(file_info, settings) for file_info in files]
+    page_data = await _get_page(page, cursor=cursor, before=before)
+    serialized_files = [
+        _serialize_file_for_page(file_info, settings) for file_info in page_data["files"]
+    ]
     return templates.TemplateResponse(
         request,
         "index.html",
         {
             "request": request,
+            **page_data,
             "files": serialized_files,
-            "page": max(page, 1),
-            "total_pages": total_pages,
         },
     )
 
@@ -127,19 +172,20 @@ async def submit_password(request: Request, password: str = Form(...)):
 async def image_hosting_page(
     request: Request,
     page: int = 1,
+    cursor: str | None = None,
+    before: str | None = None,
     settings: Settings = Depends(get_settings),
 ):
     """提供图床页面，并分页展示已上传图片。"""
-    files, total_pages = await _get_page(page, images_only=True)
-    images = [_serialize_file_for_page(file_info, settings) for file_info in files]
+    page_data = await _get_page(page, cursor=cursor, before=before, images_only=True)
+    images = [_serialize_file_for_page(file_info, settings) for file_info in page_data.pop("files")]
     return templates.TemplateResponse(
         request,
         "image_hosting.html",
         {
             "request": request,
+            **page_data,
             "images": images,
-            "page": max(page, 1),
-            "total_pages": total_pages,
         },
     )
 
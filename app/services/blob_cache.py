@@ -0,0 +1,299 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from functools import lru_cache
+from typing import Any, BinaryIO
+
+from ..core.config import get_settings
+
+BLOB_SUFFIX = ".blob"
+TEMP_SUFFIX = ".tmp"
+# 写入缓存时攒够这么多字节再交给线程写盘，不必每个小块都切换一次线程。
+BLOB_WRITE_BUFFER_BYTES = 1024 * 1024
+# 超过这么久没有写入的临时文件视为遗留文件；其他 worker 正在写入的临时文件不受影响。
+STALE_TEMP_SECONDS = 60 * 60
+# 提交新文件时按本进程累计的大小判断是否超出容量，超出时才扫描目录；
+# 其他 worker 写入的文件每隔这么久通过一次扫描计入。
+BLOB_CACHE_RESCAN_SECONDS = 60.0
+
+
+class BlobCacheWriter:
+    """边向客户端输出边写入缓存的临时文件，完整结束后才提交；写盘在线程中进行。"""
+
+    def __init__(
+        self,
+        cache: "BlobCache",
+        key: str,
+        temp_path: str,
+        handle: BinaryIO,
+        expected_size: int | None,
+    ):
+        self.cache = cache
+        self.key = key
+        self.temp_path = temp_path
+        self.handle: BinaryIO | None = handle
+        self.expected_size = expected_size
+        self.size = 0
+        self._buffer = bytearray()
+
+    async def write(self, data: bytes) -> None:
+        if self.handle is None:
+            return
+
+        self.size += len(data)
+        if self.size > self.cache.max_file_bytes:
+            await self.abort()
+            return
+
+        self._buffer += data
+        if len(self._buffer) < BLOB_WRITE_BUFFER_BYTES:
+            return
+
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        try:
+            await asyncio.to_thread(self.handle.write, data)
+        except OSError as exc:
+            print(f"写入下载缓存失败，已放弃缓存 {self.key}: {exc}")
+            await self.abort()
+
+    async def commit(self) -> bool:
+        """写完剩余数据，把临时文件移动到正式位置并计入缓存大小，超出容量时执行淘汰。"""
+        if self.handle is None:
+            return False
+
+        if self.expected_size is not None and self.size != self.expected_size:
+            await self.abort()
+            return False
+
+        handle, self.handle = self.handle, None
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        try:
+            replaced_size = await asyncio.to_thread(self._commit_file, handle, data)
+        except OSError as exc:
+            print(f"提交下载缓存失败 {self.key}: {exc}")
+            await asyncio.to_thread(self._remove_temp_file, None)
+            return False
+
+        await self.cache._record_commit(self.size, replaced_size)
+        return True
+
+    async def abort(self) -> None:
+        handle, self.handle = self.handle, None
+        self._buffer.clear()
+        await asyncio.to_thread(self._remove_temp_file, handle)
+
+    def _commit_file(self, handle: BinaryIO, data: bytes) -> int | None:
+        """写完并替换正式文件，返回被替换的旧文件大小，原先不存在时返回 None。"""
+        try:
+            handle.write(data)
+        finally:
+            handle.close()
+        path = self.cache.path_for(self.key)
+        try:
+            replaced_size = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced_size = None
+        os.replace(self.temp_path, path)
+        BlobCache._touch(path)
+        return replaced_size
+
+    def _remove_temp_file(self, handle: BinaryIO | None) -> None:
+        if handle is not None:
+            handle.close()
+        try:
+            os.unlink(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+
+class BlobCache:
+    """
+    按 file_id 缓存文件内容的本地磁盘缓存，总大小超限时按 LRU 淘汰。
+
+    缓存目录本身就是索引：命中时更新文件的修改时间，淘汰时扫描目录，
+    按修改时间从旧到新删除超出容量的部分。本进程提交的文件计入累计大小，
+    超出容量或距上次扫描超过 BLOB_CACHE_RESCAN_SECONDS 时才重新扫描，
+    多个 worker 进程共用同一个目录时总占用不会按进程数成倍增加。
+    磁盘读写都在线程中进行，不阻塞事件循环。
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_file_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = min(max_file_bytes, max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self.total_bytes, self.entries, evicted = self._scan_and_evict()
+        self.evictions += evicted
+        self._last_scan = time.monotonic()
+
+    @staticmethod
+    def _digest(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{self._digest(key)}{BLOB_SUFFIX}")
+
+    @staticmethod
+    def _touch(path: str) -> bool:
+        """把文件的修改时间设为当前时间（纳秒精度），作为 LRU 顺序；文件不存在时返回 False。"""
+        now = time.time_ns()
+        try:
+            os.utime(path, ns=(now, now))
+        except FileNotFoundError:
+            return False
+        return True
+
+    @staticmethod
+    def _unlink(path: str) -> None:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            # 其他 worker 已经删除。
+            pass
+
+    def _scan_and_evict(self) -> tuple[int, int, int]:
+        """
+        扫描缓存目录，删除遗留的临时文件并把总大小压回容量以内。
+        返回 (总字节数, 条目数, 淘汰数)。
+        """
+        stale_before = time.time() - STALE_TEMP_SECONDS
+        blobs: list[tuple[int, str, int]] = []
+        for entry in os.scandir(self.directory):
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.endswith(TEMP_SUFFIX):
+                if stat.st_mtime < stale_before:
+                    self._unlink(entry.path)
+            elif entry.name.endswith(BLOB_SUFFIX):
+                blobs.append((stat.st_mtime_ns, entry.path, stat.st_size))
+
+        total_bytes = sum(size for _, _, size in blobs)
+        evicted = 0
+        for _, path, size in sorted(blobs):
+            if total_bytes <= self.max_bytes:
+                break
+            self._unlink(path)
+            total_bytes -= size
+            evicted += 1
+        return total_bytes, len(blobs) - evicted, evicted
+
+    async def _enforce_limit(self) -> None:
+        self.total_bytes, self.entries, evicted = await asyncio.to_thread(self._scan_and_evict)
+        self.evictions += evicted
+        self._last_scan = time.monotonic()
+
+    async def _record_commit(self, size: int, replaced_size: int | None) -> None:
+        """把新提交的文件计入累计大小，超出容量或到了定期扫描的时间才扫描目录。"""
+        self.total_bytes += size - (replaced_size or 0)
+        if replaced_size is None:
+            self.entries += 1
+        if (
+            self.total_bytes > self.max_bytes
+            or time.monotonic() - self._last_scan >= BLOB_CACHE_RESCAN_SECONDS
+        ):
+            await self._enforce_limit()
+
+    async def open_blob(self, key: str) -> tuple[BinaryIO, int] | None:
+        """
+        命中时返回已打开的缓存文件及其大小，并更新修改时间；其他 worker 写入的文件同样能命中。
+        文件描述符在返回前就已打开，之后即使被其他 worker 淘汰也能完整读出。
+        """
+        path = self.path_for(key)
+
+        def open_file() -> tuple[BinaryIO, int] | None:
+            try:
+                handle = open(path, "rb")
+            except FileNotFoundError:
+                return None
+            self._touch(path)
+            return handle, os.fstat(handle.fileno()).st_size
+
+        opened = await asyncio.to_thread(open_file)
+        if opened is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return opened
+
+    def admits(self, size: int | None) -> bool:
+        """准入策略：只缓存大小已知且不超过单文件上限的内容。"""
+        return size is not None and 0 < size <= self.max_file_bytes
+
+    async def open_writer(self, key: str, expected_size: int | None) -> BlobCacheWriter | None:
+        if not self.admits(expected_size):
+            self.rejections += 1
+            return None
+
+        def create_temp_file() -> tuple[str, BinaryIO]:
+            descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix=TEMP_SUFFIX)
+            return temp_path, os.fdopen(descriptor, "wb")
+
+        try:
+            temp_path, handle = await asyncio.to_thread(create_temp_file)
+        except OSError as exc:
+            print(f"创建下载缓存临时文件失败: {exc}")
+            return None
+        return BlobCacheWriter(self, key, temp_path, handle, expected_size)
+
+    async def store(self, key: str, content: bytes) -> bool:
+        """直接缓存一段已经完整读入内存的内容。"""
+        writer = await self.open_writer(key, len(content))
+        if writer is None:
+            return False
+        await writer.write(content)
+        return await writer.commit()
+
+    async def discard(self, key: str) -> None:
+        path = self.path_for(key)
+
+        def remove_file() -> int | None:
+            try:
+                size = os.stat(path).st_size
+                os.unlink(path)
+            except FileNotFoundError:
+                return None
+            return size
+
+        size = await asyncio.to_thread(remove_file)
+        if size is not None:
+            self.total_bytes -= size
+            self.entries -= 1
+
+    def stats(self) -> dict[str, Any]:
+        # total_bytes 与 entries 为最近一次扫描目录的结果加上本进程之后的增减。
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "rejections": self.rejections,
+            "entries": self.entries,
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "max_file_bytes": self.max_file_bytes,
+        }
+
+
+@lru_cache()
+def get_blob_cache() -> BlobCache | None:
+    """本地下载缓存工厂，未启用时返回 None。"""
+    settings = get_settings()
+    if not settings.BLOB_CACHE_ENABLED:
+        return None
+
+    return BlobCache(
+        directory=settings.BLOB_CACHE_DIR,
+        max_bytes=settings.BLOB_CACHE_MAX_BYTES,
+        max_file_bytes=settings.BLOB_CACHE_MAX_FILE_BYTES,
+    )
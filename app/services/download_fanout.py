@@ -0,0 +1,283 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, AsyncIterator, Callable
+
+from fastapi import Depends
+
+from ..core.config import Settings, get_settings
+
+# 每个订阅者最多缓冲的字节数；后加入的请求可以从开头补齐的字节数，超过后不再接受新订阅者。
+DEFAULT_FANOUT_SUBSCRIBER_BUFFER_BYTES = 8 * 1024 * 1024
+DEFAULT_FANOUT_JOIN_WINDOW_BYTES = 4 * 1024 * 1024
+# 慢连接拖住其他订阅者超过该时长后被摘除，改为自己回源。
+FANOUT_SLOW_CONSUMER_GRACE_SECONDS = 2.0
+
+# 订阅者被摘除后的回源函数，参数为已经输出的字节数，返回从该偏移开始的数据。
+ResumeCallback = Callable[[int], AsyncIterator[bytes]]
+
+
+class _FanoutSubscriber:
+    def __init__(self, initial_chunks: list[bytes]):
+        self.chunks: deque[bytes] = deque(initial_chunks)
+        self.buffered = sum(len(chunk) for chunk in initial_chunks)
+        self.delivered = 0
+        self.detached = False
+        self.finished = False
+        self.error: BaseException | None = None
+        self.wakeup = asyncio.Event()
+
+    def push(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self.buffered += len(chunk)
+        self.wakeup.set()
+
+    def finish(self, error: BaseException | None) -> None:
+        self.finished = True
+        self.error = error
+        self.wakeup.set()
+
+
+class FanoutStream:
+    """
+    同一个文件的一次上游读取，结果分发给所有订阅者。
+
+    每个订阅者有独立的有界缓冲；上游按最慢的订阅者限速，
+    某个订阅者的缓冲已满而其他订阅者还在等待时，超过宽限期就把它摘除，
+    它输出完已缓冲的数据后从当前偏移自行回源，不再拖慢其他人。
+    """
+
+    def __init__(
+        self,
+        on_release: Callable[["FanoutStream"], None],
+        *,
+        subscriber_buffer_bytes: int,
+        join_window_bytes: int,
+        slow_consumer_grace_seconds: float,
+    ):
+        self.subscriber_buffer_bytes = subscriber_buffer_bytes
+        self.join_window_bytes = join_window_bytes
+        self.slow_consumer_grace_seconds = slow_consumer_grace_seconds
+        self._on_release = on_release
+        self._released = False
+        self._subscribers: set[_FanoutSubscriber] = set()
+        # 开头的数据保留在内存中，供稍后加入的订阅者补齐；超过窗口后置为 None。
+        self._prefix: list[bytes] | None = []
+        self._prefix_bytes = 0
+        self._started = asyncio.Event()
+        self._start_ok = False
+        self._room = asyncio.Event()
+        self._done = False
+        self._completed = False
+        self._error: BaseException | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def joinable(self) -> bool:
+        # 已经读完且内容都在补齐窗口内时，仍可以直接从内存输出。
+        return self._prefix is not None and (not self._done or self._completed)
+
+    async def wait_started(self) -> bool:
+        """等待发起请求的一方打开上游，返回是否成功。"""
+        await self._started.wait()
+        return self._start_ok
+
+    def start(self, body: AsyncGenerator[bytes, None]) -> None:
+        """开始读取上游响应体并分发。"""
+        self._start_ok = True
+        self._started.set()
+        self._task = asyncio.create_task(self._pump(body))
+
+    def fail(self) -> None:
+        """上游打开失败：等待中的请求各自回源，以便返回正确的状态码。"""
+        self._done = True
+        self._started.set()
+        self._release()
+
+    def subscribe(self, resume: ResumeCallback) -> AsyncIterator[bytes]:
+        """
+        输出完整的文件内容。订阅者在调用时立即登记，而不是等到开始迭代，
+        发起方先订阅再调用 start，分发不会在它加入前越过补齐窗口。
+        开头的数据已经不在内存中时直接回源；被判定为慢连接而摘除后，从已输出的偏移继续回源。
+        """
+        if not self.joinable:
+            return resume(0)
+
+        subscriber = _FanoutSubscriber(list(self._prefix or ()))
+        if self._completed:
+            subscriber.finish(None)
+        else:
+            self._subscribers.add(subscriber)
+        return self._iter_subscriber(subscriber, resume)
+
+    async def _iter_subscriber(
+        self,
+        subscriber: _FanoutSubscriber,
+        resume: ResumeCallback,
+    ) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                if subscriber.chunks:
+                    chunk = subscriber.chunks.popleft()
+                    subscriber.buffered -= len(chunk)
+                    subscriber.delivered += len(chunk)
+                    self._room.set()
+                    yield chunk
+                    continue
+                if subscriber.detached:
+                    break
+                if subscriber.finished:
+                    if subscriber.error is not None:
+                        raise subscriber.error
+                    return
+                subscriber.wakeup.clear()
+                await subscriber.wakeup.wait()
+        finally:
+            self._unsubscribe(subscriber)
+
+        async for chunk in resume(subscriber.delivered):
+            yield chunk
+
+    def _unsubscribe(self, subscriber: _FanoutSubscriber) -> None:
+        self._subscribers.discard(subscriber)
+        self._room.set()
+        if not self._subscribers and not self.joinable and self._task and not self._done:
+            # 没有人再读，也不会有新订阅者加入，停止读取上游。
+            self._task.cancel()
+
+    def _release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._on_release(self)
+
+    async def _wait_for_room(self) -> None:
+        """等所有订阅者的缓冲都有空间；慢连接拖住其他人超过宽限期时将其摘除。"""
+        blocked_since: float | None = None
+        while True:
+            full = [
+                subscriber for subscriber in self._subscribers
+                if subscriber.buffered >= self.subscriber_buffer_bytes
+            ]
+            if not full:
+                return
+
+            timeout = None
+            if len(full) < len(self._subscribers):
+                now = time.monotonic()
+                blocked_since = blocked_since or now
+                timeout = blocked_since + self.slow_consumer_grace_seconds - now
+                if timeout <= 0:
+                    for subscriber in full:
+                        subscriber.detached = True
+                        subscriber.wakeup.set()
+                        self._subscribers.discard(subscriber)
+                    blocked_since = None
+                    continue
+            else:
+                # 所有订阅者都慢时没有人被拖累，按最慢的速度继续即可。
+                blocked_since = None
+
+            self._room.clear()
+            try:
+                async with asyncio.timeout(timeout):
+                    await self._room.wait()
+            except TimeoutError:
+                pass
+
+    async def _pump(self, body: AsyncGenerator[bytes, None]) -> None:
+        try:
+            async for chunk in body:
+                if self._prefix is not None:
+                    if self._prefix_bytes + len(chunk) <= self.join_window_bytes:
+                        self._prefix.append(chunk)
+                        self._prefix_bytes += len(chunk)
+                    else:
+                        # 超出补齐窗口后新的请求另起一次分发。
+                        self._prefix = None
+                        self._release()
+                if not self._subscribers and self._prefix is None:
+                    return
+                for subscriber in tuple(self._subscribers):
+                    subscriber.push(chunk)
+                await self._wait_for_room()
+            self._completed = True
+        except Exception as exc:
+            self._error = exc
+        finally:
+            self._done = True
+            self._release()
+            for subscriber in tuple(self._subscribers):
+                if self._completed or self._error is not None:
+                    subscriber.finish(self._error)
+                else:
+                    # 分发被取消时数据并不完整，让订阅者从已输出的偏移自行回源。
+                    subscriber.detached = True
+                    subscriber.wakeup.set()
+            await body.aclose()
+
+
+class DownloadFanout:
+    """
+    合并同一文件的并发完整下载：第一个请求打开上游，其余并发请求订阅同一份数据，
+    热点文件的回源流量从 N 份降到约 1 份。
+    """
+
+    def __init__(
+        self,
+        *,
+        subscriber_buffer_bytes: int = DEFAULT_FANOUT_SUBSCRIBER_BUFFER_BYTES,
+        join_window_bytes: int = DEFAULT_FANOUT_JOIN_WINDOW_BYTES,
+        slow_consumer_grace_seconds: float = FANOUT_SLOW_CONSUMER_GRACE_SECONDS,
+    ):
+        self.subscriber_buffer_bytes = subscriber_buffer_bytes
+        self.join_window_bytes = min(join_window_bytes, subscriber_buffer_bytes)
+        self.slow_consumer_grace_seconds = slow_consumer_grace_seconds
+        self._streams: dict[str, FanoutStream] = {}
+        self.leaders = 0
+        self.joins = 0
+
+    def get(self, key: str) -> FanoutStream | None:
+        """返回仍可加入的分发；没有时返回 None，调用方应通过 create 成为发起方。"""
+        stream = self._streams.get(key)
+        if stream is None or not stream.joinable:
+            return None
+        self.joins += 1
+        return stream
+
+    def create(self, key: str) -> FanoutStream:
+        """登记一个新的分发，发起方打开上游后调用 start，失败时调用 fail。"""
+        stream = FanoutStream(
+            lambda released: self._discard(key, released),
+            subscriber_buffer_bytes=self.subscriber_buffer_bytes,
+            join_window_bytes=self.join_window_bytes,
+            slow_consumer_grace_seconds=self.slow_consumer_grace_seconds,
+        )
+        self._streams[key] = stream
+        self.leaders += 1
+        return stream
+
+    def _discard(self, key: str, stream: FanoutStream) -> None:
+        if self._streams.get(key) is stream:
+            del self._streams[key]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "active_streams": len(self._streams),
+            "leaders": self.leaders,
+            "joins": self.joins,
+            "subscriber_buffer_bytes": self.subscriber_buffer_bytes,
+        }
+
+
+_download_fanout: DownloadFanout | None = None
+
+
+def get_download_fanout(settings: Settings = Depends(get_settings)) -> DownloadFanout | None:
+    """并发下载合并器依赖，未启用时返回 None；同一进程内的请求共用一个实例。"""
+    global _download_fanout
+    if not settings.DOWNLOAD_FANOUT_ENABLED:
+        return None
+
+    if _download_fanout is None:
+        _download_fanout = DownloadFanout(subscriber_buffer_bytes=settings.DOWNLOAD_FANOUT_BUFFER_BYTES)
+    return _download_fanout
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+
+class DownloadUrlCache:
+    """
+    file_id → Telegram 下载链接的 TTL + LRU 缓存。
+    同一 file_id 的并发查询只会触发一次真实请求（single-flight）。
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max(max_entries, 1)
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task[str | None]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    async def get_or_load(
+        self,
+        file_id: str,
+        loader: Callable[[str], Awaitable[str | None]],
+    ) -> str | None:
+        """命中缓存直接返回，否则复用进行中的查询或发起新查询。"""
+        entry = self._entries.get(file_id)
+        if entry is not None:
+            url, expires_at = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(file_id)
+                self.hits += 1
+                return url
+            del self._entries[file_id]
+
+        task = self._inflight.get(file_id)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._load(file_id, loader))
+            self._inflight[file_id] = task
+        else:
+            self.coalesced += 1
+
+        # 使用 shield，避免某个客户端断开时取消其他请求共享的查询。
+        return await asyncio.shield(task)
+
+    async def _load(
+        self,
+        file_id: str,
+        loader: Callable[[str], Awaitable[str | None]],
+    ) -> str | None:
+        try:
+            url = await loader(file_id)
+            if url:
+                self._entries[file_id] = (url, time.monotonic() + self.ttl_seconds)
+                self._entries.move_to_end(file_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return url
+        finally:
+            self._inflight.pop(file_id, None)
+
+    def invalidate(self, file_id: str) -> None:
+        """CDN 返回 4xx 时丢弃缓存的链接，下次访问重新解析。"""
+        if self._entries.pop(file_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+        }
@@ -1,18 +1,78 @@
 import asyncio
+import math
 import os
+from datetime import timedelta
 from functools import lru_cache
-from typing import BinaryIO
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable
+import httpx
 import telegram
 from telegram import InputFile, Update
 from telegram.ext import CallbackContext
-from telegram.request import HTTPXRequest
 from ..core.config import Settings, get_settings
+from ..core.http_transport import SharedHttpTransport, get_shared_transport
 from .. import database
+from .download_url_cache import DownloadUrlCache
 
 # Telegram Bot API 对通过 getFile 方法下载的文件有 20MB 的限制。
 # 我们将分块大小设置为 19.5MB 以确保上传和下载都能成功。
 CHUNK_SIZE_BYTES = int(19.5 * 1024 * 1024)
 
+# Telegram 保证 getFile 返回的链接至少有效 1 小时，缓存时间留出余量。
+DOWNLOAD_URL_CACHE_TTL_SECONDS = 50 * 60
+DOWNLOAD_URL_CACHE_MAX_ENTRIES = 4096
+
+# 分块上传的默认并发数，以及单个分块的最大尝试次数与退避基数。
+DEFAULT_UPLOAD_CONCURRENCY = 4
+UPLOAD_PART_MAX_ATTEMPTS = 4
+UPLOAD_RETRY_BASE_DELAY_SECONDS = 1.0
+
+# deleteMessages 单次最多删除的消息数、同时在途的删除请求数，以及遇到限流时的最大尝试次数。
+DELETE_MESSAGES_BATCH_SIZE = 100
+DELETE_CONCURRENCY = 4
+DELETE_MAX_ATTEMPTS = 4
+
+# 删除文件或列出频道文件时读取清单的超时时间。
+MANIFEST_FETCH_TIMEOUT_SECONDS = 60.0
+
+# 上传进度回调，参数为 (已上传字节数, 总字节数)。
+ProgressCallback = Callable[[int, int], None]
+
+# 单个分块发送成功后的回调，参数为 (分块序号, 分块复合 ID, 分块大小)，用于持久化断点。
+PartCallback = Callable[[int, str, int], Awaitable[None]]
+
+
+def extract_thumbnails(message: telegram.Message) -> list[tuple[str, int, int]]:
+    """
+    取出消息自带的缩略图 (file_id, 宽, 高)：照片为原图之外的各个尺寸，
+    图片等文档为 Telegram 服务端生成的缩略图。
+    """
+    if message.photo:
+        sizes = message.photo[:-1]
+    elif message.document and message.document.thumbnail:
+        sizes = (message.document.thumbnail,)
+    else:
+        return []
+    return [(size.file_id, size.width, size.height) for size in sizes]
+
+
+def _retry_after_seconds(error: telegram.error.RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+async def _iter_upload_parts(chunks: AsyncIterator[bytes], part_size: int) -> AsyncIterator[bytes]:
+    """把任意大小的数据块重新切分为 part_size 大小的分块，最后一块可能更小。"""
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
 
 class ChunkReader:
     """把一个文件句柄限制为单个分块，避免把分块复制进内存。"""
@@ -35,10 +95,18 @@ class TelegramService:
     """
     用于与 Telegram Bot API 交互的服务。
     """
-    def __init__(self, settings: Settings):
+    def __init__(
+        self,
+        settings: Settings,
+        *,
+        upload_concurrency: int = DEFAULT_UPLOAD_CONCURRENCY,
+        http_transport: SharedHttpTransport | None = None,
+    ):
+        # Bot API 调用与 CDN 下载共用同一个连接池；未传入时使用独立的连接池。
+        self.http_transport = http_transport or SharedHttpTransport()
+        self.http_client = self.http_transport.client
         # 为大文件上传设置更长的超时时间 (例如 5 分钟)
-        request = HTTPXRequest(
-            connection_pool_size=8,
+        request = self.http_transport.create_bot_request(
             connect_timeout=300.0,
             read_timeout=300.0,
             write_timeout=300.0,
@@ -46,49 +114,94 @@ class TelegramService:
         )
         self.bot = telegram.Bot(token=settings.BOT_TOKEN, request=request)
         self.channel_name = settings.CHANNEL_NAME
-
-    async def _upload_as_chunks(self, file_path: str, original_filename: str) -> str | None:
+        self.upload_concurrency = max(upload_concurrency, 1)
+        self.download_url_cache = DownloadUrlCache(
+            max_entries=DOWNLOAD_URL_CACHE_MAX_ENTRIES,
+            ttl_seconds=DOWNLOAD_URL_CACHE_TTL_SECONDS,
+        )
+        # 任一删除请求收到 RetryAfter 后，所有删除请求都等到这个时间点之后再发出。
+        self._delete_retry_until = 0.0
+
+    async def _send_chunk_document(
+        self,
+        make_document: Callable[[], InputFile | bytes],
+        chunk_name: str,
+        reply_to_message_id: int | None,
+    ) -> telegram.Message:
         """
-        将大文件分割成块，并通过回复链将所有部分聚合起来。
+        发送单个分块，失败时按指数退避重试。
+        遇到 Telegram 限流时按返回的 retry_after 等待；BadRequest 等确定性错误不重试。
         """
-        chunk_file_ids = []
-        first_message_id = None
-        total_size = os.path.getsize(file_path)
-
-        try:
-            with open(file_path, 'rb') as file:
-                chunk_number = 1
-                remaining = total_size
-                while remaining:
-                    chunk_size = min(CHUNK_SIZE_BYTES, remaining)
-                    chunk_name = f"{original_filename}.part{chunk_number}"
-                    print(f"正在上传分块: {chunk_name}")
-                    chunk_reader = ChunkReader(file, chunk_size, chunk_name)
-                    document = InputFile(
-                        chunk_reader,
-                        filename=chunk_name,
-                        read_file_handle=False,
-                    )
-                    message = await self.bot.send_document(
-                        chat_id=self.channel_name,
-                        document=document,
-                        filename=chunk_name,
-                        reply_to_message_id=first_message_id,
-                    )
+        for attempt in range(1, UPLOAD_PART_MAX_ATTEMPTS + 1):
+            try:
+                return await self.bot.send_document(
+                    chat_id=self.channel_name,
+                    document=make_document(),
+                    filename=chunk_name,
+                    reply_to_message_id=reply_to_message_id,
+                )
+            except telegram.error.BadRequest:
+                raise
+            except telegram.error.RetryAfter as e:
+                if attempt == UPLOAD_PART_MAX_ATTEMPTS:
+                    raise
+                delay = _retry_after_seconds(e)
+            except telegram.error.NetworkError:
+                if attempt == UPLOAD_PART_MAX_ATTEMPTS:
+                    raise
+                delay = UPLOAD_RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1)
+
+            print(f"分块 {chunk_name} 第 {attempt} 次上传失败，{delay:.1f} 秒后重试...")
+            await asyncio.sleep(delay)
+
+        raise RuntimeError(f"分块 {chunk_name} 重试次数已耗尽。")
+
+    async def _upload_file_part(
+        self,
+        file_path: str,
+        offset: int,
+        size: int,
+        chunk_name: str,
+        reply_to_message_id: int | None,
+    ) -> telegram.Message:
+        """使用独立的文件句柄上传一个分块，便于多个分块并发读取。"""
+        with open(file_path, 'rb') as file:
+            def make_document() -> InputFile:
+                file.seek(offset)
+                return InputFile(
+                    ChunkReader(file, size, chunk_name),
+                    filename=chunk_name,
+                    read_file_handle=False,
+                )
 
-                    if not first_message_id:
-                        first_message_id = message.message_id
-
-                    chunk_file_ids.append(f"{message.message_id}:{message.document.file_id}")
-                    remaining -= chunk_size
-                    chunk_number += 1
-        except IOError as e:
-            print(f"读取或上传文件块时出错: {e}")
-            return None
-        except Exception as e:
-            print(f"发送文件块时出错: {e}")
-            return None
+            return await self._send_chunk_document(make_document, chunk_name, reply_to_message_id)
 
+    async def upload_file_part(
+        self,
+        file_path: str,
+        index: int,
+        file_name: str,
+        reply_to_message_id: int | None = None,
+    ) -> tuple[str, int]:
+        """
+        发送本地文件中的第 index 个分块，返回 (分块复合 ID, 分块大小)。
+        可续传上传在收齐一个完整分块后立即调用，不必等整个文件到达。
+        """
+        offset = index * CHUNK_SIZE_BYTES
+        chunk_size = min(CHUNK_SIZE_BYTES, os.path.getsize(file_path) - offset)
+        chunk_name = f"{file_name}.part{index + 1}"
+        print(f"正在上传分块: {chunk_name}")
+        message = await self._upload_file_part(file_path, offset, chunk_size, chunk_name, reply_to_message_id)
+        return f"{message.message_id}:{message.document.file_id}", chunk_size
+
+    async def _send_manifest(
+        self,
+        original_filename: str,
+        chunk_file_ids: list[str],
+        chunk_sizes: list[int],
+        reply_to_message_id: int | None,
+    ) -> str | None:
+        """上传清单文件，并把文件记录与分块索引写入数据库，返回清单消息的复合 ID。"""
         manifest_content = f"tgstate-blob\n{original_filename}\n" + "\n".join(chunk_file_ids)
         manifest_name = f"{original_filename}.manifest"
 
@@ -98,7 +211,7 @@ class TelegramService:
                 chat_id=self.channel_name,
                 document=manifest_content.encode('utf-8'),
                 filename=manifest_name,
-                reply_to_message_id=first_message_id
+                reply_to_message_id=reply_to_message_id
             )
             if message.document:
                 print("清单文件上传成功。")
@@ -107,22 +220,112 @@ class TelegramService:
                     database.add_file_metadata,
                     filename=original_filename,
                     file_id=composite_id,
-                    filesize=total_size,
+                    filesize=sum(chunk_sizes),
+                    chunks=list(zip(chunk_file_ids, chunk_sizes)),
                 )
                 return composite_id # 返回复合ID
         except Exception as e:
             print(f"上传清单文件时出错: {e}")
-        
+
         return None
 
-    async def upload_file(self, file_path: str, file_name: str) -> str | None:
+    async def _upload_as_chunks(
+        self,
+        file_path: str,
+        original_filename: str,
+        progress_callback: ProgressCallback | None = None,
+        *,
+        completed_parts: dict[int, str] | None = None,
+        part_callback: PartCallback | None = None,
+    ) -> str | None:
+        """
+        将大文件分割成块，并通过回复链将所有部分聚合起来。
+        第一个分块先上传以获得回复锚点，其余分块按 upload_concurrency 并发上传，
+        清单中的顺序始终与分块序号一致。
+        completed_parts 中已有的分块直接沿用，不再重复发送。
+        """
+        total_size = os.path.getsize(file_path)
+        part_count = math.ceil(total_size / CHUNK_SIZE_BYTES)
+        chunk_sizes = [
+            min(CHUNK_SIZE_BYTES, total_size - index * CHUNK_SIZE_BYTES)
+            for index in range(part_count)
+        ]
+        completed_parts = {
+            index: chunk_file_id
+            for index, chunk_file_id in (completed_parts or {}).items()
+            if 0 <= index < part_count
+        }
+        chunk_file_ids: list[str] = [completed_parts.get(index, "") for index in range(part_count)]
+        uploaded_bytes = sum(chunk_sizes[index] for index in completed_parts)
+
+        async def upload_part(index: int, reply_to_message_id: int | None) -> int:
+            nonlocal uploaded_bytes
+            offset = index * CHUNK_SIZE_BYTES
+            chunk_size = chunk_sizes[index]
+            chunk_name = f"{original_filename}.part{index + 1}"
+            print(f"正在上传分块: {chunk_name}")
+            message = await self._upload_file_part(
+                file_path,
+                offset,
+                chunk_size,
+                chunk_name,
+                reply_to_message_id,
+            )
+            chunk_file_ids[index] = f"{message.message_id}:{message.document.file_id}"
+            uploaded_bytes += chunk_size
+            print(f"分块上传进度: {uploaded_bytes / total_size:.0%} ({index + 1}/{part_count})")
+            if part_callback is not None:
+                await part_callback(index, chunk_file_ids[index], chunk_size)
+            if progress_callback is not None:
+                progress_callback(uploaded_bytes, total_size)
+            return message.message_id
+
+        try:
+            if 0 in completed_parts:
+                first_message_id = database.parse_message_id(completed_parts[0])
+                print(f"沿用已上传的 {len(completed_parts)}/{part_count} 个分块继续上传...")
+            else:
+                first_message_id = await upload_part(0, None)
+            semaphore = asyncio.Semaphore(self.upload_concurrency)
+
+            async def upload_bounded(index: int) -> None:
+                async with semaphore:
+                    await upload_part(index, first_message_id)
+
+            # TaskGroup 在任一分块最终失败时取消其余分块。
+            async with asyncio.TaskGroup() as task_group:
+                for index in range(1, part_count):
+                    if index not in completed_parts:
+                        task_group.create_task(upload_bounded(index))
+        except IOError as e:
+            print(f"读取或上传文件块时出错: {e}")
+            return None
+        except Exception as e:
+            print(f"发送文件块时出错: {e}")
+            return None
+
+        return await self._send_manifest(original_filename, chunk_file_ids, chunk_sizes, first_message_id)
+
+    async def upload_file(
+        self,
+        file_path: str,
+        file_name: str,
+        progress_callback: ProgressCallback | None = None,
+        *,
+        completed_parts: dict[int, str] | None = None,
+        part_callback: PartCallback | None = None,
+    ) -> str | None:
         """
         将文件上传到指定的 Telegram 频道。
-        如果文件大于 200MB，则分块上传。
+        如果文件大于等于分块大小，则分块上传。
         
         参数:
             file_path: 文件的本地路径。
             file_name: 文件名。
+            progress_callback: 可选的分块上传进度回调。
+            completed_parts: 可选的 {分块序号: 复合 ID}，这些分块视为已上传，直接跳过；
+                小文件的序号 0 即已发送的整个文件。
+            part_callback: 可选的异步回调，每个分块（小文件即整个文件）发送成功后调用，用于记录断点。
 
         返回:
             如果成功，则返回文件的 file_id，否则返回 None。
@@ -139,8 +342,26 @@ class TelegramService:
 
         if file_size >= CHUNK_SIZE_BYTES:
             print(f"文件大小 ({file_size / 1024 / 1024:.2f} MB) 超过或等于 {CHUNK_SIZE_BYTES / 1024 / 1024:.2f}MB。正在启动分块上传...")
-            return await self._upload_as_chunks(file_path, file_name)
+            return await self._upload_as_chunks(
+                file_path,
+                file_name,
+                progress_callback,
+                completed_parts=completed_parts,
+                part_callback=part_callback,
+            )
         
+        if completed_parts and 0 in completed_parts:
+            # 上次执行已经发送过该文件、但没来得及写入元数据，直接沿用已发送的消息。
+            composite_id = completed_parts[0]
+            print(f"沿用已发送的文件消息 {composite_id}，不再重复上传。")
+            await asyncio.to_thread(
+                database.add_file_metadata,
+                filename=file_name,
+                file_id=composite_id,
+                filesize=file_size,
+            )
+            return composite_id
+
         print(f"文件大小 ({file_size / 1024 / 1024:.2f} MB) 小于 {CHUNK_SIZE_BYTES / 1024 / 1024:.2f}MB。正在直接上传...")
         try:
             with open(file_path, 'rb') as document_file:
@@ -153,11 +374,15 @@ class TelegramService:
                 # 将小文件的元数据存入数据库
                 # 创建复合ID，格式为 "message_id:file_id"
                 composite_id = f"{message.message_id}:{message.document.file_id}"
+                # 先记录已发送的消息，写入元数据前退出时重试不会再发一遍。
+                if part_callback is not None:
+                    await part_callback(0, composite_id, file_size)
                 await asyncio.to_thread(
                     database.add_file_metadata,
                     filename=file_name,
                     file_id=composite_id,
                     filesize=file_size,
+                    thumbnails=extract_thumbnails(message),
                 )
                 return composite_id # 返回复合ID
         except Exception as e:
@@ -165,9 +390,102 @@ class TelegramService:
         
         return None
 
+    async def upload_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        file_name: str,
+        total_size: int | None = None,
+    ) -> str | None:
+        """
+        直接把到达中的数据流切分上传，不落地临时文件。
+
+        每凑满一个分块就立即发送，第一个分块不必等整个请求体到达。
+        内存中最多同时持有 upload_concurrency 个分块；
+        数据不足一个分块时按普通小文件上传。
+
+        参数:
+            chunks: 逐段产出文件内容的异步迭代器。
+            file_name: 文件名。
+            total_size: 可选的预期总大小，实际收到的字节数不一致时视为上传失败。
+
+        返回:
+            如果成功，则返回文件的 file_id，否则返回 None。
+        """
+        if not self.channel_name:
+            print("错误：环境变量中未设置 CHANNEL_NAME。")
+            return None
+
+        parts = _iter_upload_parts(chunks, CHUNK_SIZE_BYTES)
+        try:
+            first_part = await anext(parts, b"")
+            if len(first_part) < CHUNK_SIZE_BYTES:
+                if total_size is not None and len(first_part) != total_size:
+                    print(f"上传数据不完整: 预期 {total_size} 字节，实际收到 {len(first_part)} 字节。")
+                    return None
+                print(f"文件大小 ({len(first_part) / 1024 / 1024:.2f} MB) 小于 {CHUNK_SIZE_BYTES / 1024 / 1024:.2f}MB。正在直接上传...")
+                message = await self._send_chunk_document(lambda: first_part, file_name, None)
+                if not message.document:
+                    return None
+                composite_id = f"{message.message_id}:{message.document.file_id}"
+                await asyncio.to_thread(
+                    database.add_file_metadata,
+                    filename=file_name,
+                    file_id=composite_id,
+                    filesize=len(first_part),
+                    thumbnails=extract_thumbnails(message),
+                )
+                return composite_id
+
+            print("正在以流式方式分块上传...")
+            chunk_file_ids: list[str] = [""]
+            chunk_sizes: list[int] = [len(first_part)]
+            received_bytes = len(first_part)
+
+            async def upload_part(index: int, data: bytes, reply_to_message_id: int | None) -> int:
+                chunk_name = f"{file_name}.part{index + 1}"
+                print(f"正在上传分块: {chunk_name}")
+                message = await self._send_chunk_document(lambda: data, chunk_name, reply_to_message_id)
+                chunk_file_ids[index] = f"{message.message_id}:{message.document.file_id}"
+                return message.message_id
+
+            first_message_id = await upload_part(0, first_part, None)
+            del first_part
+
+            # 先占用并发名额再读取下一个分块，在途与待发送的分块总数不超过并发上限。
+            semaphore = asyncio.Semaphore(self.upload_concurrency)
+
+            async def upload_bounded(index: int, data: bytes) -> None:
+                try:
+                    await upload_part(index, data, first_message_id)
+                finally:
+                    semaphore.release()
+
+            # TaskGroup 在任一分块最终失败时取消其余分块，并停止继续读取请求体。
+            async with asyncio.TaskGroup() as task_group:
+                while True:
+                    await semaphore.acquire()
+                    part = await anext(parts, None)
+                    if part is None:
+                        semaphore.release()
+                        break
+                    chunk_file_ids.append("")
+                    chunk_sizes.append(len(part))
+                    received_bytes += len(part)
+                    task_group.create_task(upload_bounded(len(chunk_file_ids) - 1, part))
+                    del part
+        except Exception as e:
+            print(f"流式上传文件时出错: {e}")
+            return None
+
+        if total_size is not None and received_bytes != total_size:
+            print(f"上传数据不完整: 预期 {total_size} 字节，实际收到 {received_bytes} 字节。")
+            return None
+
+        return await self._send_manifest(file_name, chunk_file_ids, chunk_sizes, first_message_id)
+
     async def get_download_url(self, file_id: str) -> str | None:
         """
-        为给定的 file_id 获取临时下载链接。
+        为给定的 file_id 获取临时下载链接，优先使用缓存。
 
         参数:
             file_id: 来自 Telegram 的文件 ID。
@@ -175,6 +493,14 @@ class TelegramService:
         返回:
             如果成功，则返回临时下载链接，否则返回 None。
         """
+        return await self.download_url_cache.get_or_load(file_id, self._resolve_download_url)
+
+    def invalidate_download_url(self, file_id: str) -> None:
+        """丢弃已缓存的下载链接，通常在 CDN 返回 4xx 时调用。"""
+        self.download_url_cache.invalidate(file_id)
+
+    async def _resolve_download_url(self, file_id: str) -> str | None:
+        """通过 Bot API 的 getFile 解析下载链接。"""
         try:
             file = await self.bot.get_file(file_id)
             return file.file_path
@@ -194,7 +520,8 @@ class TelegramService:
             reason 可以是 'deleted', 'not_found', 或 'error'。
         """
         try:
-            await self.bot.delete_message(
+            await self._call_delete_api(
+                self.bot.delete_message,
                 chat_id=self.channel_name,
                 message_id=message_id
             )
@@ -210,6 +537,81 @@ class TelegramService:
             print(f"删除消息 {message_id} 时发生未知错误: {e}")
             return (False, "error")
 
+    async def _call_delete_api(self, method: Callable, **kwargs):
+        """
+        调用删除相关的 Bot API，遇到 RetryAfter 时让所有删除请求一起暂停，等待结束后重试。
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(1, DELETE_MAX_ATTEMPTS + 1):
+            delay = self._delete_retry_until - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await method(**kwargs)
+            except telegram.error.RetryAfter as e:
+                if attempt == DELETE_MAX_ATTEMPTS:
+                    raise
+                retry_after = _retry_after_seconds(e)
+                self._delete_retry_until = max(self._delete_retry_until, loop.time() + retry_after)
+                print(f"删除消息触发限流，{retry_after:.1f} 秒后重试...")
+
+        raise RuntimeError("删除请求重试次数已耗尽。")
+
+    async def delete_messages(self, message_ids: list[int]) -> set[int]:
+        """
+        按每批 DELETE_MESSAGES_BATCH_SIZE 条调用 deleteMessages 删除消息，返回删除成功的消息 ID。
+        不存在的消息会被 Telegram 跳过，视为已删除；整批失败时逐条删除以找出失败的消息。
+        """
+        unique_ids = list(dict.fromkeys(message_ids))
+        deleted_ids: set[int] = set()
+        semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+
+        async def delete_batch(batch_ids: list[int]) -> None:
+            async with semaphore:
+                try:
+                    await self._call_delete_api(
+                        self.bot.delete_messages,
+                        chat_id=self.channel_name,
+                        message_ids=batch_ids,
+                    )
+                    deleted_ids.update(batch_ids)
+                    return
+                except Exception as e:
+                    print(f"批量删除 {len(batch_ids)} 条消息失败，改为逐条删除: {e}")
+
+                for message_id in batch_ids:
+                    success, _ = await self.delete_message(message_id)
+                    if success:
+                        deleted_ids.add(message_id)
+
+        await asyncio.gather(*(
+            delete_batch(unique_ids[index:index + DELETE_MESSAGES_BATCH_SIZE])
+            for index in range(0, len(unique_ids), DELETE_MESSAGES_BATCH_SIZE)
+        ))
+        return deleted_ids
+
+    async def _fetch_remote_chunk_ids(self, file_id: str, actual_file_id: str, result: dict) -> list[str]:
+        """没有本地索引的旧记录下载清单读取分块列表，普通文件返回空列表。"""
+        download_url = await self.get_download_url(actual_file_id)
+        if not download_url:
+            print(f"警告: 无法为文件 {actual_file_id} 获取下载链接。将只尝试删除主消息。")
+            result["reason"] = f"Could not get download URL for {actual_file_id}."
+            return []
+
+        try:
+            response = await self.http_client.get(download_url, timeout=MANIFEST_FETCH_TIMEOUT_SECONDS)
+            if response.status_code == 200 and response.content.startswith(b'tgstate-blob\n'):
+                result["is_manifest"] = True
+                print(f"文件 {file_id} 是一个清单文件。正在处理分块删除...")
+                lines = response.content.decode('utf-8').strip().split('\n')
+                return lines[2:]
+        except Exception as e:
+            error_message = f"下载或解析清单文件 {file_id} 时出错: {e}"
+            print(error_message)
+            result["reason"] += " " + error_message
+            # 即使清单处理失败，我们也要继续尝试删除主消息
+        return []
+
     async def delete_file_with_chunks(self, file_id: str) -> dict:
         """
         完全删除一个文件，包括其所有可能的分块。
@@ -221,86 +623,98 @@ class TelegramService:
         返回:
             一个包含删除操作结果的字典。
         """
-        results = {
-            "status": "pending",
-            "main_file_id": file_id,
-            "deleted_chunks": [],
-            "failed_chunks": [],
-            "main_message_deleted": False,
-            "is_manifest": False,
-            "reason": ""
-        }
+        return (await self.delete_files_with_chunks([file_id]))[file_id]
 
-        try:
-            main_message_id_str, main_actual_file_id = file_id.split(':', 1)
-            main_message_id = int(main_message_id_str)
-        except (ValueError, IndexError):
-            results["status"] = "error"
-            results["reason"] = "Invalid composite file_id format."
-            return results
-
-        # 步骤 1: 检查文件是否为清单
-        download_url = await self.get_download_url(main_actual_file_id)
-        if not download_url:
-            print(f"警告: 无法为文件 {main_actual_file_id} 获取下载链接。将只尝试删除主消息。")
-            results["reason"] = f"Could not get download URL for {main_actual_file_id}."
-        else:
+    async def delete_files_with_chunks(self, file_ids: list[str]) -> dict[str, dict]:
+        """
+        批量删除文件及其分块。
+
+        分块列表优先从本地索引一次查出，只有未建立索引的旧记录才并发下载清单；
+        之后所有主消息与分块消息合并，按每批 100 条调用 deleteMessages。
+
+        返回:
+            file_id 到删除结果的映射，结果结构与 delete_file_with_chunks 相同。
+        """
+        results: dict[str, dict] = {}
+        main_message_ids: dict[str, int] = {}
+        for file_id in dict.fromkeys(file_ids):
+            results[file_id] = {
+                "status": "pending",
+                "main_file_id": file_id,
+                "deleted_chunks": [],
+                "failed_chunks": [],
+                "main_message_deleted": False,
+                "is_manifest": False,
+                "reason": ""
+            }
             try:
-                import httpx
-                async with httpx.AsyncClient(timeout=60.0) as client:
-                    response = await client.get(download_url)
-                    if response.status_code == 200 and response.content.startswith(b'tgstate-blob\n'):
-                        results["is_manifest"] = True
-                        print(f"文件 {file_id} 是一个清单文件。正在处理分块删除...")
-                        
-                        manifest_content = response.content.decode('utf-8')
-                        lines = manifest_content.strip().split('\n')
-                        chunk_composite_ids = lines[2:]
-
-                        for chunk_id in chunk_composite_ids:
-                            try:
-                                chunk_message_id_str, _ = chunk_id.split(':', 1)
-                                chunk_message_id = int(chunk_message_id_str)
-                                success, _ = await self.delete_message(chunk_message_id)
-                                if success:
-                                    results["deleted_chunks"].append(chunk_id)
-                                else:
-                                    results["failed_chunks"].append(chunk_id)
-                            except Exception as e:
-                                print(f"处理或删除分块 {chunk_id} 时出错: {e}")
-                                results["failed_chunks"].append(chunk_id)
-            except Exception as e:
-                error_message = f"下载或解析清单文件 {file_id} 时出错: {e}"
-                print(error_message)
-                results["reason"] += " " + error_message
-                # 即使清单处理失败，我们也要继续尝试删除主消息
-
-        # 步骤 2: 删除主消息 (清单文件本身或单个文件)
-        main_message_deleted, delete_reason = await self.delete_message(main_message_id)
-        results["main_message_deleted"] = main_message_deleted
-        
-        if main_message_deleted:
-            if delete_reason == "deleted":
+                main_message_id_str, _ = file_id.split(':', 1)
+                main_message_ids[file_id] = int(main_message_id_str)
+            except (ValueError, IndexError):
+                results[file_id]["status"] = "error"
+                results[file_id]["reason"] = "Invalid composite file_id format."
+
+        # 步骤 1: 找出每个文件的分块，优先使用本地分块索引，没有索引的旧记录才下载清单
+        chunk_lists = await asyncio.to_thread(database.get_chunk_lists, list(main_message_ids))
+        semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+
+        async def resolve_remote(file_id: str) -> None:
+            async with semaphore:
+                chunk_lists[file_id] = await self._fetch_remote_chunk_ids(
+                    file_id,
+                    file_id.split(':', 1)[1],
+                    results[file_id],
+                )
+
+        await asyncio.gather(*(
+            resolve_remote(file_id)
+            for file_id in main_message_ids
+            if chunk_lists.get(file_id) is None
+        ))
+
+        chunk_message_ids: dict[str, int | None] = {}
+        for file_id, chunk_ids in chunk_lists.items():
+            if chunk_ids:
+                results[file_id]["is_manifest"] = True
+            for chunk_id in chunk_ids or []:
+                chunk_message_id_str, _, _ = chunk_id.partition(':')
+                chunk_message_ids[chunk_id] = (
+                    int(chunk_message_id_str) if chunk_message_id_str.isdigit() else None
+                )
+
+        # 步骤 2: 批量删除分块消息与主消息 (清单文件本身或单个文件)
+        deleted_message_ids = await self.delete_messages([
+            *(message_id for message_id in chunk_message_ids.values() if message_id is not None),
+            *main_message_ids.values(),
+        ])
+
+        # 步骤 3: 决定每个文件的最终状态
+        for file_id, main_message_id in main_message_ids.items():
+            result = results[file_id]
+            for chunk_id in chunk_lists.get(file_id) or []:
+                if chunk_message_ids[chunk_id] in deleted_message_ids:
+                    result["deleted_chunks"].append(chunk_id)
+                else:
+                    print(f"删除分块 {chunk_id} 失败。")
+                    result["failed_chunks"].append(chunk_id)
+
+            result["main_message_deleted"] = main_message_id in deleted_message_ids
+            if result["main_message_deleted"]:
                 print(f"主消息 {main_message_id} 已成功删除。")
-            elif delete_reason == "not_found":
-                print(f"主消息 {main_message_id} 在 Telegram 中未找到，视为成功。")
-        else:
-            print(f"删除主消息 {main_message_id} 失败。")
-
-        # 步骤 3: 决定最终状态
-        if results["main_message_deleted"] and (not results["is_manifest"] or not results["failed_chunks"]):
-             results["status"] = "success"
-        else:
-             results["status"] = "partial_failure"
-             if not results["main_message_deleted"]:
-                 results["reason"] += " Failed to delete main message."
-             if results["failed_chunks"]:
-                 results["reason"] += f" Failed to delete {len(results['failed_chunks'])} chunks."
+            else:
+                print(f"删除主消息 {main_message_id} 失败。")
 
+            if result["main_message_deleted"] and (not result["is_manifest"] or not result["failed_chunks"]):
+                result["status"] = "success"
+            else:
+                result["status"] = "partial_failure"
+                if not result["main_message_deleted"]:
+                    result["reason"] += " Failed to delete main message."
+                if result["failed_chunks"]:
+                    result["reason"] += f" Failed to delete {len(result['failed_chunks'])} chunks."
 
         return results
 
-
     async def list_files_in_channel(self) -> list[dict]:
         """
         遍历频道历史记录，智能地列出所有文件。
@@ -345,25 +759,36 @@ class TelegramService:
                         })
                     # 清单文件
                     elif doc.file_name.endswith('.manifest'):
+                        # 已索引的清单直接使用数据库中的原始文件名和大小
+                        file_info = await asyncio.to_thread(
+                            database.get_file_info,
+                            f"{message.message_id}:{doc.file_id}",
+                        )
+                        if file_info:
+                            files.append({
+                                "name": file_info["filename"],
+                                "file_id": doc.file_id,
+                                "size": file_info["filesize"]
+                            })
+                            continue
+
                         # 下载并解析清单文件以获取原始文件名和大小
                         manifest_url = await self.get_download_url(doc.file_id)
                         if not manifest_url: continue
                         
-                        import httpx
-                        async with httpx.AsyncClient() as client:
-                            try:
-                                resp = await client.get(manifest_url)
-                                if resp.status_code == 200 and resp.content.startswith(b'tgstate-blob\n'):
-                                    lines = resp.content.decode('utf-8').strip().split('\n')
-                                    original_filename = lines[1]
-                                    # 注意：这里我们无法轻易获得原始总大小，暂时留空
-                                    files.append({
-                                        "name": original_filename,
-                                        "file_id": doc.file_id, # 关键：使用清单文件的ID
-                                        "size": None # 标记为未知大小
-                                    })
-                            except httpx.RequestError:
-                                continue
+                        try:
+                            resp = await self.http_client.get(manifest_url, timeout=MANIFEST_FETCH_TIMEOUT_SECONDS)
+                            if resp.status_code == 200 and resp.content.startswith(b'tgstate-blob\n'):
+                                lines = resp.content.decode('utf-8').strip().split('\n')
+                                original_filename = lines[1]
+                                # 注意：这里我们无法轻易获得原始总大小，暂时留空
+                                files.append({
+                                    "name": original_filename,
+                                    "file_id": doc.file_id, # 关键：使用清单文件的ID
+                                    "size": None # 标记为未知大小
+                                })
+                        except httpx.RequestError:
+                            continue
             
             # 设置下一次迭代的偏移量
             last_message_id = messages[-1].message_id
@@ -377,4 +802,9 @@ def get_telegram_service() -> TelegramService:
     """
     TelegramService 的缓存工厂函数。
     """
-    return TelegramService(settings=get_settings())
\ No newline at end of file
+    settings = get_settings()
+    return TelegramService(
+        settings=settings,
+        upload_concurrency=settings.UPLOAD_CONCURRENCY,
+        http_transport=get_shared_transport(),
+    )
\ No newline at end of file
@@ -1,26 +1,127 @@
 import asyncio
+import math
 import re
+import time
 from functools import lru_cache
-from typing import Any
+from typing import Any, Awaitable, Callable
 
 from .. import database
 from ..core.config import Settings, get_settings
-from ..events import publish_file_update
+from ..events import publish_files_deleted
 
 try:
     from telethon import TelegramClient, events
+    from telethon.errors import FloodWaitError
     from telethon.sessions import StringSession
 except ImportError:  # pragma: no cover - 运行时依赖缺失时的兜底。
     TelegramClient = None
     events = None
+    FloodWaitError = None
     StringSession = None
 
 MANIFEST_MAGIC = b"tgstate-blob\n"
 MESSAGE_BATCH_SIZE = 100
 HISTORY_SYNC_STOP_AFTER_KNOWN = 200
+# 历史回填每扫描这么多条消息提交一次，新记录与检查点在同一个事务中写入。
+HISTORY_SYNC_BATCH_SIZE = 500
+# sync_state 中的检查点：未完成回填已扫描到的最小消息 ID 与该轮见到的最大消息 ID，
+# 以及上一次完整回填覆盖到的最大消息 ID（高水位）。
+HISTORY_RESUME_OFFSET_KEY = "history_backfill_offset_id"
+HISTORY_RUN_TOP_KEY = "history_backfill_top_id"
+HISTORY_HIGH_WATER_KEY = "history_high_water_id"
+# 历史回填解析清单时，单次请求遇到 FloodWait 后的最大重试次数。
+MANIFEST_FLOOD_WAIT_MAX_RETRIES = 3
+# 增量对账单轮最多确认的文件数。
+RECONCILE_MAX_SLICE_SIZE = 5_000
+# 每轮最多四分之一名额留给最近被访问过的文件。
+RECONCILE_PRIORITY_DIVISOR = 4
+RECONCILE_RECENT_ACCESS_SECONDS = 24 * 60 * 60
 CHUNK_FILENAME_PATTERN = re.compile(r"\.part\d+$")
 
 
+class _ManifestResolvePool:
+    """
+    历史回填时并发解析清单消息的有界任务池。
+
+    扫描循环在池满时停在 submit 上；任一请求收到 FloodWait 后，
+    所有任务都会等到限流结束再发起下一次请求。同时统计实际并发度。
+    """
+
+    def __init__(self, concurrency: int):
+        self._semaphore = asyncio.Semaphore(max(concurrency, 1))
+        self._flood_wait_until = 0.0
+        self._in_flight = 0
+        self._active_since = 0.0
+        self.resolved = 0
+        self.busy_seconds = 0.0
+        self.active_seconds = 0.0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+
+    async def submit(self, resolve: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        await self._semaphore.acquire()
+        try:
+            return asyncio.create_task(self._run(resolve))
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    async def _run(self, resolve: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        if self._in_flight == 0:
+            self._active_since = started
+        self._in_flight += 1
+        try:
+            return await resolve()
+        finally:
+            finished = loop.time()
+            self.busy_seconds += finished - started
+            self.resolved += 1
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self.active_seconds += finished - self._active_since
+            self._semaphore.release()
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+        """发起一次 Telegram 请求，收到 FloodWait 时按要求的秒数暂停后重试。"""
+        loop = asyncio.get_running_loop()
+        for attempt in range(MANIFEST_FLOOD_WAIT_MAX_RETRIES + 1):
+            delay = self._flood_wait_until - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await func(*args, **kwargs)
+            except Exception as exc:
+                if (
+                    FloodWaitError is None
+                    or not isinstance(exc, FloodWaitError)
+                    or attempt == MANIFEST_FLOOD_WAIT_MAX_RETRIES
+                ):
+                    raise
+                seconds = max(int(getattr(exc, "seconds", 0) or 0), 1)
+                self.flood_waits += 1
+                self.flood_wait_seconds += seconds
+                self._flood_wait_until = max(self._flood_wait_until, loop.time() + seconds)
+                print(f"Telegram 清单解析触发限流，暂停 {seconds} 秒后重试。")
+
+    def summary(self) -> dict[str, Any]:
+        """
+        返回本轮统计。effective_concurrency 为各任务耗时之和除以有任务在途的总时长，
+        约等于并发解析相对逐个解析节省的倍数。
+        """
+        return {
+            "resolved": self.resolved,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "active_seconds": round(self.active_seconds, 3),
+            "effective_concurrency": (
+                round(self.busy_seconds / self.active_seconds, 2) if self.active_seconds else 0.0
+            ),
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": self.flood_wait_seconds,
+        }
+
+
 class TelegramSyncService:
     """
     使用 MTProto 对账 Telegram 频道状态，补齐 Bot API 无法感知的删除事件。
@@ -33,6 +134,8 @@ class TelegramSyncService:
         self._reconcile_task: asyncio.Task | None = None
         self._started = False
         self._session_mode = "disabled"
+        self._manifest_pool: _ManifestResolvePool | None = None
+        self.last_manifest_resolve_stats: dict[str, Any] | None = None
 
     @property
     def enabled(self) -> bool:
@@ -179,20 +282,39 @@ class TelegramSyncService:
             return max(base_interval, 300)
         return base_interval
 
+    def _get_reconcile_slice_size(self, file_count: int) -> int:
+        """
+        根据文件总数和轮转窗口计算单轮对账的文件数，
+        使全部文件在 TELEGRAM_RECONCILE_SWEEP_WINDOW 内各确认一次。
+        """
+        interval = self._get_reconcile_interval(file_count)
+        ticks = max(self.settings.TELEGRAM_RECONCILE_SWEEP_WINDOW // interval, 1)
+        batches = max(math.ceil(file_count / ticks / MESSAGE_BATCH_SIZE), 1)
+        return min(batches * MESSAGE_BATCH_SIZE, RECONCILE_MAX_SLICE_SIZE)
+
     async def reconcile_once(self) -> int:
-        """主动对账数据库与频道主消息是否一致。"""
+        """
+        增量对账：每轮只确认一批文件的主消息是否仍然存在。
+
+        优先确认最近被访问过的文件，其余按上次确认时间轮转；
+        消息已不存在的记录批量删除，其余批量写回确认时间。
+        """
         if not self.client or not self.channel_entity:
             return 0
 
-        files = await asyncio.to_thread(database.get_all_files)
-        message_ids: list[int] = []
-        for file in files:
-            try:
-                message_ids.append(int(str(file["file_id"]).split(":", 1)[0]))
-            except (ValueError, IndexError):
-                print(f"警告: 跳过无效 file_id: {file['file_id']}")
+        await asyncio.to_thread(database.flush_file_access)
+        file_count = await self._get_file_count()
+        slice_size = self._get_reconcile_slice_size(file_count)
+        files = await asyncio.to_thread(
+            database.get_reconcile_slice,
+            slice_size,
+            priority_limit=slice_size // RECONCILE_PRIORITY_DIVISOR,
+            accessed_since=int(time.time()) - RECONCILE_RECENT_ACCESS_SECONDS,
+        )
+        message_ids = [file["message_id"] for file in files]
 
-        removed_file_ids: list[str] = []
+        missing_message_ids: list[int] = []
+        verified_message_ids: list[int] = []
         for index in range(0, len(message_ids), MESSAGE_BATCH_SIZE):
             batch_ids = message_ids[index:index + MESSAGE_BATCH_SIZE]
             messages = await self.client.get_messages(self.channel_entity, ids=batch_ids)
@@ -201,18 +323,17 @@ class TelegramSyncService:
 
             for message_id, message in zip(batch_ids, messages):
                 if message is None:
-                    deleted_file_id = await asyncio.to_thread(
-                        database.delete_file_by_message_id,
-                        message_id,
-                    )
-                    if deleted_file_id:
-                        removed_file_ids.append(deleted_file_id)
-
-        for file_id in removed_file_ids:
-            await publish_file_update({
-                "action": "delete",
-                "file_id": file_id
-            })
+                    missing_message_ids.append(message_id)
+                else:
+                    verified_message_ids.append(message_id)
+
+        removed_file_ids = await asyncio.to_thread(
+            database.delete_files_by_message_ids,
+            missing_message_ids,
+        )
+        await asyncio.to_thread(database.mark_files_verified, verified_message_ids)
+
+        await publish_files_deleted(removed_file_ids)
 
         if removed_file_ids:
             print(f"Telegram 删除对账完成，本轮同步删除 {len(removed_file_ids)} 条记录。")
@@ -222,49 +343,107 @@ class TelegramSyncService:
         """
         启动时扫描频道历史，重建数据库中的文件索引。
 
-        - 数据库为空时执行一次全量回填。
-        - 数据库已有数据时，只向后扫描到连续命中足够多的已知记录后停止，
-          避免每次重启都全量遍历整个频道历史。
+        - 只扫描高水位之后的新消息；上一轮被中断时从检查点继续向旧消息扫描。
+        - 每扫描 HISTORY_SYNC_BATCH_SIZE 条消息批量写入一次，检查点随数据一起提交。
+        - 旧数据库还没有高水位时，沿用连续命中足够多已知记录后提前结束的策略。
+        - 清单消息交给有界任务池并发解析，扫描继续向前；写入前等待本批清单全部解析完成。
         """
         if not self.client or not self.channel_entity:
             return 0
 
-        existing_file_ids = {
-            file["file_id"]
-            for file in await asyncio.to_thread(database.get_all_files)
-        }
+        manifest_pool = _ManifestResolvePool(self.settings.MANIFEST_RESOLVE_CONCURRENCY)
+        self._manifest_pool = manifest_pool
+        pending_items: list[dict[str, Any] | asyncio.Task] = []
+        try:
+            return await self._scan_history(pending_items)
+        finally:
+            for item in pending_items:
+                if isinstance(item, asyncio.Task):
+                    item.cancel()
+            self._manifest_pool = None
+            self.last_manifest_resolve_stats = manifest_pool.summary()
+            if manifest_pool.resolved:
+                stats = self.last_manifest_resolve_stats
+                print(
+                    f"Telegram 清单解析 {stats['resolved']} 个，任务累计耗时 "
+                    f"{stats['busy_seconds']} 秒，实际占用 {stats['active_seconds']} 秒，"
+                    f"有效并发 {stats['effective_concurrency']}，"
+                    f"限流等待 {stats['flood_waits']} 次共 {stats['flood_wait_seconds']} 秒。"
+                )
+
+    async def _scan_history(self, pending_items: list[dict[str, Any] | asyncio.Task]) -> int:
+        """sync_history_once 的扫描主体；pending_items 由调用方持有，出错时用于取消在途任务。"""
+        state = await asyncio.to_thread(database.get_sync_state)
+        high_water = state.get(HISTORY_HIGH_WATER_KEY)
+        resume_offset = state.get(HISTORY_RESUME_OFFSET_KEY)
+        run_top = state.get(HISTORY_RUN_TOP_KEY) if resume_offset else None
+        stop_after_known = (
+            high_water is None
+            and resume_offset is None
+            and await self._get_file_count() > 0
+        )
+
+        iter_options: dict[str, int] = {}
+        if high_water:
+            iter_options["min_id"] = high_water
+        if resume_offset:
+            iter_options["offset_id"] = resume_offset
+            print(f"Telegram 历史回填从消息 {resume_offset} 处继续。")
+
         chunk_message_ids: set[int] = set()
+        scanned_since_flush = 0
+        lowest_message_id: int | None = None
         inserted_count = 0
         known_streak = 0
-        warm_start = bool(existing_file_ids)
 
-        async for message in self.client.iter_messages(self.channel_entity):
-            history_record = await self._build_history_record(message, chunk_message_ids)
-            if history_record is None:
+        async for message in self.client.iter_messages(self.channel_entity, **iter_options):
+            message_id = getattr(message, "id", None)
+            if message_id:
+                lowest_message_id = int(message_id)
+                run_top = max(run_top or 0, lowest_message_id)
+
+            history_item = await self._build_history_record(message, chunk_message_ids)
+            if history_item is not None:
+                pending_items.append(history_item)
+            scanned_since_flush += 1
+            if scanned_since_flush < HISTORY_SYNC_BATCH_SIZE:
                 continue
 
-            file_id = history_record["file_id"]
-            if file_id in existing_file_ids:
-                known_streak += 1
-                if warm_start and known_streak >= HISTORY_SYNC_STOP_AFTER_KNOWN:
-                    print(
-                        "Telegram 历史回填已命中足够多的连续已知记录，"
-                        "提前结束本轮扫描。"
-                    )
-                    break
-                continue
-
-            known_streak = 0
-            inserted = await asyncio.to_thread(
-                database.add_file_metadata,
-                filename=history_record["filename"],
-                file_id=file_id,
-                filesize=history_record["filesize"],
-                upload_date=history_record["upload_date"],
+            pending_records = await self._collect_history_records(pending_items)
+            inserted_file_ids = await asyncio.to_thread(
+                database.add_files_metadata,
+                pending_records,
+                sync_state={
+                    HISTORY_RESUME_OFFSET_KEY: lowest_message_id,
+                    HISTORY_RUN_TOP_KEY: run_top,
+                },
             )
-            if inserted:
-                inserted_count += 1
-                existing_file_ids.add(file_id)
+            inserted_count += len(inserted_file_ids)
+            if stop_after_known:
+                known_streak = self._count_known_streak(
+                    pending_records,
+                    set(inserted_file_ids),
+                    known_streak,
+                )
+            scanned_since_flush = 0
+            if known_streak >= HISTORY_SYNC_STOP_AFTER_KNOWN:
+                print(
+                    "Telegram 历史回填已命中足够多的连续已知记录，"
+                    "提前结束本轮扫描。"
+                )
+                break
+
+        new_high_water = max(filter(None, (high_water, run_top)), default=None)
+        inserted_file_ids = await asyncio.to_thread(
+            database.add_files_metadata,
+            await self._collect_history_records(pending_items),
+            sync_state={
+                HISTORY_HIGH_WATER_KEY: new_high_water,
+                HISTORY_RESUME_OFFSET_KEY: None,
+                HISTORY_RUN_TOP_KEY: None,
+            },
+        )
+        inserted_count += len(inserted_file_ids)
 
         if inserted_count:
             print(f"Telegram 历史回填完成，新增 {inserted_count} 条文件记录。")
@@ -272,12 +451,55 @@ class TelegramSyncService:
             print("Telegram 历史回填完成，本轮没有新增文件记录。")
         return inserted_count
 
+    @staticmethod
+    async def _collect_history_records(
+        pending_items: list[dict[str, Any] | asyncio.Task],
+    ) -> list[dict[str, Any]]:
+        """等待本批清单解析完成，按扫描顺序返回可写入的记录并清空 pending_items。"""
+        tasks = [item for item in pending_items if isinstance(item, asyncio.Task)]
+        results = iter(await asyncio.gather(*tasks, return_exceptions=True))
+        records: list[dict[str, Any]] = []
+        for item in pending_items:
+            if isinstance(item, asyncio.Task):
+                item = next(results)
+                if isinstance(item, BaseException):
+                    raise item
+            if item is not None:
+                records.append(item)
+        pending_items.clear()
+        return records
+
+    async def _telegram_request(self, func: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+        """历史回填期间经由清单解析池发起请求，统一处理 FloodWait。"""
+        if self._manifest_pool is None:
+            return await func(*args, **kwargs)
+        return await self._manifest_pool.call(func, *args, **kwargs)
+
+    @staticmethod
+    def _count_known_streak(
+        records: list[dict[str, Any]],
+        inserted_file_ids: set[str],
+        known_streak: int,
+    ) -> int:
+        """按扫描顺序累计连续已存在的记录数，遇到新插入的记录时清零。"""
+        for record in records:
+            if record["file_id"] in inserted_file_ids:
+                known_streak = 0
+            else:
+                known_streak += 1
+                if known_streak >= HISTORY_SYNC_STOP_AFTER_KNOWN:
+                    break
+        return known_streak
+
     async def _build_history_record(
         self,
         message: Any,
         chunk_message_ids: set[int],
-    ) -> dict[str, Any] | None:
-        """从频道历史消息中提取可落库的文件记录。"""
+    ) -> dict[str, Any] | asyncio.Task | None:
+        """
+        从频道历史消息中提取可落库的文件记录。
+        历史回填期间清单消息交给任务池解析，此时返回解析该清单的任务。
+        """
         if not message or not getattr(message, "id", None):
             return None
 
@@ -309,6 +531,12 @@ class TelegramSyncService:
             return None
 
         if file_name.endswith(".manifest"):
+            if self._manifest_pool is not None:
+                # 并发解析时分块 ID 会晚一些才加入 chunk_message_ids，
+                # 期间扫描到的分块消息仍由 CHUNK_FILENAME_PATTERN 排除。
+                return await self._manifest_pool.submit(
+                    lambda: self._build_manifest_record(message, upload_date, chunk_message_ids)
+                )
             return await self._build_manifest_record(message, upload_date, chunk_message_ids)
 
         if message_id in chunk_message_ids or CHUNK_FILENAME_PATTERN.search(file_name):
@@ -324,6 +552,7 @@ class TelegramSyncService:
             "file_id": f"{message_id}:{file_id}",
             "filesize": file_size,
             "upload_date": upload_date,
+            "mime_type": getattr(message_file, "mime_type", None),
         }
 
     async def _build_manifest_record(
@@ -337,7 +566,7 @@ class TelegramSyncService:
         if not file_id:
             return None
 
-        manifest_blob = await self.client.download_media(message, bytes)
+        manifest_blob = await self._telegram_request(self.client.download_media, message, bytes)
         if not isinstance(manifest_blob, (bytes, bytearray)):
             print(f"警告: 无法读取清单消息 {message.id} 的内容。")
             return None
@@ -358,6 +587,7 @@ class TelegramSyncService:
 
         original_filename = lines[1].strip() or f"file_{message.id}"
         chunk_ids: list[int] = []
+        chunk_entries: list[str] = []
         for line in lines[2:]:
             chunk_entry = line.strip()
             if not chunk_entry:
@@ -370,26 +600,32 @@ class TelegramSyncService:
                 continue
 
             chunk_ids.append(chunk_message_id)
+            chunk_entries.append(chunk_entry)
 
         chunk_message_ids.update(chunk_ids)
-        total_size = await self._sum_chunk_sizes(chunk_ids)
+        chunk_sizes = await self._get_chunk_sizes(chunk_ids)
 
         return {
             "filename": original_filename,
             "file_id": f"{message.id}:{file_id}",
-            "filesize": total_size,
+            "filesize": sum(size for size in chunk_sizes if size is not None),
             "upload_date": upload_date,
+            "chunks": list(zip(chunk_entries, chunk_sizes)),
         }
 
-    async def _sum_chunk_sizes(self, chunk_ids: list[int]) -> int:
-        """按批量读取分块消息，累计大文件总大小。"""
+    async def _get_chunk_sizes(self, chunk_ids: list[int]) -> list[int | None]:
+        """按批量读取分块消息，按顺序返回每个分块的大小，无法解析的记为 None。"""
         if not self.client or not self.channel_entity or not chunk_ids:
-            return 0
+            return [None] * len(chunk_ids)
 
-        total_size = 0
+        chunk_sizes: list[int | None] = []
         for index in range(0, len(chunk_ids), MESSAGE_BATCH_SIZE):
             batch_ids = chunk_ids[index:index + MESSAGE_BATCH_SIZE]
-            messages = await self.client.get_messages(self.channel_entity, ids=batch_ids)
+            messages = await self._telegram_request(
+                self.client.get_messages,
+                self.channel_entity,
+                ids=batch_ids,
+            )
             if not isinstance(messages, list):
                 messages = [messages]
 
@@ -403,10 +639,9 @@ class TelegramSyncService:
                 chunk_size = self._extract_message_size(chunk_message)
                 if chunk_size is None:
                     print(f"警告: 无法解析分块消息 {chunk_id} 的文件大小。")
-                    continue
-                total_size += chunk_size
+                chunk_sizes.append(chunk_size)
 
-        return total_size
+        return chunk_sizes
 
     def _extract_bot_file_id(self, message: Any) -> str | None:
         """提取 Telethon 消息中的 Bot API 风格 file_id。"""
@@ -455,18 +690,12 @@ class TelegramSyncService:
 
     async def _handle_message_deleted(self, event: Any) -> None:
         deleted_ids = getattr(event, "deleted_ids", None) or getattr(event, "message_ids", None) or []
-        for message_id in deleted_ids:
-            deleted_file_id = await asyncio.to_thread(
-                database.delete_file_by_message_id,
-                int(message_id),
-            )
-            if deleted_file_id:
-                await publish_file_update(
-                    {
-                        "action": "delete",
-                        "file_id": deleted_file_id
-                    }
-                )
+        # 整个删除事件在一个事务内处理，避免逐条加写锁。
+        deleted_file_ids = await asyncio.to_thread(
+            database.delete_files_by_message_ids,
+            [int(message_id) for message_id in deleted_ids],
+        )
+        await publish_files_deleted(deleted_file_ids)
 
 
 @lru_cache()
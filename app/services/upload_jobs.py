@@ -0,0 +1,497 @@
+import asyncio
+import math
+import os
+import time
+import uuid
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, AsyncIterator
+
+from .. import database
+from ..core.config import Settings, get_settings
+from ..events import publish_file_update
+from ..utils.file_paths import build_file_path
+from .telegram_service import CHUNK_SIZE_BYTES, TelegramService, get_telegram_service
+
+# 同时执行的后台上传任务数量；每个任务内部仍按 UPLOAD_CONCURRENCY 并发发送分块。
+DEFAULT_UPLOAD_JOB_CONCURRENCY = 2
+UPLOAD_SPOOL_SUFFIX = ".upload"
+# 可续传上传会话超过这么久没有收到数据时，在下次启动时清理。
+UPLOAD_SESSION_TTL_SECONDS = 24 * 60 * 60
+# 写入会话暂存文件时，攒够这么多字节再交给线程写盘。
+SESSION_WRITE_BUFFER_BYTES = 1024 * 1024
+# 执行中任务的租约时长与续租间隔；租约过期的 running 任务由其他 worker 接管。
+UPLOAD_JOB_LEASE_SECONDS = 60
+UPLOAD_JOB_LEASE_RENEW_SECONDS = 20
+# 其他 worker 仍在转发会话分块，或任务由其他 worker 执行时，finalize 查询状态的间隔。
+UPLOAD_SESSION_POLL_SECONDS = 0.5
+# 发送失败的任务保留暂存文件与已完成的分块，等待一段时间后重试，超过次数才标记为失败。
+UPLOAD_JOB_MAX_ATTEMPTS = 5
+UPLOAD_JOB_RETRY_DELAY_SECONDS = 30.0
+
+
+class _UploadJobLeaseLost(Exception):
+    """任务的租约已被其他 worker 接管。"""
+
+
+class UploadSessionConflict(ValueError):
+    """上传会话的状态或偏移与请求不一致，offset 为服务端当前已接收的字节数。"""
+
+    def __init__(self, message: str, offset: int):
+        super().__init__(message)
+        self.offset = offset
+
+
+def serialize_upload_job(job: dict[str, Any]) -> dict[str, Any]:
+    """生成接口与 SSE 事件共用的任务状态。"""
+    total_size = job["total_size"]
+    return {
+        "job_id": job["id"],
+        "filename": job["filename"],
+        "status": job["status"],
+        "total_size": total_size,
+        "uploaded_bytes": job["uploaded_bytes"],
+        "part_count": math.ceil(total_size / CHUNK_SIZE_BYTES) if total_size >= CHUNK_SIZE_BYTES else 1,
+        "completed_parts": job.get("completed_parts"),
+        "file_id": job["file_id"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+class UploadJobManager:
+    """
+    后台上传任务队列。
+
+    请求体先写入 spool 目录，接口立即返回任务 ID；固定数量的 worker 再调用
+    TelegramService.upload_file 发送到 Telegram。任务状态与每个已完成的分块写入 SQLite，
+    应用重启后未完成的任务重新入队，并跳过已发送的分块。
+
+    多个 worker 进程共用同一个数据库时，任务执行前先原子地认领并持有租约，
+    同一个任务只会有一个 worker 在发送；持有者退出、租约过期后才由其他 worker 接管。
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        telegram_service: TelegramService,
+        *,
+        concurrency: int = DEFAULT_UPLOAD_JOB_CONCURRENCY,
+        spool_dir: str = "upload_spool",
+    ):
+        self.settings = settings
+        self.telegram_service = telegram_service
+        self.concurrency = max(concurrency, 1)
+        self.spool_dir = spool_dir
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._workers: list[asyncio.Task] = []
+        self._recovery_task: asyncio.Task | None = None
+        self._attempts: dict[str, int] = {}
+        self._retry_handles: dict[str, asyncio.TimerHandle] = {}
+        # 上传会话：写入锁、后台转发完整分块的任务，以及等待任务完成的 finalize 请求。
+        self._session_locks: dict[str, asyncio.Lock] = {}
+        self._forward_tasks: dict[str, asyncio.Task] = {}
+        self._forward_requested: set[str] = set()
+        self._job_waiters: dict[str, asyncio.Future] = {}
+
+    def new_spool_path(self) -> tuple[str, str]:
+        """分配新的任务 ID 及其请求体落地路径。"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        job_id = uuid.uuid4().hex
+        return job_id, os.path.join(self.spool_dir, f"{job_id}{UPLOAD_SPOOL_SUFFIX}")
+
+    async def start(self) -> None:
+        """恢复未完成的任务并启动 worker；其他 worker 仍持有租约的 running 任务不在此接管。"""
+        if self._workers:
+            return
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        resumed = 0
+        now = int(time.time())
+        expire_before = now - UPLOAD_SESSION_TTL_SECONDS
+        for job in await asyncio.to_thread(database.get_unfinished_upload_jobs):
+            leased = job["status"] == "running" and (job["lease_expires_at"] or 0) >= now
+            if leased:
+                continue
+            if not os.path.exists(job["spool_path"]):
+                await self._set_status(job["id"], "failed", error="上传缓存文件已丢失，无法恢复。")
+            elif job["status"] != "receiving":
+                self._queue.put_nowait(job["id"])
+                resumed += 1
+            elif job["updated_at"] < expire_before:
+                await self._set_status(job["id"], "failed", error="上传会话已过期。")
+                self._remove_spool_file(job["spool_path"])
+        if resumed:
+            print(f"已恢复 {resumed} 个未完成的后台上传任务。")
+
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        self._recovery_task = asyncio.create_task(self._recover_expired_jobs())
+
+    async def stop(self) -> None:
+        """停止 worker 与分块转发；进行中的任务保持原状态并释放租约，下次启动时继续。"""
+        tasks = [*self._workers, *self._forward_tasks.values()]
+        if self._recovery_task:
+            tasks.append(self._recovery_task)
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        for handle in self._retry_handles.values():
+            handle.cancel()
+        self._retry_handles.clear()
+        self._workers = []
+        self._recovery_task = None
+        self._forward_tasks.clear()
+        self._forward_requested.clear()
+        await asyncio.to_thread(database.release_upload_job_leases, self.owner)
+
+    async def submit(self, job_id: str, filename: str, spool_path: str, total_size: int) -> dict[str, Any]:
+        """登记一个已完整落地的上传任务并放入队列。"""
+        job = await asyncio.to_thread(database.create_upload_job, job_id, filename, spool_path, total_size)
+        job["completed_parts"] = 0
+        self._queue.put_nowait(job_id)
+        await self._publish_job(job)
+        return job
+
+    async def create_session(self, filename: str, total_size: int) -> dict[str, Any]:
+        """创建可续传上传会话，之后按偏移追加数据，收齐后调用 finalize_session。"""
+        job_id, spool_path = self.new_spool_path()
+        await asyncio.to_thread(Path(spool_path).touch)
+        job = await asyncio.to_thread(
+            database.create_upload_job,
+            job_id,
+            filename,
+            spool_path,
+            total_size,
+            status="receiving",
+        )
+        job["completed_parts"] = 0
+        return job
+
+    @staticmethod
+    def get_session_offset(job: dict[str, Any]) -> int:
+        """会话已接收的字节数即暂存文件的大小。"""
+        try:
+            return os.path.getsize(job["spool_path"])
+        except OSError:
+            return 0
+
+    async def append_session_data(
+        self,
+        job: dict[str, Any],
+        offset: int,
+        chunks: AsyncIterator[bytes],
+    ) -> int:
+        """
+        从 offset 处追加会话数据，返回新的偏移。offset 必须等于当前已接收的字节数。
+        数据边到达边写盘，连接中途断开时已写入的部分仍然保留；
+        每收齐一个完整分块就安排后台转发到 Telegram。
+        """
+        job_id = job["id"]
+        async with self._session_lock(job_id):
+            job = await asyncio.to_thread(database.get_upload_job, job_id) or job
+            current_offset = self.get_session_offset(job)
+            if job["status"] != "receiving":
+                raise UploadSessionConflict("上传会话已结束。", current_offset)
+            if offset != current_offset:
+                raise UploadSessionConflict("上传偏移与服务端不一致。", current_offset)
+
+            buffer = bytearray()
+            try:
+                with open(job["spool_path"], "ab") as spool_file:
+                    async for chunk in chunks:
+                        if current_offset + len(buffer) + len(chunk) > job["total_size"]:
+                            raise UploadSessionConflict("上传数据超过声明的文件大小。", current_offset)
+                        buffer += chunk
+                        if len(buffer) >= SESSION_WRITE_BUFFER_BYTES:
+                            await asyncio.to_thread(spool_file.write, bytes(buffer))
+                            current_offset += len(buffer)
+                            buffer.clear()
+                    if buffer:
+                        await asyncio.to_thread(spool_file.write, bytes(buffer))
+                        current_offset += len(buffer)
+            finally:
+                await asyncio.to_thread(database.touch_upload_session, job_id)
+                if current_offset >= CHUNK_SIZE_BYTES:
+                    self._schedule_forward(job_id)
+        return current_offset
+
+    async def finalize_session(self, job: dict[str, Any]) -> dict[str, Any]:
+        """
+        结束数据接收，把会话交给后台任务发送剩余分块与清单，并等待其完成。
+        对已进入队列或已完成的会话重复调用是安全的。
+        """
+        job_id = job["id"]
+        loop = asyncio.get_running_loop()
+        async with self._session_lock(job_id):
+            while True:
+                job = await asyncio.to_thread(database.get_upload_job, job_id) or job
+                if job["status"] != "receiving":
+                    break
+                offset = self.get_session_offset(job)
+                if offset != job["total_size"]:
+                    raise UploadSessionConflict("上传数据尚未收齐。", offset)
+                # 等待进行中的分块转发结束，避免与后台任务重复发送同一个分块。
+                forward_task = self._forward_tasks.get(job_id)
+                if forward_task:
+                    self._forward_requested.discard(job_id)
+                    await asyncio.gather(forward_task, return_exceptions=True)
+                waiter = self._job_waiters.setdefault(job_id, loop.create_future())
+                if await asyncio.to_thread(database.queue_upload_session, job_id):
+                    self._queue.put_nowait(job_id)
+                    job["status"] = "queued"
+                    break
+                # 其他 worker 正在转发分块，等它释放租约后再交给后台任务。
+                await asyncio.sleep(UPLOAD_SESSION_POLL_SECONDS)
+
+            if job["status"] in ("queued", "running"):
+                waiter = self._job_waiters.setdefault(job_id, loop.create_future())
+            else:
+                return job
+
+        return await self._wait_for_job(job_id, waiter)
+
+    async def _wait_for_job(self, job_id: str, waiter: asyncio.Future) -> dict[str, Any]:
+        """等待任务结束；任务可能由其他 worker 执行，本进程的 waiter 不会被唤醒，因此同时查询状态。"""
+        while True:
+            done, _ = await asyncio.wait({waiter}, timeout=UPLOAD_SESSION_POLL_SECONDS)
+            job = await asyncio.to_thread(database.get_upload_job, job_id)
+            if done or not job or job["status"] in ("done", "failed"):
+                return job
+
+    def _session_lock(self, job_id: str) -> asyncio.Lock:
+        lock = self._session_locks.get(job_id)
+        if lock is None:
+            lock = self._session_locks[job_id] = asyncio.Lock()
+        return lock
+
+    def _schedule_forward(self, job_id: str) -> None:
+        self._forward_requested.add(job_id)
+        task = self._forward_tasks.get(job_id)
+        if task is None or task.done():
+            self._forward_tasks[job_id] = asyncio.create_task(self._forward_parts(job_id))
+
+    async def _forward_parts(self, job_id: str) -> None:
+        """转发会话中已收齐但尚未发送的完整分块；转发期间又有新数据到达时继续处理。"""
+        try:
+            while job_id in self._forward_requested:
+                self._forward_requested.discard(job_id)
+                await self._forward_complete_parts(job_id)
+        except Exception as exc:
+            # 转发失败的分块会在 finalize 后由后台任务补发。
+            print(f"上传会话 {job_id} 转发分块失败: {exc}")
+        finally:
+            if self._forward_tasks.get(job_id) is asyncio.current_task():
+                del self._forward_tasks[job_id]
+
+    async def _forward_complete_parts(self, job_id: str) -> None:
+        # 先认领会话的租约，多个 worker 收到同一会话的数据时只有一个在转发。
+        job = await asyncio.to_thread(database.claim_upload_session, job_id, self.owner, UPLOAD_JOB_LEASE_SECONDS)
+        if not job:
+            return
+
+        try:
+            completed_parts = await asyncio.to_thread(database.get_upload_job_parts, job_id)
+            complete_count = self.get_session_offset(job) // CHUNK_SIZE_BYTES
+            # 第一个分块作为回复锚点，必须最先发送。
+            anchor_message_id = database.parse_message_id(completed_parts[0]) if 0 in completed_parts else None
+            for index in range(complete_count):
+                if index in completed_parts:
+                    continue
+                upload = asyncio.create_task(self.telegram_service.upload_file_part(
+                    job["spool_path"],
+                    index,
+                    job["filename"],
+                    anchor_message_id,
+                ))
+                chunk_file_id, chunk_size = await self._hold_lease(job_id, upload)
+                await asyncio.to_thread(database.record_upload_job_part, job_id, index, chunk_file_id, chunk_size)
+                await self._publish_job_by_id(job_id)
+                if index == 0:
+                    anchor_message_id = database.parse_message_id(chunk_file_id)
+        finally:
+            await asyncio.to_thread(database.release_upload_job_leases, self.owner, job_id)
+
+    async def _recover_expired_jobs(self) -> None:
+        """定期接管租约已过期的任务，即执行它的 worker 已退出或长时间没有续租。"""
+        while True:
+            await asyncio.sleep(UPLOAD_JOB_LEASE_SECONDS)
+            try:
+                for job_id in await asyncio.to_thread(database.get_expired_upload_jobs):
+                    self._queue.put_nowait(job_id)
+            except Exception as exc:
+                print(f"检查过期的后台上传任务失败: {exc}")
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                print(f"后台上传任务 {job_id} 异常: {exc}")
+                await self._set_status(job_id, "failed", error=str(exc), owner=self.owner)
+            finally:
+                self._queue.task_done()
+                self._session_locks.pop(job_id, None)
+                waiter = self._job_waiters.pop(job_id, None)
+                if waiter and not waiter.done():
+                    waiter.set_result(None)
+
+    async def _run_job(self, job_id: str) -> None:
+        # 认领失败说明任务已结束或正由其他 worker 执行。
+        job = await asyncio.to_thread(database.claim_upload_job, job_id, self.owner, UPLOAD_JOB_LEASE_SECONDS)
+        if not job:
+            return
+
+        await self._publish_job_by_id(job_id)
+        completed_parts = await asyncio.to_thread(database.get_upload_job_parts, job_id)
+        # 上次执行在清单写入数据库之后、任务标记完成之前退出时，不再重复发送清单。
+        if 0 in completed_parts:
+            file_id = await asyncio.to_thread(database.find_file_by_first_chunk, completed_parts[0])
+            if file_id:
+                await self._complete_job(job_id, job["spool_path"], file_id)
+                return
+
+        async def record_part(index: int, chunk_file_id: str, size: int) -> None:
+            await asyncio.to_thread(database.record_upload_job_part, job_id, index, chunk_file_id, size)
+            await self._publish_job_by_id(job_id)
+
+        upload = asyncio.create_task(self.telegram_service.upload_file(
+            job["spool_path"],
+            job["filename"],
+            completed_parts=completed_parts,
+            part_callback=record_part,
+        ))
+        try:
+            file_id = await self._hold_lease(job_id, upload)
+        except _UploadJobLeaseLost:
+            print(f"后台上传任务 {job_id} 的租约已被其他 worker 接管，停止本地执行。")
+            return
+        if not file_id:
+            await self._retry_or_fail(job_id, job["spool_path"])
+            return
+
+        await self._complete_job(job_id, job["spool_path"], file_id)
+
+    async def _complete_job(self, job_id: str, spool_path: str, file_id: str) -> None:
+        self._attempts.pop(job_id, None)
+        await self._set_status(job_id, "done", file_id=file_id, owner=self.owner)
+        self._remove_spool_file(spool_path)
+        await self._publish_file_added(file_id)
+
+    async def _retry_or_fail(self, job_id: str, spool_path: str) -> None:
+        """
+        发送失败多为网络或 Telegram 的临时错误：保留暂存文件与已完成的分块，任务回到 queued 稍后重试，
+        已发送的分块不会重复发送。连续失败达到上限后才标记为失败并清理暂存文件。
+        """
+        attempts = self._attempts[job_id] = self._attempts.get(job_id, 0) + 1
+        if attempts >= UPLOAD_JOB_MAX_ATTEMPTS:
+            self._attempts.pop(job_id, None)
+            await self._set_status(job_id, "failed", error="上传到 Telegram 失败。", owner=self.owner)
+            self._remove_spool_file(spool_path)
+            return
+
+        print(f"后台上传任务 {job_id} 第 {attempts} 次发送失败，{UPLOAD_JOB_RETRY_DELAY_SECONDS:g} 秒后重试。")
+        await self._set_status(job_id, "queued", owner=self.owner)
+        self._retry_handles[job_id] = asyncio.get_running_loop().call_later(
+            UPLOAD_JOB_RETRY_DELAY_SECONDS,
+            self._requeue,
+            job_id,
+        )
+
+    def _requeue(self, job_id: str) -> None:
+        self._retry_handles.pop(job_id, None)
+        self._queue.put_nowait(job_id)
+
+    async def _hold_lease(self, job_id: str, upload: asyncio.Task) -> Any:
+        """等待上传结束并定期续租，返回上传结果；续租失败说明任务已被接管，取消本地上传。"""
+        try:
+            while True:
+                done, _ = await asyncio.wait({upload}, timeout=UPLOAD_JOB_LEASE_RENEW_SECONDS)
+                if done:
+                    return upload.result()
+                renewed = await asyncio.to_thread(
+                    database.renew_upload_job_lease,
+                    job_id,
+                    self.owner,
+                    UPLOAD_JOB_LEASE_SECONDS,
+                )
+                if not renewed:
+                    raise _UploadJobLeaseLost(job_id)
+        finally:
+            if not upload.done():
+                upload.cancel()
+                await asyncio.gather(upload, return_exceptions=True)
+
+    async def _set_status(
+        self,
+        job_id: str,
+        status: str,
+        *,
+        file_id: str | None = None,
+        error: str | None = None,
+        owner: str | None = None,
+    ) -> None:
+        """更新任务状态并广播；指定 owner 时，任务已被其他 worker 接管则不做改动。"""
+        updated = await asyncio.to_thread(
+            database.set_upload_job_status,
+            job_id,
+            status,
+            file_id=file_id,
+            error=error,
+            owner=owner,
+        )
+        if updated:
+            await self._publish_job_by_id(job_id)
+
+    async def _publish_job_by_id(self, job_id: str) -> None:
+        job = await asyncio.to_thread(database.get_upload_job, job_id)
+        if job:
+            await self._publish_job(job)
+
+    async def _publish_job(self, job: dict[str, Any]) -> None:
+        await publish_file_update({"action": "job", **serialize_upload_job(job)})
+
+    async def _publish_file_added(self, file_id: str) -> None:
+        """与同步上传接口一致，完成后广播新增文件事件。"""
+        file_info = await asyncio.to_thread(database.get_file_info, file_id)
+        if not file_info:
+            return
+        path = build_file_path(file_info["file_id"], file_info["filename"], self.settings.FILE_ROUTE)
+        await publish_file_update({
+            "action": "add",
+            "filename": file_info["filename"],
+            "file_id": file_info["file_id"],
+            "filesize": file_info["filesize"],
+            "upload_date": file_info["upload_date"],
+            "path": path,
+            "url": f"{self.settings.BASE_URL.strip('/')}{path}",
+        })
+
+    @staticmethod
+    def _remove_spool_file(spool_path: str) -> None:
+        try:
+            os.remove(spool_path)
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            print(f"删除上传缓存文件 {spool_path} 失败: {exc}")
+
+
+@lru_cache()
+def get_upload_job_manager() -> UploadJobManager:
+    """后台上传任务队列工厂。"""
+    settings = get_settings()
+    return UploadJobManager(
+        settings,
+        get_telegram_service(),
+        concurrency=settings.UPLOAD_JOB_CONCURRENCY,
+        spool_dir=settings.UPLOAD_SPOOL_DIR,
+    )
@@ -10,10 +10,18 @@ const copyLinksBtn = document.getElementById('copy-links-btn');
 const selectionCounter = document.getElementById('selection-counter');
 const formatOptionsContainer = document.querySelector('.link-format-selector');
 const formatOptions = document.querySelectorAll('.format-option');
+const paginationNav = document.querySelector('.pagination');
 
 const FILE_ROUTE_PREFIX = '/d';
+const THUMBNAIL_ROUTE_PREFIX = '/t';
+// 超过这个大小的文件改用可续传上传会话，每次 PATCH 发送一段，断线后从服务端记录的偏移继续。
+const RESUMABLE_UPLOAD_MIN_BYTES = 20 * 1024 * 1024;
+const RESUMABLE_SLICE_BYTES = 8 * 1024 * 1024;
+const RESUMABLE_MAX_RETRIES = 8;
 const uploadQueue = [];
 let isUploading = false;
+let nextPageCursor = paginationNav?.dataset.nextCursor || '';
+let isLoadingNextPage = false;
 
 function escapeHtml(value) {
     return String(value)
@@ -40,6 +48,10 @@ function buildDownloadPath(fileId, filename) {
     return `${FILE_ROUTE_PREFIX}/${encodeURIComponent(fileId)}/${encodeURIComponent(filename)}`;
 }
 
+function buildThumbnailPath(fileId) {
+    return `${THUMBNAIL_ROUTE_PREFIX}/${encodeURIComponent(fileId)}`;
+}
+
 function getAbsoluteUrl(pathOrUrl) {
     if (/^https?:\/\//i.test(pathOrUrl)) {
         return pathOrUrl;
@@ -57,6 +69,7 @@ function normalizeFilePayload(file) {
         upload_date: file.upload_date || new Date().toISOString(),
         path,
         url: file.url || getAbsoluteUrl(path),
+        thumbnail_path: file.thumbnail_path || buildThumbnailPath(file.file_id),
     };
 }
 
@@ -236,7 +249,7 @@ function createImageItem(file) {
     nameWrapper.className = 'file-info-name';
 
     const image = document.createElement('img');
-    image.src = file.path;
+    image.src = file.thumbnail_path;
     image.alt = file.filename;
     image.className = 'list-thumbnail';
     image.loading = 'lazy';
@@ -429,13 +442,131 @@ function handleUploadCompletion(xhr, originalFileName, fileId, fileSize) {
     }
 }
 
-function uploadFile(file) {
+function sendXhr(method, url, { body = null, headers = {}, onProgress = null } = {}) {
     return new Promise((resolve) => {
-        const formData = new FormData();
-        formData.append('file', file, file.name);
+        const xhr = new XMLHttpRequest();
+        xhr.open(method, url, true);
+        Object.entries(headers).forEach(([name, value]) => xhr.setRequestHeader(name, value));
+        if (onProgress) {
+            xhr.upload.onprogress = ({ loaded }) => onProgress(loaded);
+        }
+        xhr.onload = () => resolve(xhr);
+        xhr.onerror = () => resolve(xhr);
+        xhr.send(body);
+    });
+}
+
+function parseJsonResponse(xhr) {
+    try {
+        return JSON.parse(xhr.responseText);
+    } catch {
+        return {};
+    }
+}
+
+function getResumableSessionKey(file) {
+    return `upload-session:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function openResumableSession(file) {
+    // 页面刷新或重新选择同一个文件时，沿用尚未完成的会话。
+    const sessionKey = getResumableSessionKey(file);
+    const savedSessionId = localStorage.getItem(sessionKey);
+    if (savedSessionId) {
+        const xhr = await sendXhr('GET', `/api/upload/sessions/${encodeURIComponent(savedSessionId)}`);
+        const session = parseJsonResponse(xhr);
+        if (xhr.status === 200 && session.status === 'receiving') {
+            return session;
+        }
+        localStorage.removeItem(sessionKey);
+    }
+
+    const xhr = await sendXhr(
+        'POST',
+        `/api/upload/sessions?filename=${encodeURIComponent(file.name)}&size=${file.size}`,
+    );
+    if (xhr.status !== 201) {
+        return { error: xhr };
+    }
+    const session = parseJsonResponse(xhr);
+    localStorage.setItem(sessionKey, session.session_id);
+    return session;
+}
+
+async function uploadFileResumable(file, fileId) {
+    const session = await openResumableSession(file);
+    if (session.error) {
+        return session.error;
+    }
+
+    const sessionUrl = `/api/upload/sessions/${encodeURIComponent(session.session_id)}`;
+    let offset = session.offset || 0;
+    let retries = 0;
+    updateProgressBar(file.name, offset, file.size, fileId);
+
+    while (offset < file.size) {
+        const end = Math.min(offset + RESUMABLE_SLICE_BYTES, file.size);
+        const xhr = await sendXhr('PATCH', sessionUrl, {
+            body: file.slice(offset, end),
+            headers: {
+                'Content-Type': 'application/offset+octet-stream',
+                'Upload-Offset': String(offset),
+            },
+            onProgress: (loaded) => updateProgressBar(file.name, offset + loaded, file.size, fileId),
+        });
+
+        const response = parseJsonResponse(xhr);
+        if (xhr.status === 200) {
+            offset = response.offset;
+            retries = 0;
+            continue;
+        }
+        if (xhr.status === 409 && typeof response.offset === 'number' && retries < RESUMABLE_MAX_RETRIES) {
+            // 偏移与服务端不一致，直接采用服务端返回的偏移。
+            offset = response.offset;
+            retries += 1;
+            continue;
+        }
+        if (xhr.status >= 400 && xhr.status < 500) {
+            return xhr;
+        }
+
+        retries += 1;
+        if (retries > RESUMABLE_MAX_RETRIES) {
+            return xhr;
+        }
+
+        // 网络中断或服务端错误：退避后查询服务端已接收的偏移再继续。
+        await new Promise((resolve) => setTimeout(resolve, Math.min(1000 * 2 ** (retries - 1), 30000)));
+        const statusXhr = await sendXhr('GET', sessionUrl);
+        if (statusXhr.status === 200) {
+            offset = parseJsonResponse(statusXhr).offset ?? offset;
+        }
+    }
+
+    const finalizeXhr = await sendXhr('POST', `${sessionUrl}/finalize`);
+    if (finalizeXhr.status === 200 || finalizeXhr.status === 500) {
+        localStorage.removeItem(getResumableSessionKey(file));
+    }
+    return finalizeXhr;
+}
+
+function uploadFile(file) {
+    if (file.size >= RESUMABLE_UPLOAD_MIN_BYTES) {
+        const fileId = `file-${Date.now()}-${Math.random().toString(36).slice(2, 9)}`;
+        if (progressArea) {
+            progressArea.insertAdjacentHTML('beforeend', `<div class="row" id="progress-${fileId}"></div>`);
+        }
+        return uploadFileResumable(file, fileId).then((xhr) => {
+            handleUploadCompletion(xhr, file.name, fileId, file.size);
+        });
+    }
 
+    return new Promise((resolve) => {
+        // 直接发送文件内容，服务端边接收边分块转发到 Telegram。
         const xhr = new XMLHttpRequest();
-        xhr.open('POST', '/api/upload', true);
+        xhr.open('POST', `/api/upload/stream?filename=${encodeURIComponent(file.name)}`, true);
+        xhr.setRequestHeader('Content-Type', 'application/octet-stream');
 
         const fileId = `file-${Date.now()}-${Math.random().toString(36).slice(2, 9)}`;
 
@@ -457,7 +588,7 @@ function uploadFile(file) {
             progressArea.insertAdjacentHTML('beforeend', `<div class="row" id="progress-${fileId}"></div>`);
         }
 
-        xhr.send(formData);
+        xhr.send(file);
     });
 }
 
@@ -737,23 +868,162 @@ if (copyLinksBtn) {
     });
 }
 
+function appendFileItems(rawFiles) {
+    const container = getActiveListContainer();
+    if (!container) {
+        return;
+    }
+
+    for (const rawFile of rawFiles) {
+        const file = normalizeFilePayload(rawFile);
+        if (document.getElementById(getFileItemDomId(file.file_id))) {
+            continue;
+        }
+        if (imageListBody && !isImageFile(file.filename)) {
+            continue;
+        }
+        container.appendChild(imageListBody ? createImageItem(file) : createDiskItem(file));
+    }
+
+    refreshBatchControls();
+}
+
+function updateNextPageLink() {
+    const nextLink = paginationNav?.querySelector('.pagination-link:last-of-type');
+    if (!nextLink) {
+        return;
+    }
+
+    nextLink.classList.toggle('disabled', !nextPageCursor);
+    nextLink.setAttribute('aria-disabled', nextPageCursor ? 'false' : 'true');
+    nextLink.href = nextPageCursor ? `?cursor=${encodeURIComponent(nextPageCursor)}` : '?';
+}
+
+async function loadNextPage() {
+    if (!nextPageCursor || isLoadingNextPage) {
+        return false;
+    }
+
+    isLoadingNextPage = true;
+    try {
+        const params = new URLSearchParams({ cursor: nextPageCursor });
+        if (isImagePage()) {
+            params.set('images_only', 'true');
+        }
+
+        const response = await fetch(`/api/files?${params}`);
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+
+        const data = await response.json();
+        appendFileItems(data.items || []);
+        nextPageCursor = data.next_cursor || '';
+        updateNextPageLink();
+        return true;
+    } catch (error) {
+        console.error('Failed to load next page:', error);
+        return false;
+    } finally {
+        isLoadingNextPage = false;
+    }
+}
+
+function setupInfiniteScroll() {
+    // 滚动到分页栏附近时按游标自动加载下一页，分页链接保留给不支持的浏览器。
+    if (!paginationNav || !getActiveListContainer() || !('IntersectionObserver' in window)) {
+        return;
+    }
+
+    const observer = new IntersectionObserver(async (entries) => {
+        if (!entries.some((entry) => entry.isIntersecting)) {
+            return;
+        }
+
+        const loaded = await loadNextPage();
+        observer.unobserve(paginationNav);
+        if (loaded && nextPageCursor) {
+            // 重新观察一次，新内容不足一屏时会立即继续加载。
+            observer.observe(paginationNav);
+        }
+    }, { rootMargin: '200px' });
+    observer.observe(paginationNav);
+}
+
+async function resyncFileList() {
+    // 服务端无法补发断线期间的事件时，重新加载第一页。
+    const container = getActiveListContainer();
+    if (!container) {
+        return;
+    }
+
+    try {
+        const params = new URLSearchParams();
+        if (isImagePage()) {
+            params.set('images_only', 'true');
+        }
+        const response = await fetch(`/api/files?${params}`);
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+
+        const data = await response.json();
+        container.querySelectorAll('.file-item-disk, .image-list-item').forEach((item) => item.remove());
+        appendFileItems(data.items || []);
+        nextPageCursor = data.next_cursor || '';
+        updateNextPageLink();
+        ensureEmptyState();
+    } catch (error) {
+        console.error('Failed to resync file list:', error);
+    }
+}
+
+function handleFileUpdate(payload) {
+    if (payload.action === 'delete') {
+        removeFileItem(payload.file_id);
+        return;
+    }
+
+    if (payload.action === 'delete_many') {
+        // 批量删除合并为一条事件推送。
+        (payload.file_ids || []).forEach(removeFileItem);
+        return;
+    }
+
+    if (payload.action === 'batch') {
+        // 同一波的新增与删除由服务端合并为一条事件。
+        (payload.deleted || []).forEach(removeFileItem);
+        (payload.added || []).forEach(addOrUpdateFileItem);
+        (payload.events || []).forEach(handleFileUpdate);
+        return;
+    }
+
+    if (payload.action === 'reset') {
+        resyncFileList();
+        return;
+    }
+
+    if (payload.action === 'add') {
+        addOrUpdateFileItem(payload);
+    }
+}
+
+// 重建 EventSource 时浏览器不会带上 Last-Event-ID，改用查询参数传给服务端补发错过的事件。
+let lastFileUpdateId = '';
+
 function connectSSE() {
     if (!getActiveListContainer()) {
         return;
     }
 
-    const eventSource = new EventSource('/api/file-updates');
+    const query = lastFileUpdateId ? `?last_event_id=${encodeURIComponent(lastFileUpdateId)}` : '';
+    const eventSource = new EventSource(`/api/file-updates${query}`);
     eventSource.onmessage = (event) => {
+        if (event.lastEventId) {
+            lastFileUpdateId = event.lastEventId;
+        }
         try {
-            const payload = JSON.parse(event.data);
-            if (payload.action === 'delete') {
-                removeFileItem(payload.file_id);
-                return;
-            }
-
-            if (payload.action === 'add') {
-                addOrUpdateFileItem(payload);
-            }
+            handleFileUpdate(JSON.parse(event.data));
         } catch (error) {
             console.error('Failed to parse SSE payload:', error);
         }
@@ -770,4 +1040,5 @@ document.addEventListener('DOMContentLoaded', () => {
     ensureEmptyState();
     refreshBatchControls();
     connectSSE();
+    setupInfiniteScroll();
 });
@@ -0,0 +1,62 @@
+import base64
+import json
+
+
+class InvalidCursor(ValueError):
+    """分页游标无法解析。"""
+
+
+def _encode_payload(values: list) -> str:
+    payload = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def _decode_payload(cursor: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursor(cursor) from exc
+
+    if not isinstance(values, list) or len(values) != 2 or not isinstance(values[1], int):
+        raise InvalidCursor(cursor)
+    return values
+
+
+def encode_cursor(upload_date: str, row_id: int) -> str:
+    """把 (upload_date, id) 编码为对客户端不透明的 URL 安全字符串。"""
+    return _encode_payload([upload_date, row_id])
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    upload_date, row_id = _decode_payload(cursor)
+    if not isinstance(upload_date, str):
+        raise InvalidCursor(cursor)
+    return upload_date, row_id
+
+
+def encode_search_cursor(sort_key: float | str, row_id: int) -> str:
+    """搜索结果的游标，sort_key 为相关度得分或上传时间。"""
+    return _encode_payload([sort_key, row_id])
+
+
+def decode_search_cursor(cursor: str) -> tuple[float | str, int]:
+    sort_key, row_id = _decode_payload(cursor)
+    if isinstance(sort_key, bool) or not isinstance(sort_key, (int, float, str)):
+        raise InvalidCursor(cursor)
+    return sort_key, row_id
+
+
+def build_page_cursors(
+    rows: list[dict],
+    *,
+    has_older: bool,
+    has_newer: bool,
+) -> tuple[str | None, str | None]:
+    """根据当前页首尾两行生成 (next_cursor, prev_cursor)，对应方向没有记录时为 None。"""
+    if not rows:
+        return None, None
+
+    next_cursor = encode_cursor(rows[-1]["upload_date"], rows[-1]["id"]) if has_older else None
+    prev_cursor = encode_cursor(rows[0]["upload_date"], rows[0]["id"]) if has_newer else None
+    return next_cursor, prev_cursor
@@ -1,6 +1,7 @@
 from urllib.parse import quote, unquote, urlparse
 
 DEFAULT_FILE_ROUTE = "/d"
+THUMBNAIL_ROUTE = "/t"
 
 
 def normalize_file_route(file_route: str | None = None) -> str:
@@ -19,6 +20,11 @@ def build_file_path(file_id: str, filename: str, file_route: str | None = None)
     return f"{route}/{encoded_file_id}/{encoded_filename}"
 
 
+def build_thumbnail_path(file_id: str) -> str:
+    """构建缩略图路径。"""
+    return f"{THUMBNAIL_ROUTE}/{quote(str(file_id), safe='')}"
+
+
 def extract_file_id_from_value(value: str | None, file_route: str | None = None) -> str | None:
     """从文件 URL、相对路径或复合 file_id 中解析 file_id。"""
     if value is None:
@@ -0,0 +1,134 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Mapping
+
+
+class RangeNotSatisfiable(ValueError):
+    """Range 起点超出文件大小，应返回 416。"""
+
+
+def parse_range_header(value: str | None, total_size: int) -> tuple[int, int] | None:
+    """
+    解析单段 `bytes=` Range 头，返回闭区间 (start, end)。
+    多段或格式不合法的 Range 按规范忽略，返回 None 表示输出完整内容。
+    """
+    if not value or total_size <= 0:
+        return None
+
+    unit, _, range_spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in range_spec:
+        return None
+
+    start_text, separator, end_text = range_spec.strip().partition("-")
+    if not separator:
+        return None
+
+    try:
+        if not start_text:
+            suffix_length = int(end_text)
+            if suffix_length <= 0:
+                raise RangeNotSatisfiable(value)
+            return max(total_size - suffix_length, 0), total_size - 1
+
+        start = int(start_text)
+        end = int(end_text) if end_text else None
+    except ValueError:
+        return None
+
+    if start < 0 or (end is not None and end < start):
+        return None
+    if start >= total_size:
+        raise RangeNotSatisfiable(value)
+    return start, total_size - 1 if end is None else min(end, total_size - 1)
+
+
+def parse_content_range_total(value: str | None) -> int | None:
+    """从 `Content-Range: bytes 0-127/5000` 中取出完整大小。"""
+    if not value or "/" not in value:
+        return None
+
+    total_text = value.rsplit("/", 1)[1].strip()
+    return int(total_text) if total_text.isdigit() else None
+
+
+def split_range_across_chunks(
+    chunk_sizes: list[int],
+    start: int,
+    end: int,
+) -> tuple[int, int, int, int]:
+    """
+    把完整文件中的字节区间映射到分块上。
+    返回 (首个分块下标, 首块内起始偏移, 末个分块下标, 末块内结束偏移)。
+    """
+    first_index = last_index = -1
+    first_offset = last_end = 0
+    chunk_start = 0
+    for index, chunk_size in enumerate(chunk_sizes):
+        chunk_end = chunk_start + chunk_size - 1
+        if first_index < 0 and start <= chunk_end:
+            first_index = index
+            first_offset = start - chunk_start
+        if end <= chunk_end:
+            last_index = index
+            last_end = end - chunk_start
+            break
+        chunk_start += chunk_size
+
+    if first_index < 0 or last_index < 0:
+        raise RangeNotSatisfiable(f"bytes={start}-{end}")
+    return first_index, first_offset, last_index, last_end
+
+
+def _parse_upload_date(upload_date: str | None) -> datetime | None:
+    if not upload_date:
+        return None
+
+    try:
+        parsed = datetime.fromisoformat(str(upload_date))
+    except ValueError:
+        return None
+    # SQLite 的 CURRENT_TIMESTAMP 不带时区，但始终是 UTC。
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def build_validator_headers(file_id: str, upload_date: str | None = None) -> dict[str, str]:
+    """生成强 ETag（由 file_id 派生，内容不可变）以及可选的 Last-Modified。"""
+    digest = hashlib.sha256(file_id.encode("utf-8")).hexdigest()[:32]
+    headers = {"ETag": f'"{digest}"'}
+    last_modified = _parse_upload_date(upload_date)
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    return headers
+
+
+def is_not_modified(request_headers: Mapping[str, str], validator_headers: Mapping[str, str]) -> bool:
+    """按 RFC 9110 处理 If-None-Match 与 If-Modified-Since。"""
+    etag = validator_headers["ETag"]
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = {candidate.strip() for candidate in if_none_match.split(",")}
+        return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+    if_modified_since = request_headers.get("if-modified-since")
+    last_modified = validator_headers.get("Last-Modified")
+    if not if_modified_since or not last_modified:
+        return False
+
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return parsedate_to_datetime(last_modified) <= since
+
+
+def if_range_matches(if_range: str | None, validator_headers: Mapping[str, str]) -> bool:
+    """If-Range 不匹配时应忽略 Range，返回完整内容。"""
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    return if_range in (validator_headers["ETag"], validator_headers.get("Last-Modified"))
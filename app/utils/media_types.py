@@ -0,0 +1,59 @@
+import mimetypes
+
+# 参与分类与统计的扩展名最大长度，更长的后缀按无扩展名处理。
+MAX_EXTENSION_LENGTH = 16
+
+# 图床页面能直接展示的图片格式，与前端 isImageFile 保持一致。
+IMAGE_EXTENSIONS = ("jpg", "jpeg", "png", "gif", "bmp", "webp")
+
+MEDIA_KINDS = ("image", "video", "audio", "archive", "document", "other")
+
+EXTENSION_MEDIA_KINDS = {
+    **{extension: "image" for extension in IMAGE_EXTENSIONS},
+    **{
+        extension: "video"
+        for extension in ("mp4", "mkv", "webm", "mov", "avi", "flv", "wmv", "m4v", "3gp")
+    },
+    **{
+        extension: "audio"
+        for extension in ("mp3", "flac", "wav", "ogg", "oga", "m4a", "aac", "opus", "wma")
+    },
+    **{
+        extension: "archive"
+        for extension in ("zip", "rar", "7z", "tar", "gz", "tgz", "bz2", "xz", "zst", "iso")
+    },
+    **{
+        extension: "document"
+        for extension in (
+            "pdf", "doc", "docx", "xls", "xlsx", "ppt", "pptx", "odt", "ods", "odp",
+            "txt", "md", "csv", "rtf", "epub",
+        )
+    },
+}
+
+
+def file_extension(filename: str) -> str:
+    """返回小写的文件扩展名（不含点），没有合法扩展名时返回空字符串。"""
+    _, separator, extension = filename.rpartition(".")
+    extension = extension.lower()
+    if not separator or not extension.isalnum() or len(extension) > MAX_EXTENSION_LENGTH:
+        return ""
+    return extension
+
+
+def classify_media_kind(filename: str, mime_type: str | None = None) -> str:
+    """
+    根据扩展名判断文件类别，扩展名无法判断时再参考 MIME 类型。
+    "image" 只包含图床页面能展示的格式，其余图片格式归为 "other"。
+    """
+    kind = EXTENSION_MEDIA_KINDS.get(file_extension(filename))
+    if kind is not None:
+        return kind
+
+    mime_type = mime_type or mimetypes.guess_type(filename)[0] or ""
+    major_type = mime_type.partition("/")[0].lower()
+    if major_type in ("video", "audio"):
+        return major_type
+    if major_type == "text":
+        return "document"
+    return "other"
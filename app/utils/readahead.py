@@ -0,0 +1,52 @@
+import asyncio
+from collections import deque
+
+
+class ByteBoundedBuffer:
+    """
+    单生产者、单消费者的字节缓冲区，缓冲字节数超过上限时阻塞生产者。
+
+    消费者读取得慢时生产者会停在 `put` 上，不再从上游读取，
+    从而把背压一路传回到 CDN 连接。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(max_bytes, 1)
+        self.buffered_bytes = 0
+        self._pieces: deque[bytes] = deque()
+        self._closed = False
+        self._error: BaseException | None = None
+        self._changed = asyncio.Condition()
+
+    async def put(self, data: bytes) -> None:
+        if not data:
+            return
+        async with self._changed:
+            # 缓冲区为空时总是允许写入，保证单块超过上限时也能继续推进。
+            await self._changed.wait_for(
+                lambda: self.buffered_bytes == 0
+                or self.buffered_bytes + len(data) <= self.max_bytes
+            )
+            self._pieces.append(data)
+            self.buffered_bytes += len(data)
+            self._changed.notify_all()
+
+    async def close(self, error: BaseException | None = None) -> None:
+        """标记数据已经写完；传入 error 时消费者读完已缓冲的数据后会收到该异常。"""
+        async with self._changed:
+            self._closed = True
+            self._error = error
+            self._changed.notify_all()
+
+    async def get(self) -> bytes | None:
+        """返回下一段数据，全部读完时返回 None。"""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._pieces or self._closed)
+            if self._pieces:
+                data = self._pieces.popleft()
+                self.buffered_bytes -= len(data)
+                self._changed.notify_all()
+                return data
+            if self._error is not None:
+                raise self._error
+            return None
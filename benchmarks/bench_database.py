@@ -0,0 +1,197 @@
+"""
+数据库读延迟基准：对比旧实现（每次调用新建连接 + 全局锁）与连接池实现。
+
+运行方式（在项目根目录）:
+    python -m benchmarks.bench_database
+"""
+import argparse
+import contextlib
+import io
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from app import database
+
+
+class LegacyDatabase:
+    """复刻连接池之前的访问方式，作为对照组。"""
+
+    def __init__(self, database_path: str):
+        self.database_path = database_path
+        self.lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.database_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def add_file_metadata(self, filename: str, file_id: str, filesize: int) -> None:
+        with self.lock:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR IGNORE INTO files (filename, file_id, filesize) VALUES (?, ?, ?)",
+                    (filename, file_id, filesize),
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+    def get_files_page(self, limit: int, offset: int = 0) -> list[dict]:
+        with self.lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    """
+                    SELECT filename, file_id, filesize, upload_date
+                    FROM files ORDER BY upload_date DESC, id DESC LIMIT ? OFFSET ?
+                    """,
+                    (limit, offset),
+                ).fetchall()
+                return [dict(row) for row in rows]
+            finally:
+                conn.close()
+
+    def count_files(self) -> int:
+        with self.lock:
+            conn = self._connect()
+            try:
+                return int(conn.execute("SELECT COUNT(*) FROM files").fetchone()[0])
+            finally:
+                conn.close()
+
+    def get_file_info(self, file_id: str) -> dict | None:
+        with self.lock:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT filename, file_id, filesize, upload_date FROM files WHERE file_id = ?",
+                    (file_id,),
+                ).fetchone()
+                return dict(row) if row else None
+            finally:
+                conn.close()
+
+
+class PooledDatabase:
+    """直接调用 `app.database` 中的连接池实现。"""
+
+    add_file_metadata = staticmethod(database.add_file_metadata)
+    get_files_page = staticmethod(database.get_files_page)
+    count_files = staticmethod(database.count_files)
+    get_file_info = staticmethod(database.get_file_info)
+
+
+def seed(row_count: int) -> None:
+    with database.get_connection_pool().writer() as conn:
+        conn.executemany(
+            "INSERT INTO files (filename, file_id, filesize, upload_date) VALUES (?, ?, ?, ?)",
+            (
+                (
+                    f"seed-{index}.bin",
+                    f"{index}:seed-{index}",
+                    index,
+                    f"2026-01-01T00:{index // 60 % 60:02}:{index % 60:02}",
+                )
+                for index in range(row_count)
+            ),
+        )
+
+
+def run_mixed_load(
+    backend,
+    *,
+    readers: int,
+    writers: int,
+    duration: float,
+    row_count: int,
+) -> dict[str, float]:
+    stop_at = time.perf_counter() + duration
+    read_latencies: list[float] = []
+    latencies_lock = threading.Lock()
+    write_counter = iter(range(10**9))
+    write_counter_lock = threading.Lock()
+
+    def reader_loop(worker_index: int) -> None:
+        local: list[float] = []
+        step = 0
+        while time.perf_counter() < stop_at:
+            step += 1
+            started = time.perf_counter()
+            backend.get_files_page(50, (step * 50) % max(row_count, 1))
+            backend.count_files()
+            seed_index = (step * 7 + worker_index) % row_count
+            backend.get_file_info(f"{seed_index}:seed-{seed_index}")
+            local.append(time.perf_counter() - started)
+        with latencies_lock:
+            read_latencies.extend(local)
+
+    def writer_loop() -> None:
+        while time.perf_counter() < stop_at:
+            with write_counter_lock:
+                index = next(write_counter)
+            backend.add_file_metadata(f"bench-{index}.bin", f"w{index}:bench", index)
+
+    threads = [threading.Thread(target=reader_loop, args=(index,)) for index in range(readers)]
+    threads += [threading.Thread(target=writer_loop) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    read_latencies.sort()
+    return {
+        "reads": len(read_latencies),
+        "p50_ms": statistics.median(read_latencies) * 1000,
+        "p99_ms": read_latencies[int(len(read_latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    results = {}
+    for label in ("legacy", "pooled"):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            database_path = str(Path(temp_dir, "bench.db"))
+            with patch.object(database, "DATABASE_URL", database_path):
+                database.init_db()
+                seed(args.rows)
+                backend = LegacyDatabase(database_path) if label == "legacy" else PooledDatabase()
+                if label == "legacy":
+                    # 对照组使用默认的 rollback journal，与旧实现保持一致。
+                    database.close_db()
+                    conn = sqlite3.connect(database_path)
+                    conn.execute("PRAGMA journal_mode = DELETE")
+                    conn.close()
+                # add_file_metadata 每次写入都会打印日志，压测期间将其丢弃。
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results[label] = run_mixed_load(
+                        backend,
+                        readers=args.readers,
+                        writers=args.writers,
+                        duration=args.duration,
+                        row_count=args.rows,
+                    )
+                database.close_db()
+
+    print(f"{'backend':<8} {'reads':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    for label, result in results.items():
+        print(
+            f"{label:<8} {result['reads']:>8} "
+            f"{result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+单文件下载首字节延迟（TTFB）基准：在本地启动模拟 CDN 和应用服务器，
+对比 is_manifest 未知（先探测文件开头，再发起完整请求）与已知为普通文件
+（直接发起一次请求）两种情况下客户端收到首字节和完整内容的耗时。
+
+模拟 CDN 对每个请求附加固定延迟，用来近似到 Telegram CDN 的往返时间。
+
+运行方式（在项目根目录）:
+    python -m benchmarks.bench_download_ttfb
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import socket
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+from app import database
+from app.api import routes
+from app.core.config import get_settings
+from app.core.http_client import get_http_client
+from app.services.blob_cache import get_blob_cache
+from app.services.telegram_service import get_telegram_service
+
+
+def create_fake_cdn(body: bytes, latency: float) -> Starlette:
+    async def serve_file(request: Request) -> Response:
+        await asyncio.sleep(latency)
+        range_header = request.headers.get("range")
+        if not range_header:
+            return Response(body, media_type="application/octet-stream")
+
+        start, _, end = range_header.removeprefix("bytes=").partition("-")
+        start = int(start)
+        end = min(int(end) if end else len(body) - 1, len(body) - 1)
+        return Response(
+            body[start:end + 1],
+            status_code=206,
+            media_type="application/octet-stream",
+            headers={"Content-Range": f"bytes {start}-{end}/{len(body)}"},
+        )
+
+    return Starlette(routes=[Route("/file/{name}", serve_file)])
+
+
+class FakeTelegramService:
+    """下载链接视为已在缓存中，只测量 CDN 往返。"""
+
+    def __init__(self, cdn_base_url: str):
+        self.cdn_base_url = cdn_base_url
+
+    async def get_download_url(self, file_id: str) -> str:
+        return f"{self.cdn_base_url}/file/{file_id}"
+
+    def invalidate_download_url(self, file_id: str) -> None:
+        pass
+
+
+def find_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_server(app, port: int) -> tuple[uvicorn.Server, asyncio.Task]:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def measure(client: httpx.AsyncClient, url: str) -> tuple[float, float]:
+    started = time.perf_counter()
+    first_byte = None
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        async for _ in response.aiter_bytes():
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+    return first_byte or 0.0, time.perf_counter() - started
+
+
+async def run_benchmark(args: argparse.Namespace) -> None:
+    body = os.urandom(int(args.size_kb * 1024))
+    cdn_port = find_free_port()
+    app_port = find_free_port()
+    cdn_server, cdn_task = await start_server(create_fake_cdn(body, args.latency), cdn_port)
+
+    upstream_client = httpx.AsyncClient(timeout=30)
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.dependency_overrides[get_telegram_service] = lambda: FakeTelegramService(
+        f"http://127.0.0.1:{cdn_port}"
+    )
+    app.dependency_overrides[get_http_client] = lambda: upstream_client
+    app.dependency_overrides[get_blob_cache] = lambda: None
+    app.dependency_overrides[get_settings] = lambda: SimpleNamespace(
+        DOWNLOAD_READAHEAD_CHUNKS=2,
+        DOWNLOAD_READAHEAD_MAX_BYTES=32 * 1024 * 1024,
+        # 请求逐个发出，合并并发下载不影响结果。
+        DOWNLOAD_FANOUT_ENABLED=False,
+    )
+
+    results: dict[str, list[tuple[float, float]]] = {}
+    with tempfile.TemporaryDirectory() as temp_dir, contextlib.ExitStack() as stack:
+        stack.enter_context(
+            patch.object(database, "DATABASE_URL", str(Path(temp_dir, "bench.db")))
+        )
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        database.init_db()
+        database.add_file_metadata(filename="probe.bin", file_id="1:probe", filesize=len(body))
+        database.add_file_metadata(filename="known.bin", file_id="2:known", filesize=len(body))
+        with database.get_connection_pool().writer() as conn:
+            conn.execute("UPDATE files SET is_manifest = NULL WHERE file_id = '1:probe'")
+        # 保持探测组每次都走探测路径，不把结果写回数据库。
+        stack.enter_context(patch.object(database, "set_file_is_manifest"))
+
+        app_server, app_task = await start_server(app, app_port)
+        try:
+            async with httpx.AsyncClient(timeout=30) as client:
+                cases = {
+                    "probe (is_manifest unknown)": f"http://127.0.0.1:{app_port}/d/1:probe/probe.bin",
+                    "known single file": f"http://127.0.0.1:{app_port}/d/2:known/known.bin",
+                }
+                for label, url in cases.items():
+                    await measure(client, url)
+                    results[label] = [await measure(client, url) for _ in range(args.requests)]
+        finally:
+            app_server.should_exit = True
+            await app_task
+            database.close_db()
+
+    await upstream_client.aclose()
+    cdn_server.should_exit = True
+    await cdn_task
+
+    print(f"{args.size_kb:g} KB file, {args.latency * 1000:.0f} ms CDN latency, {args.requests} requests")
+    print(f"{'case':>28} {'ttfb p50 ms':>12} {'total p50 ms':>13}")
+    for label, samples in results.items():
+        ttfb = statistics.median(sample[0] for sample in samples) * 1000
+        total = statistics.median(sample[1] for sample in samples) * 1000
+        print(f"{label:>28} {ttfb:>12.1f} {total:>13.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-kb", type=float, default=512)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--requests", type=int, default=20)
+    asyncio.run(run_benchmark(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
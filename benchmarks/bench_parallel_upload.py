@@ -0,0 +1,126 @@
+"""
+分块并发上传基准：在本地启动一个模拟 Bot API 的服务器，
+按不同并发度上传同一个文件，对比总耗时。
+
+模拟服务器对每个请求按固定带宽限速（模拟单连接吞吐上限），并附加固定延迟。
+
+运行方式（在项目根目录）:
+    python -m benchmarks.bench_parallel_upload
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import os
+import socket
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import telegram
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from telegram.request import HTTPXRequest
+
+from app.services import telegram_service as telegram_service_module
+from app.services.telegram_service import TelegramService
+
+
+def create_fake_bot_api(per_connection_bytes_per_second: float, latency: float) -> Starlette:
+    message_ids = itertools.count(1)
+
+    async def send_document(request: Request) -> JSONResponse:
+        received = 0
+        async for piece in request.stream():
+            received += len(piece)
+        await asyncio.sleep(latency + received / per_connection_bytes_per_second)
+        message_id = next(message_ids)
+        return JSONResponse({
+            "ok": True,
+            "result": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": -100, "type": "channel", "title": "bench"},
+                "document": {
+                    "file_id": f"file-{message_id}",
+                    "file_unique_id": f"unique-{message_id}",
+                    "file_size": received,
+                },
+            },
+        })
+
+    return Starlette(routes=[Route("/bot{token}/sendDocument", send_document, methods=["POST"])])
+
+
+def find_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_benchmark(args: argparse.Namespace) -> None:
+    port = find_free_port()
+    app = create_fake_bot_api(args.bandwidth_mb * 1024 * 1024, args.latency)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    chunk_size = int(args.chunk_mb * 1024 * 1024)
+    with tempfile.NamedTemporaryFile(delete=False) as file:
+        file.write(os.urandom(chunk_size * args.parts))
+        file_path = file.name
+
+    results: list[tuple[int, float]] = []
+    try:
+        for concurrency in args.concurrency:
+            service = TelegramService(
+                SimpleNamespace(BOT_TOKEN="123:bench", CHANNEL_NAME="@bench"),
+                upload_concurrency=concurrency,
+            )
+            service.bot = telegram.Bot(
+                token="123:bench",
+                base_url=f"http://127.0.0.1:{port}/bot",
+                request=HTTPXRequest(connection_pool_size=max(concurrency, 1) + 1),
+            )
+            with (
+                patch.object(telegram_service_module, "CHUNK_SIZE_BYTES", chunk_size),
+                patch.object(telegram_service_module.database, "add_file_metadata"),
+                contextlib.redirect_stdout(io.StringIO()),
+            ):
+                started = time.perf_counter()
+                file_id = await service.upload_file(file_path, "bench.bin")
+                elapsed = time.perf_counter() - started
+            await service.bot.shutdown()
+            if not file_id:
+                raise RuntimeError(f"concurrency={concurrency} 上传失败")
+            results.append((concurrency, elapsed))
+    finally:
+        os.unlink(file_path)
+        server.should_exit = True
+        await server_task
+
+    baseline = results[0][1]
+    print(f"{args.parts} parts x {args.chunk_mb} MB, {args.bandwidth_mb} MB/s per connection")
+    print(f"{'concurrency':>11} {'seconds':>9} {'speedup':>8}")
+    for concurrency, elapsed in results:
+        print(f"{concurrency:>11} {elapsed:>9.2f} {baseline / elapsed:>7.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--parts", type=int, default=12)
+    parser.add_argument("--chunk-mb", type=float, default=1.0)
+    parser.add_argument("--bandwidth-mb", type=float, default=4.0)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    asyncio.run(run_benchmark(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
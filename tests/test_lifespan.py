@@ -13,19 +13,28 @@ class LifespanTests(unittest.IsolatedAsyncioTestCase):
         bot_app = MagicMock()
         bot_app.initialize = AsyncMock(side_effect=httpx.ConnectTimeout("timed out"))
         bot_app.shutdown = AsyncMock()
-        shared_client = AsyncMock()
+        shared_transport = MagicMock()
+        close_shared_transport = AsyncMock()
         sync_service = MagicMock()
         sync_service.start = AsyncMock(return_value=False)
         sync_service.stop = AsyncMock()
+        upload_job_manager = MagicMock()
+        upload_job_manager.start = AsyncMock()
+        upload_job_manager.stop = AsyncMock()
 
         with (
             patch("app.core.http_client.database.init_db"),
-            patch("app.core.http_client.httpx.AsyncClient", return_value=shared_client),
+            patch("app.core.http_client.get_shared_transport", return_value=shared_transport),
+            patch("app.core.http_client.close_shared_transport", close_shared_transport),
             patch("app.core.http_client.create_bot_app", return_value=bot_app),
             patch(
                 "app.core.http_client.get_telegram_sync_service",
                 return_value=sync_service,
             ),
+            patch(
+                "app.core.http_client.get_upload_job_manager",
+                return_value=upload_job_manager,
+            ),
         ):
             context = http_client.lifespan(app)
             await context.__aenter__()
@@ -35,6 +44,10 @@ class LifespanTests(unittest.IsolatedAsyncioTestCase):
             finally:
                 await context.__aexit__(None, None, None)
 
+        upload_job_manager.start.assert_awaited_once()
+        upload_job_manager.stop.assert_awaited_once()
+        close_shared_transport.assert_awaited_once()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,14 +1,36 @@
 import asyncio
+import json
 import os
+import sqlite3
 import tempfile
+import threading
+import time
 import unittest
+from datetime import timedelta
 from pathlib import Path
 from types import SimpleNamespace
 from unittest.mock import AsyncMock, patch
 
+import httpx
+import telegram
+
 from app import database
-from app.services.telegram_service import CHUNK_SIZE_BYTES, TelegramService
+from app.core.http_transport import SharedHttpTransport
+from app.events import LAGGED, MemoryEventBus, SqliteEventBus, coalesce_events
+from app.services.blob_cache import BlobCache
+from app.services.download_fanout import DownloadFanout
+from app.services.telegram_service import CHUNK_SIZE_BYTES, TelegramService, extract_thumbnails
 from app.services.telegram_sync_service import TelegramSyncService
+from app.services.upload_jobs import UploadJobManager, UploadSessionConflict
+from app.utils.cursors import InvalidCursor, build_page_cursors, decode_cursor
+from app.utils.http_ranges import (
+    RangeNotSatisfiable,
+    build_validator_headers,
+    is_not_modified,
+    parse_range_header,
+    split_range_across_chunks,
+)
+from app.utils.readahead import ByteBoundedBuffer
 
 
 class PerformanceTests(unittest.IsolatedAsyncioTestCase):
@@ -23,6 +45,50 @@ class PerformanceTests(unittest.IsolatedAsyncioTestCase):
         self.database_patch.stop()
         self.temp_dir.cleanup()
 
+    def test_should_apply_migrations_once_when_workers_start_together(self):
+        database_path = str(Path(self.temp_dir.name, "workers.db"))
+        start = threading.Barrier(4)
+        errors = []
+
+        def start_worker():
+            conn = database._open_connection(database_path)
+            try:
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS files (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        filename TEXT NOT NULL,
+                        file_id TEXT NOT NULL UNIQUE,
+                        filesize INTEGER NOT NULL,
+                        upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                    """
+                )
+                conn.commit()
+                start.wait()
+                database._apply_migrations(conn)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                conn.close()
+
+        workers = [threading.Thread(target=start_worker) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        conn = sqlite3.connect(database_path)
+        try:
+            self.assertEqual(
+                conn.execute("PRAGMA user_version").fetchone()[0],
+                len(database.SCHEMA_MIGRATIONS),
+            )
+        finally:
+            conn.close()
+
     def test_should_return_only_requested_file_page(self):
         for index in range(5):
             database.add_file_metadata(
@@ -59,6 +125,134 @@ class PerformanceTests(unittest.IsolatedAsyncioTestCase):
         self.assertTrue(all(item["filename"].endswith(".png") for item in images))
         self.assertEqual(database.count_files(images_only=True), 30)
 
+    def test_should_page_with_keyset_cursors_in_both_directions(self):
+        for index in range(5):
+            database.add_file_metadata(
+                filename=f"file-{index}.txt",
+                file_id=f"{index}:id-{index}",
+                filesize=index,
+                upload_date="2026-01-01T00:00:00" if index < 3 else f"2026-01-0{index}T00:00:00",
+            )
+
+        first_page, has_older, has_newer = database.get_files_page_by_cursor(2)
+        next_cursor, prev_cursor = build_page_cursors(first_page, has_older=has_older, has_newer=has_newer)
+        second_page, has_older, has_newer = database.get_files_page_by_cursor(
+            2,
+            after=decode_cursor(next_cursor),
+        )
+        _, prev_cursor = build_page_cursors(second_page, has_older=has_older, has_newer=has_newer)
+        previous_page, _, has_newer = database.get_files_page_by_cursor(
+            2,
+            before=decode_cursor(prev_cursor),
+        )
+
+        self.assertEqual([item["filename"] for item in first_page], ["file-4.txt", "file-3.txt"])
+        # upload_date 相同的记录按 id 倒序，翻页时不会重复或遗漏。
+        self.assertEqual([item["filename"] for item in second_page], ["file-2.txt", "file-1.txt"])
+        self.assertTrue(has_older)
+        self.assertEqual(previous_page, first_page)
+        self.assertFalse(has_newer)
+        with self.assertRaises(InvalidCursor):
+            decode_cursor("not-a-cursor")
+
+    def test_should_maintain_file_stats_on_insert_and_delete(self):
+        database.add_file_metadata(filename="a.PNG", file_id="1:a", filesize=10)
+        database.add_file_metadata(filename="b.png", file_id="2:b", filesize=5)
+        database.add_file_metadata(filename="c.tar.gz", file_id="3:c", filesize=7)
+        database.add_file_metadata(filename="README", file_id="4:d", filesize=1)
+        # 重复插入被忽略，不应重复计数。
+        database.add_file_metadata(filename="b.png", file_id="2:b", filesize=5)
+        database.delete_file_metadata("1:a")
+        database.delete_file_by_message_id(4)
+
+        stats = database.get_file_stats()
+
+        self.assertEqual(stats["total_files"], 2)
+        self.assertEqual(stats["total_bytes"], 12)
+        self.assertEqual(stats["image_files"], 1)
+        self.assertEqual(stats["extensions"], {"png": {"files": 1, "bytes": 5}, "gz": {"files": 1, "bytes": 7}})
+        self.assertEqual(database.count_files(images_only=True), 1)
+
+    def test_should_migrate_legacy_database_with_stats_and_media_kind(self):
+        legacy_path = Path(self.temp_dir.name, "legacy.db")
+        connection = sqlite3.connect(legacy_path)
+        connection.executescript(
+            """
+            CREATE TABLE files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT NOT NULL,
+                file_id TEXT NOT NULL UNIQUE,
+                filesize INTEGER NOT NULL,
+                upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            INSERT INTO files (filename, file_id, filesize) VALUES ('a.JPG', '1:a', 3);
+            INSERT INTO files (filename, file_id, filesize) VALUES ('b.mkv', '2:b', 4);
+            """
+        )
+        connection.close()
+
+        with patch.object(database, "DATABASE_URL", str(legacy_path)):
+            database.init_db()
+            images = database.get_files_page(limit=10, images_only=True)
+            videos, _, _ = database.get_files_page_by_cursor(10, media_kind="video")
+            stats = database.get_file_stats()
+
+        self.assertEqual([item["filename"] for item in images], ["a.JPG"])
+        self.assertEqual([item["filename"] for item in videos], ["b.mkv"])
+        self.assertEqual(stats["total_files"], 2)
+        self.assertEqual(stats["media_kinds"]["video"], {"files": 1, "bytes": 4})
+        with patch.object(database, "DATABASE_URL", str(legacy_path)):
+            self.assertEqual(database.delete_files_by_message_ids([2]), ["2:b"])
+
+    def test_should_delete_files_by_message_ids_in_one_batch(self):
+        for message_id in (10, 11, 12, 110):
+            database.add_file_metadata(
+                filename=f"file-{message_id}.txt",
+                file_id=f"{message_id}:id",
+                filesize=1,
+            )
+
+        deleted_file_ids = database.delete_files_by_message_ids([10, 11, 11, 999])
+
+        self.assertEqual(sorted(deleted_file_ids), ["10:id", "11:id"])
+        self.assertIsNotNone(database.get_file_info("110:id"))
+        self.assertEqual(database.count_files(), 2)
+        with database.get_connection_pool().reader() as connection:
+            plan = connection.execute(
+                "EXPLAIN QUERY PLAN SELECT file_id FROM files WHERE message_id = ?",
+                (12,),
+            ).fetchall()
+        self.assertIn("idx_files_message_id", plan[0]["detail"])
+
+    def test_should_search_filenames_with_fts_index(self):
+        for index, filename in enumerate(
+            ["2025年度财务报告.pdf", "财务报表.xlsx", "holiday-photo.JPG", "notes.txt", "季度报告.pdf"],
+            start=1,
+        ):
+            database.add_file_metadata(filename=filename, file_id=f"{index}:id", filesize=index)
+        database.delete_file_metadata("5:id")
+
+        cjk_matches, _ = database.search_files("财务报", 10)
+        extension_matches, _ = database.search_files("photo jpg", 10)
+        short_matches, _ = database.search_files("报告", 10)
+        first_page, has_more = database.search_files("财务", 1)
+        second_page, _ = database.search_files(
+            "财务",
+            1,
+            after=(first_page[0]["sort_key"], first_page[0]["id"]),
+        )
+
+        self.assertEqual(
+            sorted(item["filename"] for item in cjk_matches),
+            ["2025年度财务报告.pdf", "财务报表.xlsx"],
+        )
+        self.assertEqual([item["filename"] for item in extension_matches], ["holiday-photo.JPG"])
+        # 已删除的文件不会再出现在索引里。
+        self.assertEqual([item["filename"] for item in short_matches], ["2025年度财务报告.pdf"])
+        self.assertTrue(has_more)
+        self.assertEqual(len(second_page), 1)
+        self.assertNotEqual(first_page[0]["id"], second_page[0]["id"])
+
     def test_should_create_upload_date_index(self):
         connection = database.get_db_connection()
         try:
@@ -71,6 +265,62 @@ class PerformanceTests(unittest.IsolatedAsyncioTestCase):
 
         self.assertIn("idx_files_upload_date_id", indexes)
 
+    def test_should_enable_wal_journal_mode(self):
+        with database.get_connection_pool().reader() as connection:
+            journal_mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+
+        self.assertEqual(journal_mode, "wal")
+
+    def test_should_read_while_writer_is_busy(self):
+        database.add_file_metadata(filename="a.txt", file_id="1:a", filesize=1)
+        pool = database.get_connection_pool()
+        writer_entered = threading.Event()
+        release_writer = threading.Event()
+
+        def hold_writer():
+            with pool.writer() as connection:
+                connection.execute(
+                    "INSERT INTO files (filename, file_id, filesize) VALUES ('b.txt', '2:b', 2)"
+                )
+                writer_entered.set()
+                release_writer.wait(timeout=5)
+
+        writer_thread = threading.Thread(target=hold_writer)
+        writer_thread.start()
+        try:
+            self.assertTrue(writer_entered.wait(timeout=5))
+            self.assertEqual(database.get_file_info("1:a")["filename"], "a.txt")
+            self.assertIsNone(database.get_file_info("2:b"))
+        finally:
+            release_writer.set()
+            writer_thread.join()
+
+        self.assertEqual(database.get_file_info("2:b")["filename"], "b.txt")
+
+    def test_should_drop_reader_borrowed_across_pool_close(self):
+        pool = database.ConnectionPool(str(self.database_path), reader_count=1)
+        waiter_result = []
+
+        def wait_for_reader():
+            with pool.reader() as connection:
+                waiter_result.append(connection.execute("SELECT COUNT(*) FROM files").fetchone()[0])
+
+        with pool.reader() as stale_connection:
+            waiter = threading.Thread(target=wait_for_reader)
+            waiter.start()
+            time.sleep(0.05)
+            pool.close()
+
+        # 关闭前借出的连接归还时被关闭，等待中的线程改用新打开的连接。
+        waiter.join(timeout=5)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(waiter_result, [0])
+        with self.assertRaises(sqlite3.ProgrammingError):
+            stale_connection.execute("SELECT 1")
+        with pool.reader() as connection:
+            self.assertIsNot(connection, stale_connection)
+        pool.close()
+
     async def test_should_upload_large_file_from_bounded_file_views(self):
         settings = SimpleNamespace(BOT_TOKEN="dummy", CHANNEL_NAME="@dummy")
         service = TelegramService(settings)
@@ -108,6 +358,680 @@ class PerformanceTests(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(observed_read_sizes, [CHUNK_SIZE_BYTES, 17])
         self.assertTrue(all(size <= CHUNK_SIZE_BYTES for size in observed_read_sizes))
 
+    async def test_should_upload_chunks_in_parallel_and_keep_manifest_order(self):
+        settings = SimpleNamespace(BOT_TOKEN="dummy", CHANNEL_NAME="@dummy")
+        service = TelegramService(settings, upload_concurrency=3)
+        in_flight = 0
+        max_in_flight = 0
+        failed_once = set()
+        manifest_payloads = []
+        progress = []
+
+        async def send_document(*, document, filename, reply_to_message_id=None, **kwargs):
+            nonlocal in_flight, max_in_flight
+            if filename.endswith(".manifest"):
+                manifest_payloads.append(document.decode("utf-8"))
+                return SimpleNamespace(message_id=100, document=SimpleNamespace(file_id="manifest"))
+
+            part_number = int(filename.rsplit("part", 1)[1])
+            if part_number > 1:
+                self.assertEqual(reply_to_message_id, 1)
+            if part_number == 3 and part_number not in failed_once:
+                failed_once.add(part_number)
+                raise telegram.error.TimedOut()
+
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            # 序号越大完成得越早，验证清单顺序不受完成顺序影响。
+            await asyncio.sleep(0.01 * (5 - part_number))
+            in_flight -= 1
+            return SimpleNamespace(
+                message_id=part_number,
+                document=SimpleNamespace(file_id=f"chunk-{part_number}"),
+            )
+
+        service.bot = SimpleNamespace(send_document=AsyncMock(side_effect=send_document))
+
+        with tempfile.NamedTemporaryFile(delete=False) as file:
+            file.write(b"x" * 41)
+            file_path = file.name
+
+        try:
+            with (
+                patch("app.services.telegram_service.database.add_file_metadata"),
+                patch("app.services.telegram_service.CHUNK_SIZE_BYTES", 10),
+                patch("app.services.telegram_service.UPLOAD_RETRY_BASE_DELAY_SECONDS", 0),
+            ):
+                file_id = await service.upload_file(
+                    file_path,
+                    "large.bin",
+                    lambda uploaded, total: progress.append((uploaded, total)),
+                )
+        finally:
+            os.unlink(file_path)
+
+        self.assertEqual(file_id, "100:manifest")
+        self.assertEqual(
+            manifest_payloads[0].splitlines()[2:],
+            [f"{number}:chunk-{number}" for number in range(1, 6)],
+        )
+        self.assertGreater(max_in_flight, 1)
+        self.assertLessEqual(max_in_flight, 3)
+        self.assertEqual(progress[-1], (41, 41))
+
+    async def test_should_upload_stream_parts_before_body_finishes(self):
+        settings = SimpleNamespace(BOT_TOKEN="dummy", CHANNEL_NAME="@dummy")
+        service = TelegramService(settings, upload_concurrency=2)
+        first_part_sent = asyncio.Event()
+        sent_parts = {}
+        manifest_payloads = []
+
+        async def send_document(*, document, filename, reply_to_message_id=None, **kwargs):
+            if filename.endswith(".manifest"):
+                manifest_payloads.append(document.decode("utf-8"))
+                return SimpleNamespace(message_id=100, document=SimpleNamespace(file_id="manifest"))
+
+            part_number = int(filename.rsplit("part", 1)[1])
+            sent_parts[part_number] = document
+            if part_number == 1:
+                first_part_sent.set()
+            return SimpleNamespace(
+                message_id=part_number,
+                document=SimpleNamespace(file_id=f"chunk-{part_number}"),
+            )
+
+        async def request_body():
+            yield b"a" * 7
+            yield b"a" * 3 + b"b" * 4
+            # 第一个分块必须在请求体剩余部分到达之前就已经发出。
+            await asyncio.wait_for(first_part_sent.wait(), timeout=1)
+            yield b"b" * 6 + b"c"
+
+        service.bot = SimpleNamespace(send_document=AsyncMock(side_effect=send_document))
+
+        with (
+            patch("app.services.telegram_service.database.add_file_metadata") as add_file_metadata,
+            patch("app.services.telegram_service.CHUNK_SIZE_BYTES", 10),
+        ):
+            file_id = await service.upload_stream(request_body(), "large.bin", total_size=21)
+
+        self.assertEqual(file_id, "100:manifest")
+        self.assertEqual(sent_parts, {1: b"a" * 10, 2: b"b" * 10, 3: b"c"})
+        self.assertEqual(
+            manifest_payloads[0].splitlines()[2:],
+            ["1:chunk-1", "2:chunk-2", "3:chunk-3"],
+        )
+        self.assertEqual(add_file_metadata.call_args.kwargs["filesize"], 21)
+
+    async def test_should_reject_truncated_stream_upload(self):
+        settings = SimpleNamespace(BOT_TOKEN="dummy", CHANNEL_NAME="@dummy")
+        service = TelegramService(settings)
+        service.bot = SimpleNamespace(send_document=AsyncMock())
+
+        async def request_body():
+            yield b"short"
+
+        with patch("app.services.telegram_service.database.add_file_metadata") as add_file_metadata:
+            file_id = await service.upload_stream(request_body(), "small.txt", total_size=100)
+
+        self.assertIsNone(file_id)
+        service.bot.send_document.assert_not_called()
+        add_file_metadata.assert_not_called()
+
+    async def test_should_resume_upload_job_from_last_completed_part(self):
+        settings = SimpleNamespace(
+            BOT_TOKEN="dummy",
+            CHANNEL_NAME="@dummy",
+            BASE_URL="http://example.test",
+            FILE_ROUTE="/d",
+        )
+        service = TelegramService(settings)
+        sent_parts = []
+        manifest_payloads = []
+
+        async def send_document(*, document, filename, reply_to_message_id=None, **kwargs):
+            if filename.endswith(".manifest"):
+                manifest_payloads.append(document.decode("utf-8"))
+                return SimpleNamespace(message_id=100, document=SimpleNamespace(file_id="manifest"))
+
+            part_number = int(filename.rsplit("part", 1)[1])
+            self.assertEqual(reply_to_message_id, 1)
+            sent_parts.append(part_number)
+            return SimpleNamespace(
+                message_id=10 + part_number,
+                document=SimpleNamespace(file_id=f"chunk-{part_number}"),
+            )
+
+        service.bot = SimpleNamespace(send_document=AsyncMock(side_effect=send_document))
+        manager = UploadJobManager(settings, service, concurrency=1, spool_dir=str(Path(self.temp_dir.name, "spool")))
+
+        # 模拟重启前已发送第一个分块、任务仍处于 running 状态。
+        job_id, spool_path = manager.new_spool_path()
+        Path(spool_path).write_bytes(b"x" * 25)
+        database.create_upload_job(job_id, "large.bin", spool_path, 25)
+        database.set_upload_job_status(job_id, "running")
+        database.record_upload_job_part(job_id, 0, "1:chunk-1", 10)
+        published = []
+
+        with (
+            patch("app.services.telegram_service.CHUNK_SIZE_BYTES", 10),
+            patch("app.services.upload_jobs.publish_file_update", AsyncMock(side_effect=published.append)),
+        ):
+            await manager.start()
+            await asyncio.wait_for(manager._queue.join(), timeout=5)
+            await manager.stop()
+
+        job = database.get_upload_job(job_id)
+        self.assertEqual(sent_parts, [2, 3])
+        self.assertEqual(manifest_payloads[0].splitlines()[2:], ["1:chunk-1", "12:chunk-2", "13:chunk-3"])
+        self.assertEqual((job["status"], job["file_id"]), ("done", "100:manifest"))
+        self.assertEqual((job["uploaded_bytes"], job["completed_parts"]), (25, 3))
+        self.assertFalse(os.path.exists(spool_path))
+        self.assertEqual(len(database.get_file_chunks("100:manifest")), 3)
+        self.assertIn("running", [event["status"] for event in published if event["action"] == "job"])
+        self.assertEqual(published[-1]["action"], "add")
+        self.assertEqual(published[-1]["url"], "http://example.test/d/100%3Amanifest/large.bin")
+
+    async def test_should_claim_upload_job_once_across_workers(self):
+        settings = SimpleNamespace(BOT_TOKEN="dummy", CHANNEL_NAME="@dummy", BASE_URL="http://x", FILE_ROUTE="/d")
+        uploads = []
+
+        async def upload_file(spool_path, filename, **kwargs):
+            uploads.append(filename)
+            await asyncio.sleep(0.05)
+            return None
+
+        service = SimpleNamespace(upload_file=upload_file)
+        spool_dir = str(Path(self.temp_dir.name, "spool"))
+        # 两个管理器共用同一个数据库，模拟同时启动的两个 worker 进程。
+        first = UploadJobManager(settings, service, concurrency=2, spool_dir=spool_dir)
+        second = UploadJobManager(settings, service, concurrency=2, spool_dir=spool_dir)
+
+        job_id, spool_path = first.new_spool_path()
+        Path(spool_path).write_bytes(b"x")
+        database.create_upload_job(job_id, "queued.bin", spool_path, 1)
+        # 另一个仍在运行的 worker 持有租约的任务不会被接管。
+        leased_id, leased_path = first.new_spool_path()
+        Path(leased_path).write_bytes(b"x")
+        database.create_upload_job(leased_id, "leased.bin", leased_path, 1)
+        self.assertIsNotNone(database.claim_upload_job(leased_id, "other-worker", 60))
+
+        with patch("app.services.upload_jobs.publish_file_update", AsyncMock()):
+            await asyncio.gather(first.start(), second.start())
+            await asyncio.wait_for(asyncio.gather(first._queue.join(), second._queue.join()), timeout=5)
+            await first.stop()
+            await second.stop()
+
+        self.assertEqual(uploads, ["queued.bin"])
+        self.assertIsNone(database.claim_upload_job(leased_id, first.owner, 60))
+        leased = database.get_upload_job(leased_id)
+        self.assertEqual((leased["status"], leased["owner"]), ("running", "other-worker"))
+
+        # 租约过期后才能被其他 worker 认领。
+        with patch("app.database.time.time", return_value=time.time() + 120):
+            claimed = database.claim_upload_job(leased_id, first.owner, 60)
+        self.assertEqual(claimed["owner"], first.owner)
+
+    async def test_should_keep_spool_and_retry_after_failed_upload(self):
+        settings = SimpleNamespace(BOT_TOKEN="dummy", CHANNEL_NAME="@dummy", BASE_URL="http://x", FILE_ROUTE="/d")
+        results = [None, "5:done"]
+        seen_parts = []
+
+        async def upload_file(spool_path, filename, *, completed_parts, part_callback):
+            seen_parts.append(dict(completed_parts))
+            if not completed_parts:
+                await part_callback(0, "1:chunk-1", 10)
+            file_id = results.pop(0)
+            if file_id:
+                database.add_file_metadata(filename=filename, file_id=file_id, filesize=25)
+            return file_id
+
+        manager = UploadJobManager(
+            settings,
+            SimpleNamespace(upload_file=upload_file),
+            concurrency=1,
+            spool_dir=str(Path(self.temp_dir.name, "spool")),
+        )
+        job_id, spool_path = manager.new_spool_path()
+        Path(spool_path).write_bytes(b"x" * 25)
+        database.create_upload_job(job_id, "large.bin", spool_path, 25)
+
+        with (
+            patch("app.services.upload_jobs.UPLOAD_JOB_RETRY_DELAY_SECONDS", 0.05),
+            patch("app.services.upload_jobs.publish_file_update", AsyncMock()),
+        ):
+            await manager.start()
+            await asyncio.wait_for(manager._queue.join(), timeout=5)
+            # 第一次失败后暂存文件与已完成的分块都保留，任务回到队列。
+            self.assertEqual(database.get_upload_job(job_id)["status"], "queued")
+            self.assertTrue(os.path.exists(spool_path))
+            await asyncio.sleep(0.1)
+            await asyncio.wait_for(manager._queue.join(), timeout=5)
+            await manager.stop()
+
+        job = database.get_upload_job(job_id)
+        self.assertEqual((job["status"], job["file_id"], job["error"]), ("done", "5:done", None))
+        self.assertEqual(seen_parts, [{}, {0: "1:chunk-1"}])
+        self.assertFalse(os.path.exists(spool_path))
+
+    async def test_should_not_resend_manifest_already_recorded(self):
+        settings = SimpleNamespace(BOT_TOKEN="dummy", CHANNEL_NAME="@dummy", BASE_URL="http://x", FILE_ROUTE="/d")
+        service = SimpleNamespace(upload_file=AsyncMock())
+        manager = UploadJobManager(settings, service, concurrency=1, spool_dir=str(Path(self.temp_dir.name, "spool")))
+
+        # 模拟清单已写入数据库、任务尚未标记完成时进程退出。
+        job_id, spool_path = manager.new_spool_path()
+        Path(spool_path).write_bytes(b"x" * 25)
+        database.create_upload_job(job_id, "large.bin", spool_path, 25)
+        database.set_upload_job_status(job_id, "running")
+        database.record_upload_job_part(job_id, 0, "1:chunk-1", 10)
+        database.record_upload_job_part(job_id, 1, "2:chunk-2", 15)
+        database.add_file_metadata(
+            filename="large.bin",
+            file_id="100:manifest",
+            filesize=25,
+            chunks=[("1:chunk-1", 10), ("2:chunk-2", 15)],
+        )
+
+        with patch("app.services.upload_jobs.publish_file_update", AsyncMock()):
+            await manager.start()
+            await asyncio.wait_for(manager._queue.join(), timeout=5)
+            await manager.stop()
+
+        service.upload_file.assert_not_called()
+        job = database.get_upload_job(job_id)
+        self.assertEqual((job["status"], job["file_id"]), ("done", "100:manifest"))
+        self.assertFalse(os.path.exists(spool_path))
+
+    async def test_should_not_resend_small_file_already_sent(self):
+        settings = SimpleNamespace(BOT_TOKEN="dummy", CHANNEL_NAME="@dummy", BASE_URL="http://x", FILE_ROUTE="/d")
+        service = TelegramService(settings)
+        service.bot = SimpleNamespace(send_document=AsyncMock(
+            return_value=SimpleNamespace(message_id=7, document=SimpleNamespace(file_id="doc", thumbnail=None), photo=None),
+        ))
+        manager = UploadJobManager(settings, service, concurrency=1, spool_dir=str(Path(self.temp_dir.name, "spool")))
+        job_id, spool_path = manager.new_spool_path()
+        Path(spool_path).write_bytes(b"small")
+        database.create_upload_job(job_id, "small.txt", spool_path, 5)
+        database.set_upload_job_status(job_id, "running")
+
+        async def record_part(index, chunk_file_id, size):
+            database.record_upload_job_part(job_id, index, chunk_file_id, size)
+
+        # 模拟消息已发送、元数据写入前失败。
+        with patch(
+            "app.services.telegram_service.database.add_file_metadata",
+            side_effect=sqlite3.OperationalError("database is locked"),
+        ):
+            file_id = await service.upload_file(spool_path, "small.txt", part_callback=record_part)
+        self.assertIsNone(file_id)
+        self.assertEqual(database.get_upload_job_parts(job_id), {0: "7:doc"})
+
+        with patch("app.services.upload_jobs.publish_file_update", AsyncMock()):
+            await manager.start()
+            await asyncio.wait_for(manager._queue.join(), timeout=5)
+            await manager.stop()
+
+        service.bot.send_document.assert_awaited_once()
+        job = database.get_upload_job(job_id)
+        self.assertEqual((job["status"], job["file_id"]), ("done", "7:doc"))
+        self.assertIsNotNone(database.get_file_by_id("7:doc"))
+
+    async def test_should_spool_upload_job_body_and_return_immediately(self):
+        from app.api.routes import create_upload_job
+
+        settings = SimpleNamespace(PICGO_API_KEY=None, BASE_URL="http://example.test")
+        manager = UploadJobManager(settings, None, spool_dir=str(Path(self.temp_dir.name, "spool")))
+
+        async def body():
+            yield b"hello "
+            yield b"world"
+
+        request = SimpleNamespace(cookies={}, stream=body)
+        with (
+            patch("app.api.routes.get_active_password", return_value=None),
+            patch("app.services.upload_jobs.publish_file_update", AsyncMock()),
+        ):
+            response = await create_upload_job(
+                request,
+                filename="hello.txt",
+                key=None,
+                settings=settings,
+                upload_job_manager=manager,
+                x_api_key=None,
+                x_file_name=None,
+                content_length=11,
+            )
+
+        self.assertEqual(response.status_code, 202)
+        job = database.get_upload_job(manager._queue.get_nowait())
+        self.assertEqual((job["status"], job["filename"], job["total_size"]), ("queued", "hello.txt", 11))
+        self.assertEqual(Path(job["spool_path"]).read_bytes(), b"hello world")
+        self.assertIn(f"/api/jobs/{job['id']}", response.body.decode("utf-8"))
+
+    async def test_should_forward_complete_session_parts_before_finalize(self):
+        settings = SimpleNamespace(
+            BOT_TOKEN="dummy",
+            CHANNEL_NAME="@dummy",
+            BASE_URL="http://example.test",
+            FILE_ROUTE="/d",
+        )
+        service = TelegramService(settings)
+        sent_parts = []
+        manifest_payloads = []
+
+        async def send_document(*, document, filename, reply_to_message_id=None, **kwargs):
+            if filename.endswith(".manifest"):
+                manifest_payloads.append(document.decode("utf-8"))
+                return SimpleNamespace(message_id=100, document=SimpleNamespace(file_id="manifest"))
+
+            part_number = int(filename.rsplit("part", 1)[1])
+            self.assertEqual(reply_to_message_id, None if part_number == 1 else 11)
+            sent_parts.append(part_number)
+            return SimpleNamespace(
+                message_id=10 + part_number,
+                document=SimpleNamespace(file_id=f"chunk-{part_number}"),
+            )
+
+        service.bot = SimpleNamespace(send_document=AsyncMock(side_effect=send_document))
+        manager = UploadJobManager(settings, service, concurrency=1, spool_dir=str(Path(self.temp_dir.name, "spool")))
+
+        async def body(*parts):
+            for part in parts:
+                yield part
+
+        with (
+            patch("app.services.telegram_service.CHUNK_SIZE_BYTES", 10),
+            patch("app.services.upload_jobs.CHUNK_SIZE_BYTES", 10),
+            patch("app.services.upload_jobs.publish_file_update", AsyncMock()),
+        ):
+            await manager.start()
+            session = await manager.create_session("large.bin", 25)
+            self.assertEqual(await manager.append_session_data(session, 0, body(b"a" * 6, b"a" * 6)), 12)
+
+            # 第一个完整分块在会话结束前就已转发并持久化。
+            await asyncio.wait_for(asyncio.gather(*manager._forward_tasks.values()), timeout=5)
+            self.assertEqual(sent_parts, [1])
+            self.assertEqual(database.get_upload_job_parts(session["id"]), {0: "11:chunk-1"})
+
+            with self.assertRaises(UploadSessionConflict) as conflict:
+                await manager.append_session_data(session, 6, body(b"b"))
+            self.assertEqual(conflict.exception.offset, 12)
+            with self.assertRaises(UploadSessionConflict):
+                await manager.finalize_session(session)
+
+            self.assertEqual(await manager.append_session_data(session, 12, body(b"b" * 13)), 25)
+            job = await asyncio.wait_for(manager.finalize_session(session), timeout=5)
+            await manager.stop()
+
+        self.assertEqual((job["status"], job["file_id"]), ("done", "100:manifest"))
+        self.assertEqual(sorted(sent_parts), [1, 2, 3])
+        self.assertEqual(
+            manifest_payloads[0].splitlines()[2:],
+            ["11:chunk-1", "12:chunk-2", "13:chunk-3"],
+        )
+        self.assertEqual(database.get_file_info("100:manifest")["filesize"], 25)
+        self.assertFalse(os.path.exists(session["spool_path"]))
+
+    async def test_should_not_forward_session_parts_leased_by_another_worker(self):
+        settings = SimpleNamespace(BOT_TOKEN="dummy", CHANNEL_NAME="@dummy", BASE_URL="http://x", FILE_ROUTE="/d")
+        service = SimpleNamespace(
+            upload_file_part=AsyncMock(side_effect=AssertionError("part should not be forwarded twice")),
+            upload_file=AsyncMock(return_value="100:manifest"),
+        )
+        manager = UploadJobManager(settings, service, concurrency=1, spool_dir=str(Path(self.temp_dir.name, "spool")))
+
+        async def body(data):
+            yield data
+
+        with (
+            patch("app.services.upload_jobs.CHUNK_SIZE_BYTES", 10),
+            patch("app.services.upload_jobs.UPLOAD_SESSION_POLL_SECONDS", 0.01),
+            patch("app.services.upload_jobs.publish_file_update", AsyncMock()),
+        ):
+            await manager.start()
+            session = await manager.create_session("large.bin", 12)
+            # 另一个 worker 正在转发这个会话的分块。
+            self.assertIsNotNone(database.claim_upload_session(session["id"], "other-worker", 60))
+
+            self.assertEqual(await manager.append_session_data(session, 0, body(b"a" * 12)), 12)
+            await asyncio.wait_for(asyncio.gather(*manager._forward_tasks.values()), timeout=5)
+            # 收到数据只刷新时间，不会清掉其他 worker 的租约。
+            self.assertEqual(database.get_upload_job(session["id"])["owner"], "other-worker")
+
+            finalize = asyncio.create_task(manager.finalize_session(session))
+            await asyncio.sleep(0.05)
+            self.assertEqual(database.get_upload_job(session["id"])["status"], "receiving")
+            database.release_upload_job_leases("other-worker", session["id"])
+            job = await asyncio.wait_for(finalize, timeout=5)
+            await manager.stop()
+
+        service.upload_file_part.assert_not_called()
+        self.assertEqual((job["status"], job["file_id"]), ("done", "100:manifest"))
+
+    async def test_should_deliver_sqlite_bus_events_across_bus_instances(self):
+        # 两个总线实例共用同一个数据库，模拟两个 worker 进程。
+        database.append_event('{"action": "delete", "file_id": "old"}')
+        publisher = SqliteEventBus(poll_interval=0.01)
+        subscriber = SqliteEventBus(poll_interval=0.01)
+        await publisher.start()
+        await subscriber.start()
+        try:
+            queue, _ = await subscriber.subscribe()
+            local_queue, _ = await publisher.subscribe()
+            await publisher.publish('{"action": "delete", "file_id": "a"}')
+            await publisher.publish('{"action": "delete", "file_id": "b"}')
+
+            received = [await asyncio.wait_for(queue.get(), timeout=5) for _ in range(2)]
+            local_received = [await asyncio.wait_for(local_queue.get(), timeout=5) for _ in range(2)]
+        finally:
+            await publisher.stop()
+            await subscriber.stop()
+
+        expected = ['{"action": "delete", "file_id": "a"}', '{"action": "delete", "file_id": "b"}']
+        self.assertEqual([message for _, message in received], expected)
+        self.assertEqual(local_received, received)
+        self.assertEqual(received[1][0], received[0][0] + 1)
+        self.assertTrue(queue.empty())
+
+    async def test_should_replay_missed_events_after_reconnect_and_lag(self):
+        from app.api.routes import _collect_file_updates
+
+        bus = MemoryEventBus()
+        with patch("app.api.routes.replay_file_updates", bus.replay):
+            _, start_id = await bus.subscribe()
+            for index in range(3):
+                await bus.publish(f'{{"n": {index}}}')
+
+            # 重连时只补发 Last-Event-ID 之后的事件；太旧或未知的 ID 收到 reset。
+            queue, replay_start_id = await bus.subscribe(start_id + 1)
+            current_id = start_id + 3
+            self.assertEqual(replay_start_id, start_id + 1)
+            self.assertEqual(
+                [queue.get_nowait() for _ in range(2)],
+                [(start_id + 2, '{"n": 1}'), (start_id + 3, '{"n": 2}')],
+            )
+            stale_queue, _ = await bus.subscribe(start_id - 100)
+            self.assertEqual(stale_queue.get_nowait(), (current_id, '{"action": "reset"}'))
+
+            # 慢连接的队列溢出后不再悄悄丢事件，而是从最后推送的 ID 重放。
+            slow_queue, slow_sent_id = await bus.subscribe()
+            for index in range(150):
+                await bus.publish(f'{{"m": {index}}}')
+            first_event = slow_queue.get_nowait()
+            self.assertIs(first_event, LAGGED)
+            events = await _collect_file_updates(slow_queue, first_event, slow_sent_id)
+
+        self.assertEqual([event_id for event_id, _ in events], list(range(slow_sent_id + 1, slow_sent_id + 151)))
+        self.assertEqual(events[-1][1], '{"m": 149}')
+
+    def test_should_coalesce_event_burst_into_one_batch(self):
+        events = [
+            (5, '{"action": "add", "file_id": "1:a", "filename": "a.txt"}'),
+            (6, '{"action": "add", "file_id": "2:b", "filename": "b.txt"}'),
+            (7, '{"action": "job", "job_id": "j", "uploaded_bytes": 10}'),
+            (8, '{"action": "delete_many", "file_ids": ["1:a", "0:old"]}'),
+            (9, '{"action": "job", "job_id": "j", "uploaded_bytes": 20}'),
+        ]
+
+        [(event_id, message)] = coalesce_events(events)
+
+        self.assertEqual(event_id, 9)
+        self.assertEqual(
+            json.loads(message),
+            {
+                "action": "batch",
+                "deleted": ["1:a", "0:old"],
+                "added": [{"file_id": "2:b", "filename": "b.txt"}],
+                "events": [{"action": "job", "job_id": "j", "uploaded_bytes": 20}],
+            },
+        )
+        self.assertEqual(coalesce_events(events[:1]), events[:1])
+
+    async def test_should_batch_delete_messages_and_publish_one_event(self):
+        from app.api.routes import _delete_files_and_sync
+
+        database.add_file_metadata(
+            filename="big.bin",
+            file_id="1000:manifest",
+            filesize=150,
+            chunks=[(f"{index}:chunk", 1) for index in range(1, 151)],
+        )
+        database.add_file_metadata(filename="a.txt", file_id="2000:a", filesize=1)
+        database.add_file_metadata(filename="b.txt", file_id="2001:b", filesize=1)
+
+        settings = SimpleNamespace(BOT_TOKEN="dummy", CHANNEL_NAME="@dummy")
+        service = TelegramService(settings)
+        delete_calls: list[list[int]] = []
+        throttled = False
+
+        async def delete_messages(*, chat_id, message_ids):
+            nonlocal throttled
+            if not throttled:
+                throttled = True
+                raise telegram.error.RetryAfter(timedelta(0))
+            delete_calls.append(list(message_ids))
+            return True
+
+        service.bot = SimpleNamespace(delete_messages=delete_messages)
+        published = AsyncMock()
+
+        with (
+            patch("app.api.routes.publish_files_deleted", published),
+            patch("app.api.routes.get_blob_cache", return_value=None),
+        ):
+            deleted, failed = await _delete_files_and_sync(
+                ["1000:manifest", "2000:a", "2001:b"],
+                service,
+            )
+
+        self.assertEqual(failed, [])
+        self.assertEqual([item["file_id"] for item in deleted], ["1000:manifest", "2000:a", "2001:b"])
+        self.assertEqual(len(deleted[0]["details"]["deleted_chunks"]), 150)
+        self.assertTrue(all(len(batch) <= 100 for batch in delete_calls))
+        self.assertEqual(sorted(sum(delete_calls, [])), [*range(1, 151), 1000, 2000, 2001])
+        published.assert_awaited_once_with(["1000:manifest", "2000:a", "2001:b"])
+        self.assertEqual(database.count_files(), 0)
+        self.assertEqual(database.get_file_chunks("1000:manifest"), [])
+
+    async def test_should_cache_and_coalesce_download_url_lookups(self):
+        settings = SimpleNamespace(BOT_TOKEN="dummy", CHANNEL_NAME="@dummy")
+        service = TelegramService(settings)
+        release_lookup = asyncio.Event()
+
+        async def get_file(file_id):
+            await release_lookup.wait()
+            return SimpleNamespace(file_path=f"https://cdn.example/{file_id}")
+
+        service.bot = SimpleNamespace(get_file=AsyncMock(side_effect=get_file))
+
+        lookups = [asyncio.create_task(service.get_download_url("abc")) for _ in range(5)]
+        await asyncio.sleep(0)
+        release_lookup.set()
+        urls = await asyncio.gather(*lookups)
+        cached_url = await service.get_download_url("abc")
+
+        self.assertEqual(set(urls), {"https://cdn.example/abc"})
+        self.assertEqual(cached_url, "https://cdn.example/abc")
+        self.assertEqual(service.bot.get_file.await_count, 1)
+        stats = service.download_url_cache.stats()
+        self.assertEqual((stats["misses"], stats["coalesced"], stats["hits"]), (1, 4, 1))
+
+        service.invalidate_download_url("abc")
+        await service.get_download_url("abc")
+        self.assertEqual(service.bot.get_file.await_count, 2)
+
+    async def _read_blob(self, cache: BlobCache, key: str) -> bytes | None:
+        cached = await cache.open_blob(key)
+        if cached is None:
+            return None
+        with cached[0] as handle:
+            return handle.read()
+
+    async def test_should_evict_least_recently_used_blobs(self):
+        cache = BlobCache(str(Path(self.temp_dir.name, "blobs")), max_bytes=10, max_file_bytes=6)
+
+        self.assertTrue(await cache.store("1:a", b"aaaa"))
+        self.assertTrue(await cache.store("2:b", b"bbbb"))
+        self.assertEqual(await self._read_blob(cache, "1:a"), b"aaaa")
+        self.assertTrue(await cache.store("3:c", b"cccc"))
+        self.assertFalse(await cache.store("4:big", b"x" * 7))
+
+        self.assertIsNone(await self._read_blob(cache, "2:b"))
+        self.assertEqual(await self._read_blob(cache, "1:a"), b"aaaa")
+        self.assertEqual(cache.total_bytes, 8)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    async def test_should_share_blob_cache_size_across_workers(self):
+        directory = str(Path(self.temp_dir.name, "blobs"))
+        # 两个实例共用同一个目录，模拟两个 worker 进程。
+        first = BlobCache(directory, max_bytes=10, max_file_bytes=6)
+        second = BlobCache(directory, max_bytes=10, max_file_bytes=6)
+
+        self.assertTrue(await first.store("1:a", b"aaaa"))
+        self.assertTrue(await second.store("2:b", b"bbbb"))
+        # 在另一个进程中命中也会刷新访问顺序。
+        self.assertEqual(await self._read_blob(second, "1:a"), b"aaaa")
+        # 本进程累计的大小未超出容量时不扫描目录；超出后按目录的实际占用淘汰。
+        with patch.object(BlobCache, "_scan_and_evict", wraps=first._scan_and_evict) as scan:
+            self.assertTrue(await first.store("3:c", b"cc"))
+            scan.assert_not_called()
+            self.assertTrue(await first.store("4:d", b"dddddd"))
+            scan.assert_called_once()
+
+        # 扫描计入了另一个进程写入的 2:b，按访问顺序淘汰 2:b 与 1:a。
+        self.assertEqual(first.stats()["total_bytes"], 8)
+        self.assertIsNone(await self._read_blob(second, "2:b"))
+        self.assertIsNone(await self._read_blob(second, "1:a"))
+        self.assertEqual(await self._read_blob(second, "4:d"), b"dddddd")
+        self.assertEqual(sum(path.stat().st_size for path in Path(directory).iterdir()), 8)
+
+    async def test_should_serve_cached_blob_evicted_after_lookup(self):
+        from app.api.routes import _build_cached_file_response
+
+        cache = BlobCache(str(Path(self.temp_dir.name, "blobs")), max_bytes=100, max_file_bytes=100)
+        await cache.store("1:a", b"0123456789")
+
+        cached = await cache.open_blob("1:a")
+        # 其他 worker 在查找之后淘汰了文件，已打开的描述符仍可完整读出。
+        os.unlink(cache.path_for("1:a"))
+        response = _build_cached_file_response(cached, "bytes=2-5", {})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(await self._read_body(response), b"2345")
+        self.assertTrue(cached[0].closed)
+        self.assertIsNone(await cache.open_blob("1:a"))
+
+    async def test_should_not_cache_incomplete_blob_stream(self):
+        cache = BlobCache(str(Path(self.temp_dir.name, "blobs")), max_bytes=100, max_file_bytes=100)
+
+        writer = await cache.open_writer("1:a", expected_size=10)
+        await writer.write(b"12345")
+
+        self.assertFalse(await writer.commit())
+        self.assertIsNone(await cache.open_blob("1:a"))
+        self.assertEqual(list(Path(cache.directory).iterdir()), [])
+
     async def test_should_prefetch_next_chunk_url_during_download(self):
         from app.api.routes import stream_chunks
 
@@ -143,6 +1067,556 @@ class PerformanceTests(unittest.IsolatedAsyncioTestCase):
         self.assertTrue(second_url_requested.is_set())
         self.assertEqual(chunks, [b"chunk"])
 
+    def test_should_map_byte_range_onto_chunks(self):
+        self.assertEqual(parse_range_header("bytes=5-14", 25), (5, 14))
+        self.assertEqual(parse_range_header("bytes=-3", 25), (22, 24))
+        self.assertEqual(parse_range_header("bytes=20-99", 25), (20, 24))
+        self.assertIsNone(parse_range_header("bytes=0-1,4-5", 25))
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header("bytes=25-", 25)
+
+        self.assertEqual(split_range_across_chunks([10, 10, 5], 5, 14), (0, 5, 1, 4))
+        self.assertEqual(split_range_across_chunks([10, 10, 5], 22, 24), (2, 2, 2, 4))
+
+    def test_should_answer_not_modified_for_matching_etag(self):
+        headers = build_validator_headers("1:abc", "2026-01-01 00:00:00")
+
+        self.assertTrue(is_not_modified({"if-none-match": headers["ETag"]}, headers))
+        self.assertFalse(is_not_modified({"if-none-match": '"other"'}, headers))
+        self.assertTrue(
+            is_not_modified({"if-modified-since": "Thu, 01 Jan 2026 00:00:00 GMT"}, headers)
+        )
+
+    async def test_should_stream_only_requested_range_of_chunks(self):
+        from app.api.routes import stream_chunks
+
+        chunk_bodies = {"https://example/a": b"0123456789", "https://example/b": b"abcdefghij"}
+        requested_ranges = []
+
+        class StreamResponse:
+            # 模拟忽略 Range 的 CDN，验证本地裁剪逻辑。
+            status_code = 200
+
+            def __init__(self, url, headers):
+                self.url = url
+                requested_ranges.append(headers.get("Range"))
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                return None
+
+            async def aiter_bytes(self):
+                body = chunk_bodies[self.url]
+                yield body[:4]
+                yield body[4:]
+
+        service = SimpleNamespace(
+            get_download_url=AsyncMock(side_effect=lambda file_id: f"https://example/{file_id}")
+        )
+        client = SimpleNamespace(
+            stream=lambda method, url, headers=None: StreamResponse(url, headers or {})
+        )
+
+        body = b"".join([
+            chunk
+            async for chunk in stream_chunks(
+                ["1:a", "2:b"],
+                service,
+                client,
+                first_chunk_offset=5,
+                last_chunk_end=2,
+            )
+        ])
+
+        self.assertEqual(body, b"56789abc")
+        self.assertEqual(requested_ranges, ["bytes=5-", "bytes=0-2"])
+
+    async def test_should_download_indexed_large_file_without_manifest_probe(self):
+        from app.api.routes import download_file
+
+        database.add_file_metadata(
+            filename="big.bin",
+            file_id="10:manifest",
+            filesize=20,
+            chunks=[("11:a", 10), ("12:b", 10)],
+        )
+        self.assertEqual(
+            [(chunk["chunk_file_id"], chunk["byte_offset"]) for chunk in database.get_file_chunks("10:manifest")],
+            [("11:a", 0), ("12:b", 10)],
+        )
+
+        chunk_bodies = {"https://example/a": b"0123456789", "https://example/b": b"abcdefghij"}
+
+        class StreamResponse:
+            status_code = 206
+
+            def __init__(self, url, headers):
+                start, _, end = headers["Range"].removeprefix("bytes=").partition("-")
+                body = chunk_bodies[url]
+                self.body = body[int(start):int(end) + 1 if end else None]
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                return None
+
+            async def aiter_bytes(self):
+                yield self.body
+
+        service = SimpleNamespace(
+            get_download_url=AsyncMock(side_effect=lambda file_id: f"https://example/{file_id}")
+        )
+        client = SimpleNamespace(
+            get=AsyncMock(side_effect=AssertionError("manifest should not be probed")),
+            stream=lambda method, url, headers=None: StreamResponse(url, headers or {}),
+        )
+        settings = SimpleNamespace(DOWNLOAD_READAHEAD_CHUNKS=0, DOWNLOAD_READAHEAD_MAX_BYTES=1024)
+
+        response = await download_file(
+            "10:manifest",
+            "big.bin",
+            SimpleNamespace(headers={"range": "bytes=8-12"}),
+            telegram_service=service,
+            client=client,
+            blob_cache=None,
+            settings=settings,
+        )
+        body = b"".join([chunk async for chunk in response.body_iterator])
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, b"89abc")
+        self.assertEqual(
+            [call.args[0] for call in service.get_download_url.await_args_list],
+            ["a", "b"],
+        )
+
+        database.delete_file_metadata("10:manifest")
+        self.assertEqual(database.get_file_chunks("10:manifest"), [])
+
+    async def test_should_return_404_before_not_modified_for_missing_file(self):
+        from fastapi import HTTPException
+
+        from app.api.routes import download_file
+
+        database.add_file_metadata(filename="a.txt", file_id="1:a", filesize=1)
+        service = SimpleNamespace(get_download_url=AsyncMock(return_value=None))
+
+        # 没有记录且 Telegram 上也不存在的文件，即使 ETag 匹配也返回 404。
+        with self.assertRaises(HTTPException) as missing:
+            await download_file(
+                "2:gone",
+                "a.txt",
+                SimpleNamespace(headers={"if-none-match": build_validator_headers("2:gone", None)["ETag"]}),
+                telegram_service=service,
+                client=None,
+                blob_cache=None,
+                settings=SimpleNamespace(),
+            )
+        self.assertEqual(missing.exception.status_code, 404)
+
+        known = database.get_file_info("1:a")
+        etag = build_validator_headers("1:a", known["upload_date"])["ETag"]
+        response = await download_file(
+            "1:a",
+            "a.txt",
+            SimpleNamespace(headers={"if-none-match": etag}),
+            telegram_service=service,
+            client=None,
+            blob_cache=None,
+            settings=SimpleNamespace(),
+        )
+        self.assertEqual(response.status_code, 304)
+        service.get_download_url.assert_awaited_once_with("gone")
+        self.assertEqual(database.flush_file_access(), 1)
+
+    def test_should_pick_smallest_thumbnail_covering_width(self):
+        photo = [
+            SimpleNamespace(file_id=f"size-{width}", width=width, height=width // 2)
+            for width in (90, 320, 800, 1280)
+        ]
+        message = SimpleNamespace(photo=photo, document=None)
+        database.add_file_metadata(
+            filename="photo_7.jpg",
+            file_id="7:size-1280",
+            filesize=100,
+            thumbnails=extract_thumbnails(message),
+        )
+
+        self.assertEqual(database.get_file_thumbnail("7:size-1280", 300)["thumb_file_id"], "size-320")
+        self.assertEqual(database.get_file_thumbnail("7:size-1280", 320)["thumb_file_id"], "size-320")
+        self.assertEqual(database.get_file_thumbnail("7:size-1280", 2000)["thumb_file_id"], "size-800")
+
+        database.delete_file_metadata("7:size-1280")
+        self.assertIsNone(database.get_file_thumbnail("7:size-1280", 300))
+
+    async def test_should_serve_thumbnail_with_immutable_cache_headers(self):
+        from app.api.routes import get_thumbnail
+
+        database.add_file_metadata(
+            filename="photo.png",
+            file_id="8:doc",
+            filesize=100,
+            thumbnails=[("thumb", 320, 240)],
+        )
+        database.add_file_metadata(filename="old.png", file_id="9:old", filesize=100)
+        service = SimpleNamespace(get_download_url=AsyncMock(return_value="https://example/thumb"))
+        client = SimpleNamespace(get=AsyncMock(return_value=SimpleNamespace(
+            status_code=200,
+            content=b"jpeg",
+            raise_for_status=lambda: None,
+        )))
+        settings = SimpleNamespace(FILE_ROUTE="/d")
+        blob_cache = BlobCache(str(Path(self.temp_dir.name, "blobs")), 1024, 1024)
+
+        for _ in range(2):
+            response = await get_thumbnail(
+                "8:doc",
+                SimpleNamespace(headers={}),
+                w=320,
+                telegram_service=service,
+                client=client,
+                blob_cache=blob_cache,
+                settings=settings,
+            )
+            self.assertEqual(response.headers["cache-control"], "public, max-age=31536000, immutable")
+        client.get.assert_awaited_once_with("https://example/thumb")
+
+        not_modified = await get_thumbnail(
+            "8:doc",
+            SimpleNamespace(headers={"if-none-match": response.headers["etag"]}),
+            w=320,
+            telegram_service=service,
+            client=client,
+            blob_cache=None,
+            settings=settings,
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+        fallback = await get_thumbnail(
+            "9:old",
+            SimpleNamespace(headers={}),
+            w=320,
+            telegram_service=service,
+            client=client,
+            blob_cache=None,
+            settings=settings,
+        )
+        self.assertEqual(fallback.status_code, 307)
+        self.assertEqual(fallback.headers["location"], "/d/9%3Aold/old.png")
+
+    async def test_should_stream_known_single_file_with_one_cdn_request(self):
+        from app.api.routes import download_file
+
+        database.add_file_metadata(filename="note.txt", file_id="7:small", filesize=10)
+        self.assertEqual(database.get_file_info("7:small")["is_manifest"], 0)
+        opened_requests = []
+
+        class StreamResponse:
+            status_code = 200
+            headers = {"content-length": "10"}
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                return None
+
+            def raise_for_status(self):
+                return None
+
+            async def aiter_bytes(self):
+                yield b"0123456789"
+
+        def stream(method, url, headers=None):
+            opened_requests.append((url, headers))
+            return StreamResponse()
+
+        service = SimpleNamespace(get_download_url=AsyncMock(return_value="https://example/small"))
+        client = SimpleNamespace(
+            get=AsyncMock(side_effect=AssertionError("known files should not be probed")),
+            stream=stream,
+        )
+
+        response = await download_file(
+            "7:small",
+            "note.txt",
+            SimpleNamespace(headers={}),
+            telegram_service=service,
+            client=client,
+            blob_cache=None,
+            settings=SimpleNamespace(),
+            download_fanout=None,
+        )
+        self.assertEqual(len(opened_requests), 1)
+        body = b"".join([chunk async for chunk in response.body_iterator])
+
+        self.assertEqual(body, b"0123456789")
+        self.assertEqual(opened_requests, [("https://example/small", {})])
+
+    async def test_should_share_one_upstream_between_concurrent_downloads(self):
+        from app.api.routes import download_file
+
+        database.add_file_metadata(filename="hot.jpg", file_id="8:hot", filesize=12)
+        opened_requests = []
+        release_body = asyncio.Event()
+
+        class StreamResponse:
+            status_code = 200
+            headers = {"content-length": "12"}
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                return None
+
+            def raise_for_status(self):
+                return None
+
+            async def aiter_bytes(self):
+                await release_body.wait()
+                for index in range(0, 12, 4):
+                    yield b"0123456789ab"[index:index + 4]
+
+        def stream(method, url, headers=None):
+            opened_requests.append((url, headers))
+            return StreamResponse()
+
+        service = SimpleNamespace(get_download_url=AsyncMock(return_value="https://example/hot"))
+        client = SimpleNamespace(stream=stream)
+        download_fanout = DownloadFanout()
+
+        responses = [
+            await download_file(
+                "8:hot",
+                "hot.jpg",
+                SimpleNamespace(headers={}),
+                telegram_service=service,
+                client=client,
+                blob_cache=None,
+                settings=SimpleNamespace(),
+                download_fanout=download_fanout,
+            )
+            for _ in range(3)
+        ]
+        release_body.set()
+        bodies = await asyncio.gather(*(
+            self._read_body(response) for response in responses
+        ))
+
+        self.assertEqual(bodies, [b"0123456789ab"] * 3)
+        self.assertEqual(opened_requests, [("https://example/hot", {})])
+        self.assertEqual(download_fanout.stats()["joins"], 2)
+
+    async def _read_body(self, response) -> bytes:
+        return b"".join([chunk async for chunk in response.body_iterator])
+
+    async def test_should_keep_fanout_leader_on_shared_upstream_past_join_window(self):
+        from app.api.routes import download_file
+
+        database.add_file_metadata(filename="big.bin", file_id="9:big", filesize=12)
+        opened_requests = []
+
+        class StreamResponse:
+            status_code = 200
+            headers = {"content-length": "12"}
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                return None
+
+            def raise_for_status(self):
+                return None
+
+            async def aiter_bytes(self):
+                for index in range(0, 12, 4):
+                    yield b"0123456789ab"[index:index + 4]
+
+        def stream(method, url, headers=None):
+            opened_requests.append((url, headers))
+            return StreamResponse()
+
+        response = await download_file(
+            "9:big",
+            "big.bin",
+            SimpleNamespace(headers={}),
+            telegram_service=SimpleNamespace(get_download_url=AsyncMock(return_value="https://example/big")),
+            client=SimpleNamespace(stream=stream),
+            blob_cache=None,
+            settings=SimpleNamespace(),
+            download_fanout=DownloadFanout(subscriber_buffer_bytes=4, join_window_bytes=4),
+        )
+        # 上游先读过补齐窗口，发起方才开始读取响应体。
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(await self._read_body(response), b"0123456789ab")
+        self.assertEqual(opened_requests, [("https://example/big", {})])
+
+    def test_should_build_download_fanout_from_injected_settings(self):
+        from app.services import download_fanout
+
+        with patch.object(download_fanout, "_download_fanout", None):
+            self.assertIsNone(
+                download_fanout.get_download_fanout(SimpleNamespace(DOWNLOAD_FANOUT_ENABLED=False))
+            )
+            settings = SimpleNamespace(DOWNLOAD_FANOUT_ENABLED=True, DOWNLOAD_FANOUT_BUFFER_BYTES=1024)
+            fanout = download_fanout.get_download_fanout(settings)
+            self.assertEqual(fanout.subscriber_buffer_bytes, 1024)
+            self.assertIs(download_fanout.get_download_fanout(settings), fanout)
+
+    async def test_should_detach_slow_fanout_subscriber_and_resume_from_offset(self):
+        data = b"abcdefghijkl"
+        resumed_offsets = []
+        release_slow = asyncio.Event()
+
+        async def upstream_body():
+            for index in range(0, len(data), 2):
+                yield data[index:index + 2]
+                await asyncio.sleep(0)
+
+        async def resume(offset):
+            resumed_offsets.append(offset)
+            yield data[offset:]
+
+        async def read_slowly(chunks):
+            received = [await anext(chunks)]
+            await release_slow.wait()
+            received.extend([chunk async for chunk in chunks])
+            return b"".join(received)
+
+        stream = DownloadFanout(
+            subscriber_buffer_bytes=4,
+            slow_consumer_grace_seconds=0.01,
+        ).create("1:hot")
+        fast_task = asyncio.create_task(self._collect(stream.subscribe(resume)))
+        slow_task = asyncio.create_task(read_slowly(stream.subscribe(resume)))
+        await asyncio.sleep(0)
+        stream.start(upstream_body())
+
+        self.assertEqual(await fast_task, data)
+        release_slow.set()
+        self.assertEqual(await slow_task, data)
+        self.assertEqual(resumed_offsets, [6])
+
+    async def _collect(self, chunks) -> bytes:
+        return b"".join([chunk async for chunk in chunks])
+
+    async def test_should_fall_back_to_http1_without_h2(self):
+        with patch("app.core.http_transport.importlib.util.find_spec", return_value=None):
+            transport = SharedHttpTransport(http2=True)
+        try:
+            self.assertFalse(transport.stats()["http2"])
+        finally:
+            await transport.aclose()
+
+    async def test_should_limit_requests_per_host_on_shared_transport(self):
+        def handler(request):
+            return httpx.Response(200, content=request.url.host.encode())
+
+        transport = SharedHttpTransport(max_connections_per_host=1, max_api_connections_per_host=1)
+        transport._pool = httpx.MockTransport(handler)
+        try:
+            async with transport.client.stream("GET", "https://cdn.example/file/bot1/a") as held:
+                with self.assertRaises(httpx.PoolTimeout):
+                    await transport.client.get(
+                        "https://cdn.example/file/bot1/b",
+                        timeout=httpx.Timeout(5.0, pool=0.05),
+                    )
+                # Bot API 调用与文件下载分开计数，下载占满名额时仍能发出。
+                api_call = await transport.client.get(
+                    "https://cdn.example/bot1/getFile",
+                    timeout=httpx.Timeout(5.0, pool=0.05),
+                )
+                self.assertEqual(api_call.content, b"cdn.example")
+                other_host = await transport.client.get("https://api.example/file/bot1/c")
+                self.assertEqual(other_host.content, b"api.example")
+                self.assertEqual(transport.stats()["active_requests_by_host"], {"cdn.example/file": 1})
+                await held.aread()
+
+            response = await transport.client.get("https://cdn.example/file/bot1/b")
+            self.assertEqual(response.content, b"cdn.example")
+            stats = transport.stats()
+            self.assertEqual((stats["requests"], stats["pool_timeouts"], stats["active_requests"]), (4, 1, 0))
+        finally:
+            await transport.aclose()
+
+    async def test_should_keep_shared_pool_open_when_bot_request_shuts_down(self):
+        transport = SharedHttpTransport()
+        transport._pool = httpx.MockTransport(lambda request: httpx.Response(200, content=b"tgstate-blob\nbig.bin\n1:a\n2:b"))
+        service = TelegramService(SimpleNamespace(BOT_TOKEN="dummy", CHANNEL_NAME="@dummy"), http_transport=transport)
+        service.get_download_url = AsyncMock(return_value="https://cdn.example/manifest")
+        try:
+            await service.bot.request.shutdown()
+            result = {"reason": ""}
+            chunk_ids = await service._fetch_remote_chunk_ids("9:manifest", "manifest", result)
+
+            self.assertEqual(chunk_ids, ["1:a", "2:b"])
+            self.assertTrue(result["is_manifest"])
+            self.assertEqual(transport.stats()["requests"], 1)
+        finally:
+            await transport.aclose()
+
+    async def test_should_read_ahead_following_chunks_in_parallel(self):
+        from app.api.routes import stream_chunks
+
+        started_urls = []
+        all_chunks_started = asyncio.Event()
+
+        class StreamResponse:
+            status_code = 200
+
+            def __init__(self, url):
+                self.url = url
+                started_urls.append(url)
+                if len(started_urls) == 3:
+                    all_chunks_started.set()
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                return None
+
+            async def aiter_bytes(self):
+                # 第一个分块要等后两个分块的请求都发出后才会返回数据。
+                if self.url.endswith("/a"):
+                    await asyncio.wait_for(all_chunks_started.wait(), timeout=1)
+                yield self.url[-1].encode()
+
+        service = SimpleNamespace(
+            get_download_url=AsyncMock(side_effect=lambda file_id: f"https://example/{file_id}")
+        )
+        client = SimpleNamespace(stream=lambda method, url, headers=None: StreamResponse(url))
+
+        body = b"".join([
+            chunk
+            async for chunk in stream_chunks(["1:a", "2:b", "3:c"], service, client, readahead_chunks=2)
+        ])
+
+        self.assertEqual(body, b"abc")
+        self.assertEqual(len(started_urls), 3)
+
+    async def test_should_block_readahead_when_buffer_is_full(self):
+        buffer = ByteBoundedBuffer(max_bytes=8)
+        await buffer.put(b"12345")
+
+        blocked_put = asyncio.create_task(buffer.put(b"6789"))
+        await asyncio.sleep(0)
+        self.assertFalse(blocked_put.done())
+        self.assertEqual(buffer.buffered_bytes, 5)
+
+        self.assertEqual(await buffer.get(), b"12345")
+        await asyncio.wait_for(blocked_put, timeout=1)
+        await buffer.close()
+
+        self.assertEqual(await buffer.get(), b"6789")
+        self.assertIsNone(await buffer.get())
+
     async def test_should_increase_reconcile_delay_for_large_file_sets(self):
         settings = SimpleNamespace(TELEGRAM_RECONCILE_INTERVAL=60)
         service = TelegramSyncService(settings)
@@ -151,6 +1625,175 @@ class PerformanceTests(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(service._get_reconcile_interval(5_000), 300)
         self.assertEqual(service._get_reconcile_interval(20_000), 900)
 
+    async def test_should_resume_history_backfill_from_checkpoint(self):
+        def build_message(message_id):
+            return SimpleNamespace(
+                id=message_id,
+                date=None,
+                photo=None,
+                document=True,
+                file=SimpleNamespace(
+                    name=f"file-{message_id}.txt",
+                    id=f"bot-{message_id}",
+                    size=message_id,
+                    mime_type="text/plain",
+                ),
+            )
+
+        channel_ids = list(range(10, 0, -1))
+        requested_options: list[dict] = []
+        fail_after: list[int | None] = [5]
+
+        async def iter_messages(_entity, offset_id=0, min_id=0):
+            requested_options.append({"offset_id": offset_id, "min_id": min_id})
+            yielded = 0
+            for message_id in channel_ids:
+                if (offset_id and message_id >= offset_id) or message_id <= min_id:
+                    continue
+                if fail_after[0] is not None and yielded == fail_after[0]:
+                    raise ConnectionError("interrupted")
+                yielded += 1
+                yield build_message(message_id)
+
+        service = TelegramSyncService(
+            SimpleNamespace(TELEGRAM_RECONCILE_INTERVAL=60, MANIFEST_RESOLVE_CONCURRENCY=4)
+        )
+        service.client = SimpleNamespace(iter_messages=iter_messages)
+        service.channel_entity = object()
+
+        with patch("app.services.telegram_sync_service.HISTORY_SYNC_BATCH_SIZE", 2):
+            with self.assertRaises(ConnectionError):
+                await service.sync_history_once()
+            self.assertEqual(database.count_files(), 4)
+
+            fail_after[0] = None
+            self.assertEqual(await service.sync_history_once(), 6)
+            channel_ids.insert(0, 11)
+            self.assertEqual(await service.sync_history_once(), 1)
+
+        self.assertEqual(
+            requested_options,
+            [{"offset_id": 0, "min_id": 0}, {"offset_id": 7, "min_id": 0}, {"offset_id": 0, "min_id": 10}],
+        )
+        self.assertEqual(database.count_files(), 11)
+        self.assertEqual(database.get_sync_state(), {"history_high_water_id": 11})
+
+    async def test_should_resolve_manifests_concurrently_and_wait_out_flood(self):
+        from telethon.errors import FloodWaitError
+
+        manifest_ids = [40, 30, 20, 10]
+        in_flight = 0
+        peak_in_flight = 0
+        flood_raised = False
+
+        def build_manifest_message(message_id):
+            return SimpleNamespace(
+                id=message_id,
+                date=None,
+                photo=None,
+                document=True,
+                file=SimpleNamespace(name=f"big-{message_id}.bin.manifest", id=f"bot-{message_id}", size=1),
+            )
+
+        async def iter_messages(_entity, offset_id=0, min_id=0):
+            for message_id in manifest_ids:
+                yield build_manifest_message(message_id)
+
+        async def download_media(message, _target):
+            nonlocal in_flight, peak_in_flight, flood_raised
+            if message.id == 30 and not flood_raised:
+                flood_raised = True
+                raise FloodWaitError(request=None, capture=1)
+            in_flight += 1
+            peak_in_flight = max(peak_in_flight, in_flight)
+            await asyncio.sleep(0.05)
+            in_flight -= 1
+            return f"tgstate-blob\nbig-{message.id}.bin\n{message.id - 2}:a\n{message.id - 1}:b".encode()
+
+        async def get_messages(_entity, ids):
+            return [SimpleNamespace(id=message_id, file=SimpleNamespace(size=100)) for message_id in ids]
+
+        service = TelegramSyncService(
+            SimpleNamespace(TELEGRAM_RECONCILE_INTERVAL=60, MANIFEST_RESOLVE_CONCURRENCY=4)
+        )
+        service.client = SimpleNamespace(
+            iter_messages=iter_messages,
+            download_media=download_media,
+            get_messages=get_messages,
+        )
+        service.channel_entity = object()
+
+        self.assertEqual(await service.sync_history_once(), 4)
+
+        self.assertGreater(peak_in_flight, 1)
+        stats = service.last_manifest_resolve_stats
+        self.assertEqual(stats["resolved"], 4)
+        self.assertEqual(stats["flood_waits"], 1)
+        self.assertGreater(stats["effective_concurrency"], 1)
+        # 上传时间相同按 id 倒序，写入顺序与扫描顺序一致时结果正好反过来。
+        self.assertEqual(
+            [item["filename"] for item in database.get_files_page(limit=10, offset=0)],
+            ["big-10.bin", "big-20.bin", "big-30.bin", "big-40.bin"],
+        )
+        self.assertEqual(database.get_file_info("30:bot-30")["filesize"], 200)
+        self.assertEqual(
+            [(chunk["chunk_file_id"], chunk["byte_offset"]) for chunk in database.get_file_chunks("30:bot-30")],
+            [("28:a", 0), ("29:b", 100)],
+        )
+
+    def test_should_rotate_reconcile_slice_and_prioritize_accessed_files(self):
+        for index in range(1, 6):
+            database.add_file_metadata(
+                filename=f"file-{index}.txt",
+                file_id=f"{index}:id-{index}",
+                filesize=index,
+                upload_date=f"2026-01-0{index}T00:00:00",
+            )
+
+        first_slice = database.get_reconcile_slice(2)
+        self.assertEqual([row["message_id"] for row in first_slice], [5, 4])
+        database.mark_files_verified([5, 4], verified_at=100)
+        second_slice = database.get_reconcile_slice(2)
+        self.assertEqual([row["message_id"] for row in second_slice], [3, 2])
+        database.mark_files_verified([3, 2, 1], verified_at=200)
+
+        database.record_file_access("4:id-4")
+        self.assertEqual(database.flush_file_access(), 1)
+        prioritized = database.get_reconcile_slice(2, priority_limit=1, accessed_since=0)
+
+        self.assertEqual([row["message_id"] for row in prioritized], [4, 5])
+
+    async def test_should_reconcile_one_bounded_slice_per_tick(self):
+        for index in range(1, 251):
+            database.add_file_metadata(
+                filename=f"file-{index}.txt",
+                file_id=f"{index}:id-{index}",
+                filesize=index,
+            )
+
+        requested_batches: list[list[int]] = []
+
+        async def get_messages(_entity, ids):
+            requested_batches.append(list(ids))
+            return [None if message_id == 250 else SimpleNamespace(id=message_id) for message_id in ids]
+
+        settings = SimpleNamespace(
+            TELEGRAM_RECONCILE_INTERVAL=60,
+            TELEGRAM_RECONCILE_SWEEP_WINDOW=120,
+        )
+        service = TelegramSyncService(settings)
+        service.client = SimpleNamespace(get_messages=get_messages)
+        service.channel_entity = object()
+
+        with patch("app.services.telegram_sync_service.publish_files_deleted", AsyncMock()):
+            removed = await service.reconcile_once()
+
+        self.assertEqual(removed, 1)
+        self.assertEqual([len(batch) for batch in requested_batches], [100, 100])
+        self.assertIsNone(database.get_file_info("250:id-250"))
+        remaining = database.get_reconcile_slice(50)
+        self.assertEqual({row["message_id"] for row in remaining}, set(range(1, 51)))
+
 
 if __name__ == "__main__":
     unittest.main()